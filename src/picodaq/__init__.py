@@ -1,5 +1,6 @@
 from .adc import AnalogIn, DigitalIn
 from .dac import AnalogOut, DigitalOut
+from .recorder import Recording
 from . import stimulus
 from .units import Hz, kHz, s, ms, V, mV, Time, Frequency
 from .errors import DeviceError
@@ -9,6 +10,7 @@ version = "0.1.4"
 
 __all__ = ["AnalogIn", "DigitalIn",
            "AnalogOut", "DigitalOut",
+           "Recording",
            "Hz", "kHz",
            "s", "ms",
            "V", "mV",
@@ -5,8 +5,12 @@ from numpy.typing import ArrayLike
 
 from .device import PicoDAQ
 from .stream import Stream, IStream
-from .units import s, ms, Frequency, Time
+from .units import s, ms, Frequency, Time, Quantity
 from .decorators import with_doc
+from .binreader import gapspans
+from .utils import transitions
+from .timebase import TimeBase
+from .decimate import Decimator
 from . import dac
 
 debug = False
@@ -24,6 +28,12 @@ class AnalogIn(IStream):
         rate: Sampling frequency for the recording
         port: Device to connect to identified by COM port
         serno: Device to connect to identified by serial number
+        background: Whether to read from the device in a background
+            thread, optionally specifying the amount of data to buffer
+        fillgaps: Whether to carry on when data are lost in transfer
+        decimate: Factor by which to downsample the data
+        decimation: Anti-aliasing filter to use when downsampling,
+            "iir" or "fir"
 
     You must specify either a single `channel` or a list of `channels`
     to record from, but not both. Any combination of analog inputs 0,
@@ -42,6 +52,33 @@ class AnalogIn(IStream):
     If you do not specify a port, the most recently opened device is
     used, or the first device on the system if none was opened before.
 
+    Normally, data are only transferred from the device while you call
+    ``read()``, so that any pause in your code (e.g., for analysis or
+    plotting) risks overflowing the device's limited buffer. If
+    `background` is set, a dedicated thread continuously transfers
+    data into a buffer on the host instead. By default, that buffer
+    holds 10 seconds of data; you may specify a different duration
+    instead of ``True``. Background reading applies to all streams on
+    the device.
+
+    Normally, losing a chunk of data in transfer (e.g., because of a
+    USB hiccup) ends the acquisition with an error. If `fillgaps` is
+    set, the acquisition carries on instead: the missing samples are
+    returned as NaN (or as -32768 if read raw), and each loss is
+    recorded in the ``gaps`` property.
+
+    If `decimate` is given, ``read()`` passes the data through an
+    anti-aliasing filter and returns only every `decimate`-th sample,
+    so that the data arrive at a reduced rate. The filter keeps its
+    state from one read to the next. See ``read()`` for how to obtain
+    the full-rate data as well. Decimation is only supported in
+    continuous mode.
+
+    The filter delays the signal by its group delay, which is
+    reported by the ``decimationdelay`` property. Time stamps of
+    decimated data are corrected for it, so that they line up with
+    those of the full-rate data.
+
     Example::
 
         with AnalogIn(channel=2, rate=30*kHz) as ai:
@@ -55,8 +92,13 @@ class AnalogIn(IStream):
                  channels: ArrayLike | None = None,
                  rate: Frequency = None,
                  port: str | None = None,
-                 serno: str | None = None):
-        super().__init__(port, rate, serno=serno)
+                 serno: str | None = None,
+                 background: bool | Time = False,
+                 fillgaps: bool = False,
+                 decimate: int = 1,
+                 decimation: str = "iir"):
+        super().__init__(port, rate, serno=serno, background=background,
+                         fillgaps=fillgaps)
 
         if channel is None:
             if channels is None:
@@ -75,6 +117,33 @@ class AnalogIn(IStream):
         self.channels = channels
         self.partial = {}
         self.partialcount = None
+        if decimate != int(decimate) or decimate < 1:
+            raise ValueError("Decimation factor must be a positive integer")
+        if decimation not in ("iir", "fir"):
+            raise ValueError("Decimation filter must be 'iir' or 'fir'")
+        self.decimate = int(decimate)
+        self.decimation = decimation
+        self._decimator = None # (reader, Decimator)
+        self._calreader = None # reader for which _gain and _offset are set
+
+    @property
+    def decimationdelay(self) -> Time:
+        """Group delay of the decimation filter
+
+        This is how much the decimated data lag behind the full-rate
+        data. Time stamps of decimated data are corrected for it. The
+        delay is zero without decimation. Only available when the
+        stream is open.
+        """
+        if not self.isopen:
+            raise ValueError("Not open")
+        if self.decimate == 1:
+            return 0 * s
+        if self._decimator is None:
+            delay = Decimator(self.decimate, 1, self.decimation).delay
+        else:
+            delay = self._decimator[1].delay
+        return Time(delay / self.dev.rate.as_("Hz"), "s")
 
     @with_doc(Stream.open)
     def open(self):
@@ -146,7 +215,10 @@ class AnalogIn(IStream):
     @with_doc(IStream.read)
     def read(self, amount: Time | int | None = None,
              raw: bool = False,
-             times: bool = False) -> np.ndarray:
+             times: bool = False,
+             out: np.ndarray | None = None,
+             dtype: np.dtype | None = None,
+             full: bool = False) -> np.ndarray:
         """The shape of the result depends on whether the `channel` or
         `channels` parameter was used at construction time. If
         `channel` was used, the result is a `T`-vector, where `T` is the
@@ -154,21 +226,136 @@ class AnalogIn(IStream):
         even if only one channel is in use.
 
         If `raw` is true, signed 16-bit values from the DAC are
-        returned.  Otherwise, readings are converted to volts and
-        returned as 32-bit floats.
+        returned.  Otherwise, readings are converted to volts, using
+        per-channel calibrations where available (see
+        ``PicoDAQ.inputcalibration()``), and returned as 32-bit
+        floats. Use `dtype` to specify another type, e.g.,
+        ``np.float64``.
+
+        If `out` is given, data are written directly into that array
+        rather than into a newly allocated one, and the part of `out`
+        that was filled is returned. It must have the shape of the
+        result, but may be longer than `amount`. If no `amount` is
+        given, `out` is filled. Either way, data are converted as they
+        are taken from the buffer, without intermediate arrays, so
+        that repeated reads need not allocate any memory.
+
+        With the `fillgaps` option, samples lost in transfer read as
+        -32768 if `raw` is true, or as NaN otherwise.
+
+        With the `decimate` option, `amount` refers to the decimated
+        data, and a read without `amount` returns the decimated
+        equivalent of at least a chunk. Raw data, `out`, and `dtype`
+        are not supported. If `full` is set, the full-rate data that
+        went into the decimated data are returned as well: the result
+        is then a pair (decimated, full), where each is an array, or
+        a (data, times) pair if `times` is set.
 
         """
-        if times:
-            data, times1 = super().read(amount, times=True)
-        else:
-            data = super().read(amount)
+        if self.decimate > 1:
+            if raw or out is not None or dtype is not None:
+                raise ValueError("Decimated data are always in volts")
+            return self._readdecimated(amount, times, full)
+        if full:
+            raise ValueError("The full option requires decimation")
+        return self._read(amount, raw, times, out, dtype)
+
+    def _read(self, amount, raw, times, out, dtype):
+        if out is not None and amount is None:
+            amount = len(out)
+        amount = self._prepareread(amount)
+        rowshape = () if self.asvector else (len(self.channels),)
+        if out is None:
+            dtype = np.dtype(dtype or (np.int16 if raw else np.float32))
+            out = np.empty((amount,) + rowshape, dtype)
+        elif out.shape[1:] != rowshape or len(out) < amount:
+            raise ValueError("Output array has wrong shape")
         if not raw:
-            data = data.astype(np.float32) * self.dev.igain + self.dev.ioffset
+            if not np.issubdtype(out.dtype, np.floating):
+                raise ValueError("Conversion to volts requires floating point")
+            if self._calreader is not self.dev.reader: # once per run
+                self._gain, self._offset \
+                    = self.dev.inputcalibration(self.channels)
+                self._calreader = self.dev.reader
+        data = out[:self._fill(out[:amount], raw)]
+        times1 = self._advance(len(data), times)
         if times:
             return data, times1
         else:
             return data
 
+    def read_into(self, buffer: np.ndarray, raw: bool = False) -> int:
+        """Read data into an existing array
+
+        Parameters:
+            buffer: Array to fill, either a `T`-vector or a `T` × `C`
+                array, depending on how the stream was constructed,
+                as for ``read()``
+            raw: Whether to store raw data from the device or convert
+                them to volts
+
+        Returns:
+            The number of scans read, which is `T` unless the
+            acquisition ends early.
+
+        This is equivalent to ``read(out=buffer, raw=raw)``.
+        """
+        return len(self.read(out=buffer, raw=raw))
+
+    def _readdecimated(self, amount, times, full):
+        if isinstance(amount, Quantity):
+            amount = round((amount * self.dev.rate).plain() / self.decimate)
+        chunk = self._prepareread(None)
+        if self.dev.params.get('nchunks', 0):
+            raise ValueError("Decimation is only supported in continuous mode")
+        if self._decimator is None or self._decimator[0] is not self.dev.reader:
+            self._decimator = (self.dev.reader,
+                               Decimator(self.decimate, len(self.channels),
+                                         self.decimation))
+        decimator = self._decimator[1]
+        if amount is None:
+            nin = max(chunk, decimator.inputsfor(1))
+        else:
+            nin = decimator.inputsfor(amount)
+        t0 = decimator.outputs
+        fulldata, fulltimes = self._read(nin, False, True, None, None)
+        rows = fulldata[:, None] if self.asvector else fulldata
+        if self.dev.gaps:
+            rows = np.nan_to_num(rows) # lost samples enter the filter as 0
+        data = decimator(rows)
+        if self.asvector:
+            data = data[:, 0]
+        if times:
+            rate = self.dev.rate.as_("Hz")
+            data = (data, TimeBase(t0, len(data), rate / self.decimate,
+                                   offset=-decimator.delay / rate))
+            fulldata = (fulldata, fulltimes)
+        if full:
+            return data, fulldata
+        return data
+
+    def _fill(self, out, raw):
+        """Fill `out` from the reader, converting on the way"""
+        reader = self.dev.reader
+        rows = out[:, None] if self.asvector else out
+        transform = None if raw else self._convert
+        got = 0
+        while got < len(out):
+            if not reader.hasadata():
+                dac._poll(self.dev)
+            if not reader.hasadata():
+                break
+            got += reader.fetchadatainto(rows[got:], transform)
+        if not raw and self.dev.gaps:
+            for first, end in gapspans(self.dev.gaps, self.dev.nscans,
+                                       self.offset, self.offset + got):
+                rows[first:end] = np.nan
+        return got
+
+    def _convert(self, src, dst):
+        np.multiply(src, self._gain, out=dst, casting="unsafe")
+        dst += self._offset
+
     def readall(self, raw: bool = False,
              times: bool = False) -> np.ndarray:
         """Read all data accumulated during ``run()``.
@@ -219,7 +406,7 @@ class AnalogIn(IStream):
                 
         if not data:
             if times:
-                return np.array([]), np.array([])
+                return np.array([]), self._advance(0, True)
             else:
                 return np.array([])
         
@@ -231,7 +418,7 @@ class AnalogIn(IStream):
         else: # continuous
             data = np.concatenate(data, 0)
             if times:
-                times1 = np.concatenate(times1, 0)
+                times1 = TimeBase.join(times1)
         if times:
             return data, times1
         else:
@@ -257,14 +444,21 @@ class DigitalIn(IStream):
     If you do not specify a port, the most recently opened device
     is used, or the first device on the system if none was opened before.
 
+    The `background` and `fillgaps` options work as for ``AnalogIn``.
+    Digital samples lost in transfer read as zero; consult ``gaps``
+    to find them.
+
     """
 
     def __init__(self, line: int | None = None,
                  lines: ArrayLike | None = None,
                  rate: Frequency | None = None,
                  port: str | None = None,
-                 serno: str | None = None):
-        super().__init__(port, rate, serno=serno)
+                 serno: str | None = None,
+                 background: bool | Time = False,
+                 fillgaps: bool = False):
+        super().__init__(port, rate, serno=serno, background=background,
+                         fillgaps=fillgaps)
  
         if line is None:
             if lines is None:
@@ -293,6 +487,7 @@ class DigitalIn(IStream):
         self.partialcount = None
         if len(lines):
             self.scanspersample = 8 // len(lines)
+        self._lastbyte = None # (reader, offset, byte) for readevents()
         
     @with_doc(Stream.open)
     def open(self):
@@ -360,6 +555,69 @@ class DigitalIn(IStream):
             return data
 
 
+    def readevents(self, amount: Time | int | None = None,
+                   times: bool = False,
+                   packed: bool = False) -> np.ndarray:
+        """Read only the changes of state
+
+        Parameters:
+            amount: Amount of data to be read, as for ``read()``
+            times: Whether to include time stamps
+            packed: Whether to also return the data in the packed
+                form of ``read(raw=True)``
+
+        Returns:
+            events — A structured array with fields "scan" (the index
+                of the scan since the start of the run), "line", and
+                "state" (the new state of the line), and "time" (in
+                seconds since start of run, or of episode in episodic
+                mode) if `times` is set.
+            data — The packed data; only if `packed` is set.
+
+        Changes are found directly in the packed data, and state is
+        kept from one call to the next, so that a change right at the
+        boundary between reads is reported exactly once. The first
+        call after the start of a run, or after reading with
+        ``read()``, reports the state of every line as a change.
+
+        For lines that change rarely, such as TTL sync signals, this
+        takes far less memory than ``read()`` and is much faster.
+
+        Example::
+
+            with DigitalIn(line=0, rate=30*kHz) as di:
+                ev = di.readevents(10*s)
+                rising = ev["scan"][ev["state"] == 1]
+
+        """
+        offset = self.offset
+        data = self.read(amount, raw=True)
+        L = len(self.lines)
+        last = None
+        if self._lastbyte is not None:
+            reader, at, byte = self._lastbyte
+            if reader is self.dev.reader and at == offset:
+                last = byte
+        bits, states = transitions(data, L, last) if L \
+            else (np.zeros(0, np.int64), np.zeros(0, np.uint8))
+        fields = [("scan", np.int64), ("line", np.uint8),
+                  ("state", np.uint8)]
+        if times:
+            fields.append(("time", np.float64))
+        events = np.empty(len(bits), fields)
+        events["scan"] = offset + bits // max(L, 1)
+        if L:
+            events["line"] = np.asarray(self.lines, np.uint8)[bits % L]
+        events["state"] = states
+        if times:
+            events["time"] = self._scantimes(events["scan"].astype(float))
+        if len(data):
+            self._lastbyte = (self.dev.reader, self.offset, int(data[-1]))
+        if packed:
+            return events, data
+        else:
+            return events
+
     def readall(self, raw: bool = False, times: bool = False) -> np.ndarray:
         """Read all data accumulated during ``run()``.
 
@@ -410,7 +668,7 @@ class DigitalIn(IStream):
 
         if not data:
             if times:
-                return np.array([]), np.array([])
+                return np.array([]), self._advance(0, True)
             else:
                 return np.array([])
 
@@ -422,7 +680,7 @@ class DigitalIn(IStream):
         else: # continuous
              data = np.concatenate(data, 0)
              if times:
-                times1 = np.concatenate(times1, 0)
+                times1 = TimeBase.join(times1)
 
         if times:
             return data, times1
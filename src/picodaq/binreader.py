@@ -1,8 +1,13 @@
 import numpy as np
 import time
+import functools
+import threading
 import logging
+from typing import List, NamedTuple, Tuple
 
 from .errors import DeviceError
+from .ringbuffer import RingBuffer
+from .telemetry import Telemetry
 
 FLAGS_BINARY = np.uint8(0x80)
 FLAGS_STIMACTIVE = np.uint8(0x01)
@@ -17,14 +22,117 @@ FLAGS_INBUF_FULL = np.uint8(0x30)
 log = logging.getLogger()
 debug = False
 
+MAXBULK = 32 # Max. number of chunks taken from the serial port at once
+
+GAPFILL = np.int16(-32768) # Raw analog value standing in for lost data
+
+
+class Gap(NamedTuple):
+    """Record of chunks lost in transfer"""
+    scan: int # number of scans acquired before the gap
+    chunks: int # number of chunks missing
+    time: float # host time (as in ``time.time()``) of detection
+
+
+def gapspans(gaps: List[Gap], nscans: int,
+             start: int, stop: int) -> List[Tuple[int, int]]:
+    """Ranges of lost scans within a window
+
+    Parameters:
+
+        gaps: gaps recorded during a run
+        nscans: number of scans per chunk
+        start, stop: the window, as scan indices since the start of the
+                     run
+
+    Returns a list of (first, end) scan ranges, relative to `start`.
+    """
+    spans = []
+    for gap in gaps:
+        first = max(gap.scan, start)
+        end = min(gap.scan + gap.chunks * nscans, stop)
+        if first < end:
+            spans.append((first - start, end - start))
+    return spans
+
+
+@functools.lru_cache(maxsize=16)
+def demuxplan(channels: tuple[int, ...], nscans: int) -> np.ndarray:
+    """Gather index for demultiplexing analog data in a chunk
+
+    Parameters:
+
+        channels: analog channels in the order the user asked for them
+        nscans: number of scans per chunk
+
+    Returns:
+
+        An (nscans, len(channels))-shaped array of indices into a
+        chunk viewed as int16, such that indexing the chunk with it
+        yields the analog data in user order.
+
+    Within a chunk, data from the leader (channels 0 and 1, or 2 and
+    3 if neither 0 nor 1 is in use) come first, followed by data from
+    the follower (channels 2 and 3). Within each group, channels are
+    interleaved in increasing order, except that a group of one
+    channel has its samples swapped pairwise.
+    """
+    if any(c in channels for c in (0, 1)):
+        groups = [[c for c in (0, 1) if c in channels],
+                  [c for c in (2, 3) if c in channels]]
+    else:
+        groups = [[c for c in (2, 3) if c in channels]]
+    scans = np.arange(nscans)
+    plan = np.zeros((nscans, len(channels)), np.intp)
+    start = 2
+    for group in groups:
+        n = len(group)
+        for k, c in enumerate(group):
+            if n == 1:
+                plan[:, channels.index(c)] = start + (scans ^ 1)
+            else:
+                plan[:, channels.index(c)] = start + n*scans + k
+        start += n*nscans
+    plan.setflags(write=False)
+    return plan
+
 
 class BinaryReader:
     """Helper class for reading binary data.
 
+    Parameters:
+
+        dev: the device to read from
+        maxchunks: capacity of the host-side buffer, in chunks, if
+                   data are to be read by a background thread
+        gaps: list to record lost chunks in, or None to treat lost
+              chunks as an error
+        recorder: ``Recorder`` to pass data to instead of buffering
+                  them for ``read()``
+
+    If `maxchunks` is given, a dedicated thread continuously drains
+    the serial port into a buffer holding up to that many chunks, and
+    ``read()`` merely waits for that thread to deliver. Otherwise,
+    ``read()`` reads from the serial port directly.
+
+    If `gaps` is given, a skip in the chunk numbers does not stop the
+    acquisition. Instead, a ``Gap`` is appended to the list, and the
+    missing scans are filled with ``GAPFILL`` for analog data and
+    zeros for digital data. Lost synchronization (a chunk that does not
+    start with a proper header) is still an error.
+
+    If `recorder` is given, chunks are handed to it as they arrive,
+    and nothing is kept for ``fetchadata()`` or ``fetchddata()``.
+
     This is a low-level class not intended for typical users.
     """
-    def __init__(self, dev: "PicoDAQ"):
+    def __init__(self, dev: "PicoDAQ", maxchunks: int | None = None,
+                 gaps: List[Gap] | None = None,
+                 recorder: "Recorder | None" = None):
         self.dev = dev
+        self.gaps = gaps
+        self.recorder = recorder
+        self.scans = 0 # number of scans stored, including gap fill
         self.setupaichannels()
         self.setupdilines()
         lines = dev._getfeedback("**BINARY")
@@ -35,11 +143,38 @@ class BinaryReader:
         self.active = True
         self.nn = 0
         self.t0 = time.time()
-        self._adata = []
-        self._ddata = []
+        self.nscans = dev.nscans
+        capacity = ((maxchunks or 0) + MAXBULK) * self.nscans
+        self._adata = RingBuffer(capacity, (self.nchannels,), np.int16)
+        if self.nlines:
+            self._ddata = RingBuffer(capacity * self.nlines // 8,
+                                     (), np.uint8)
+        else:
+            self._ddata = RingBuffer(capacity, (0,), np.uint8)
         self.lastflags = 0x85
         self.laststatus = 0
         self.lastchunkno = -1
+        self.telemetry = Telemetry(self.nscans / dev.rate.as_("Hz"))
+        if dev._nearfull:
+            self.telemetry.setcallback(*dev._nearfull)
+        self._buffer = None # reused for every read from the serial port
+        self._bulkplan = None
+
+        self.maxchunks = maxchunks
+        self.error = None # exception raised in background thread
+        if recorder:
+            recorder.begin(self)
+        self._cond = threading.Condition()
+        self._seen = 0 # chunks reported by read() in background mode
+        self._closing = False
+        self._reportedstop = False
+        self.thread = None
+        self._running = bool(maxchunks)
+        if maxchunks:
+            self.thread = threading.Thread(target=self._drain,
+                                           name="picodaq-reader",
+                                           daemon=True)
+            self.thread.start()
 
     @property
     def flags(self):
@@ -62,29 +197,20 @@ class BinaryReader:
         return self.laststatus
 
     def setupaichannels(self):
-        dest_leader = []
-        dest_follower = []
         channels = self.dev.aichannels
         if self.dev.aimask & 3:
             # leader has channels 0 and/or 1
-            if 0 in channels:
-                dest_leader.append(channels.index(0))
-            if 1 in channels:
-                dest_leader.append(channels.index(1))
-            if 2 in channels:
-                dest_follower.append(channels.index(2))
-            if 3 in channels:
-                dest_follower.append(channels.index(3))
+            leader = [c for c in (0, 1) if c in channels]
+            follower = [c for c in (2, 3) if c in channels]
         else:
-            if 2 in channels:
-                dest_leader.append(channels.index(2))
-            if 3 in channels:
-                dest_leader.append(channels.index(3))
-        self.destleader = dest_leader
-        self.destfollower = dest_follower
-        self.nleader = len(dest_leader)
-        self.nfollower = len(dest_follower)
+            leader = [c for c in (2, 3) if c in channels]
+            follower = []
+        self.destleader = [channels.index(c) for c in leader]
+        self.destfollower = [channels.index(c) for c in follower]
+        self.nleader = len(leader)
+        self.nfollower = len(follower)
         self.nchannels = self.nleader + self.nfollower
+        self.demux = demuxplan(tuple(channels), self.dev.nscans)
 
     def setupdilines(self):
         self.nlines = len(self.dev.dilines)
@@ -92,12 +218,14 @@ class BinaryReader:
     def storeadata(self, data):
         if debug:
             log.debug(f"storeadata {data.shape} {data.dtype}")
-        self._adata.append(data)
+        with self._cond:
+            self._adata.put(data)
         
     def storeddata(self, data):
         if debug:
             log.debug(f"storeddata {data.shape} {data.dtype}")
-        self._ddata.append(data)
+        with self._cond:
+            self._ddata.put(data)
 
     def hasadata(self):
         return len(self._adata) > 0
@@ -106,24 +234,39 @@ class BinaryReader:
         return len(self._ddata) > 0
 
     def fetchadata(self, maxn=None):
-        if maxn and maxn < len(self._adata[0]):
-            res = self._adata[0][:maxn]
-            self._adata[0] = self._adata[0][maxn:]
+        """Take up to `maxn` scans of analog data from the buffer
+
+        If `maxn` is not given, takes up to one chunk's worth.
+        """
+        with self._cond:
+            res = self._adata.get(maxn or self.nscans)
+            self._cond.notify_all()
             return res
-        else:
-            return self._adata.pop(0)
+
+    def fetchadatainto(self, out, transform=None):
+        """Take analog data from the buffer into `out`
+
+        Returns the number of scans taken, which may be fewer than
+        fit. See ``RingBuffer.getinto()`` for `transform`.
+        """
+        with self._cond:
+            n = self._adata.getinto(out, transform)
+            self._cond.notify_all()
+            return n
 
     def fetchddata(self, maxn=None):
-        if maxn:
-            if self.nlines:
-                maxb = maxn * self.nlines // 8
-            else:
-                maxb = maxn
-            if maxb < len(self._ddata[0]):
-                res = self._ddata[0][:maxb]
-                self._ddata[0] = self._ddata[0][maxb:]
-                return res
-        return self._ddata.pop(0)
+        """Take up to `maxn` scans of digital data from the buffer
+
+        Data are returned as packed bytes. If `maxn` is not given,
+        takes up to one chunk's worth.
+        """
+        maxn = maxn or self.nscans
+        if self.nlines:
+            maxn = maxn * self.nlines // 8
+        with self._cond:
+            res = self._ddata.get(maxn)
+            self._cond.notify_all()
+            return res
 
     def dump(self, data, ashex=True):
         if len(data)==0:
@@ -148,86 +291,213 @@ class BinaryReader:
 
     def read(self):
         """
-        Read a single chunk of raw data from device into buffer
+        Read raw data from device into buffer
+
+        This reads at least one chunk, or more if more are already
+        waiting in the serial port's buffer.
+
+        In background mode, this instead waits until the background
+        thread has delivered at least one chunk since the previous
+        call and data are available, and raises any error that the
+        thread encountered once all data before the error have been
+        delivered.
         """
+        if self.thread:
+            return self._awaitchunk()
         if not self.active:
             #if self.dev.params["stop"] != "ok":
             #    raise DeviceError("Stopped with error")
             raise DeviceError("Not active")
-        data = []
-        n = 0
-        while len(data) < self.blocksperchunk:
+        return self._readchunk()
+
+    def _readchunk(self):
+        cb = 64 * self.blocksperchunk
+        if self._buffer is None:
+            self._buffer = bytearray(cb * MAXBULK)
+        view = memoryview(self._buffer)
+        nchunks = 1
+        if not self._closing:
+            nchunks = max(1, min(MAXBULK, self.dev._inwaiting() // cb))
+        want = nchunks * cb
+        got = 0
+        nextb = 0 # next chunk boundary to check for the stop marker
+        while got < want:
             if debug:
                 dt = time.time() - self.t0
-                log.debug(f"> {dt:.3f} read {self.nn} {n}")
-            x = self.dev.ser.read(64)
-            if debug:
-                if n==0:
-                    self.dump(x)
-            if n==0 and x.startswith(b"**ASCII"):
-                self.active = False
-                if debug:
-                    self.dump(x, False)
-                self.dev._ungets(x)
-                return self.dev._handlestop(True)
-            elif len(x)==64:
-                data.append(x)
-                n += 1
-            elif len(x)>0:
-                for y in data:
-                    self.dump(y)
-                self.dump(x)
-                raise DeviceError("Broken data block")
-        self.nn += 1
-        self.parsedata(data)
+                log.debug(f"> {dt:.3f} read {self.nn} {got}")
+            if got==0 and self._closing:
+                # Don't wait for a full chunk if the stop marker comes
+                x = self.dev._readuntil(b"**ASCII", cb)
+                n = len(x)
+                view[:n] = x
+            else:
+                n = self.dev._readinto(view[got:want])
+            got += n
+            while nextb + 7 <= got:
+                if view[nextb:nextb+7] == b"**ASCII":
+                    if debug:
+                        self.dump(view[nextb:got], False)
+                    self._parsechunks(view, nextb // cb)
+                    self.active = False
+                    self.dev._ungets(bytes(view[nextb:got]))
+                    return self.dev._handlestop(not self._closing)
+                nextb += cb
+        if debug:
+            self.dump(view[:64])
+        self._parsechunks(view, nchunks)
+
+    def _parsechunks(self, view, nchunks):
+        if nchunks:
+            self.nn += nchunks
+            self.parsedata(view[:nchunks * 64 * self.blocksperchunk])
+
+    def _buffered(self):
+        """Number of scans available from both buffers"""
+        nd = len(self._ddata)
+        if self.nlines:
+            nd = nd * 8 // self.nlines
+        return min(len(self._adata), nd)
+
+    def _drain(self):
+        """Body of the background thread"""
+        try:
+            while self.active:
+                with self._cond:
+                    full = self.maxchunks * self.nscans
+                    while self._buffered() >= full and not self._closing:
+                        self._cond.wait(0.1)
+                if self._closing:
+                    self._awaitstop()
+                    break
+                self._readchunk()
+                with self._cond:
+                    self._cond.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            with self._cond:
+                self._running = False
+                self._cond.notify_all()
+
+    def awaitscans(self, n):
+        """Wait until the background thread has taken in `n` scans
+
+        Returns early if the acquisition ends.
+        """
+        with self._cond:
+            while self.scans < n and self._running:
+                self._cond.wait()
 
-    def parsedata(self, chunk):
-        if len(chunk) == 0:
+    def _awaitchunk(self):
+        with self._cond:
+            while self.active and self._running \
+                  and (self._seen == self.nn or not self._buffered()):
+                self._cond.wait()
+            if self._seen < self.nn and self._buffered():
+                self._seen = self.nn
+                return
+        if self.error:
+            err = self.error
+            self.error = None
+            raise err
+        if self._reportedstop:
+            raise DeviceError("Not active")
+        self._reportedstop = True
+
+    def parsedata(self, chunks):
+        """Demultiplex one or more chunks into the buffers"""
+        if len(chunks) == 0:
             return
-        raw = np.concatenate([np.frombuffer(blk, np.int16)
-                              for blk in chunk])
-        # Following is unsafe: flags can be missed as they are 
-        # overwritten by next chunk
-        self.lastflags = np.uint8(raw[0] & 255)
-        self.laststatus = np.uint8(raw[0] >> 8)
-        self.lastchunkno += 1
-        if self.lastchunkno & 65535 != int(raw[1]) & 65535:
-            raise RuntimeError("Lost chunk")
+        W = 32 * self.blocksperchunk
+        raw = np.frombuffer(chunks, np.int16).reshape(-1, W)
+        nchunks = len(raw)
+        chunknos = (self.lastchunkno + 1 + np.arange(nchunks)) & 65535
+        if np.any(raw[:,1].astype(np.uint16) != chunknos):
+            if self.gaps is None:
+                raise RuntimeError("Lost chunk")
+            return self._parsegaps(raw)
+        self._store(raw)
+
+    def _parsegaps(self, raw):
+        """Parse chunks one by one, filling in for missing ones"""
+        if np.any((raw[:,0] & FLAGS_BINARY) == 0):
+            raise RuntimeError("Lost synchronization")
+        for k in range(len(raw)):
+            skip = (int(raw[k,1]) - self.lastchunkno - 1) & 65535
+            if skip:
+                self._fillgap(skip)
+            self._store(raw[k:k+1])
+
+    def _fillgap(self, nchunks):
+        N = nchunks * self.nscans
+        gap = Gap(self.scans, nchunks, time.time())
+        self.gaps.append(gap)
+        log.warning(f"Lost {nchunks} chunks after scan {self.scans}")
+        if self.recorder:
+            self.recorder.fill(gap, self.lastchunkno + 1)
+        self.lastchunkno += nchunks
+        self.scans += N
+        if self.recorder:
+            return
+        with self._cond:
+            self._adata.put(np.full((N, self.nchannels), GAPFILL))
+            if self.nlines:
+                self._ddata.put(np.zeros(N * self.nlines // 8, np.uint8))
+            else:
+                self._ddata.put(np.zeros((N,0), np.uint8))
+
+    def _store(self, raw):
+        """Demultiplex consecutive chunks into the buffers"""
+        nchunks = len(raw)
+        # Flags and status of earlier chunks are only kept in the
+        # telemetry
+        self.lastflags = int(raw[-1,0]) & 255
+        self.laststatus = (int(raw[-1,0]) >> 8) & 255
+        self.lastchunkno += nchunks
+        self.telemetry.update(raw[:,0])
 
         if debug:
             log.debug(f"<parse< flags {self.lastflags} status {self.laststatus} chunk={self.lastchunkno}")
-        N = self.dev.nscans
-        leadstart = 2
-        follstart = leadstart + N*self.nleader
-        digistart = follstart + N*self.nfollower
-        adata = np.zeros((N, self.nchannels), np.int16)
-        for k, d in enumerate(self.destleader):
-            if self.nleader == 1:
-                adata[:,d] = raw[leadstart+k:follstart].reshape(-1,2)[:,-1::-1].reshape(-1)
-            else:
-                adata[:,d] = raw[leadstart+k:follstart:self.nleader]
-        for k, d in enumerate(self.destfollower):
-            if self.destfollower == 1:
-                adata[:,d] = raw[follstart+k:digistart].reshape(-1,2)[:,-1::-1].reshape(-1)
+        N = nchunks * self.nscans
+        self.scans += N
+        if self.recorder:
+            self.recorder.put(raw)
+            return
+        digistart = 2 * (2 + self.nscans*self.nchannels) # in bytes
+        with self._cond:
+            self._adata.gather(raw.reshape(-1), self._bulkdemux(nchunks))
+            if self.nlines:
+                nbytes = self.nscans * self.nlines // 8
+                ddata = raw.view(np.uint8)[:, digistart:digistart + nbytes]
+                self._ddata.put(ddata.reshape(-1))
             else:
-                adata[:,d] = raw[follstart+k:digistart:self.nfollower]
-        self.storeadata(adata)
-        if self.nlines:
-            ddata = np.frombuffer(raw[digistart:].tobytes(), np.uint8)
-            self.storeddata(ddata[:N*self.nlines//8])
-        else:
-            self.storeddata(np.zeros((N,0), np.uint8))
-        
+                self._ddata.put(np.zeros((N,0), np.uint8))
+
+    def _bulkdemux(self, nchunks):
+        """Gather index for several consecutive chunks"""
+        N = nchunks * self.nscans
+        if self._bulkplan is None or len(self._bulkplan) < N:
+            W = 32 * self.blocksperchunk
+            M = max(nchunks, MAXBULK)
+            plan = W * np.arange(M)[:, None, None] + self.demux[None, :, :]
+            self._bulkplan = plan.reshape(M * self.nscans, self.nchannels)
+        return self._bulkplan[:N]
+
     def close(self):
         log.debug(f"binreader close {self.active}")
+        if self.thread:
+            return self._closebackground()
         if not self.active:
             return
         
         self.dev.command("stop", False)
+        return self._awaitstop()
+
+    def _awaitstop(self):
         t0 = time.time()
         n = 0
         while time.time() - t0 < 2:
-            x = self.dev.ser.read_until(b"**ASCII")
+            x = self.dev._readuntil(b"**ASCII")
             if debug:
                 self.dump(x)
             if b"**ASCII" in x:
@@ -240,3 +510,20 @@ class BinaryReader:
                 return self.dev._handlestop(False)
             n += len(x)
         raise DeviceError("Failed to stop binary acquisition")
+
+    def _closebackground(self):
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+            if self.active:
+                self.dev.command("stop", False)
+        self.thread.join(2)
+        if self.thread.is_alive():
+            raise DeviceError("Failed to stop binary acquisition")
+        if self.active:
+            # The thread died before seeing the end of binary data
+            self._awaitstop()
+        if self.error:
+            err = self.error
+            self.error = None
+            raise err
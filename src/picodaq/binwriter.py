@@ -1,18 +1,127 @@
 import numpy as np
 import time
+import threading
+import collections
 from typing import Dict, Tuple
 import logging
 
 from .utils import checksum
+from .binreader import FLAGS_STIMACTIVE, FLAGS_INBUFMASK, FLAGS_INBUF_EMPTY
 
 FLAGS_BINARY = np.uint8(0x80)
 FLAGS_LAST = np.uint8(0x04)
 
+PREFETCH = 4 # Number of chunks the feeder thread assembles ahead
+
 log = logging.getLogger()
 debug = False
 
 
+class FlowControl:
+    """Choice of the number of chunks to keep queued in the device
+
+    Parameters:
+
+        chunktime: duration of a chunk of output, in seconds
+        maxdepth: largest permissible depth, in chunks
+        mode: how to choose the depth (see below)
+
+    If `mode` is None, the depth is fixed at `maxdepth`. Otherwise,
+    the host's service intervals, i.e., the time between successive
+    opportunities to send data, are measured, and the depth is chosen
+    to cover the longest of them that is to be expected:
+
+    - If `mode` is "latency", that is the longest interval observed
+      recently. This minimizes latency without extrapolation.
+
+    - If `mode` is a number, it is the target probability of an
+      underrun per service interval. Intervals above the median are
+      modeled as exponentially distributed, and the depth covers the
+      corresponding quantile, or the observed one if that is longer.
+
+    In either case, two chunks are added for the chunk being played
+    and for the lag of the reported status. The initial depth is
+    `maxdepth` until enough intervals have been observed.
+
+    This is a low-level class not intended for typical users.
+    """
+    WINDOW = 1000 # Number of service intervals considered
+    MINGAPS = 20 # Number of service intervals needed to adapt
+
+    def __init__(self, chunktime: float, maxdepth: int,
+                 mode: str | float | None = None):
+        if mode is not None and mode != "latency" \
+           and not (isinstance(mode, (int, float)) and 0 < mode < 1):
+            raise ValueError("Flow control must be 'latency' or a probability")
+        self.chunktime = chunktime
+        self.maxdepth = max(1, maxdepth)
+        self.mode = mode
+        self.depth = self.maxdepth
+        self.gaps = collections.deque(maxlen=self.WINDOW)
+        self.lastservice = None
+        self.margin = None # lowest reported queue depth, in seconds
+
+    def service(self, status: int, now: float | None = None) -> int:
+        """Record a service opportunity and return the depth to keep
+
+        Parameters:
+
+            status: queue depth reported by the device
+            now: time of the service, by default ``time.monotonic()``
+        """
+        if now is None:
+            now = time.monotonic()
+        if self.lastservice is not None:
+            self.gaps.append(now - self.lastservice)
+        self.lastservice = now
+        slack = float(status * self.chunktime)
+        if self.margin is None or slack < self.margin:
+            self.margin = slack
+        if self.mode is not None and len(self.gaps) >= self.MINGAPS:
+            self.depth = self._choose()
+        return self.depth
+
+    def _choose(self) -> int:
+        gaps = np.asarray(self.gaps)
+        if self.mode == "latency":
+            worst = gaps.max()
+        else:
+            median = np.median(gaps)
+            excess = gaps[gaps > median] - median
+            scale = excess.mean() if len(excess) else 0
+            worst = median + scale * np.log(0.5 / self.mode)
+            # The model must not contradict what was actually observed
+            worst = max(worst, np.quantile(gaps, max(0, 1 - self.mode)))
+        depth = int(np.ceil(worst / self.chunktime)) + 2
+        return min(max(depth, 2), self.maxdepth)
+
+    def stats(self) -> Dict[str, float]:
+        """Measured margins
+
+        Returns a dictionary with the chosen depth (in chunks and in
+        seconds), the median and maximum service interval, and the
+        lowest queue depth reported by the device (in seconds).
+        """
+        gaps = np.asarray(self.gaps)
+        return {"depth": self.depth,
+                "latency": float(self.depth * self.chunktime),
+                "medianinterval": float(np.median(gaps)) if len(gaps) else None,
+                "maxinterval": float(gaps.max()) if len(gaps) else None,
+                "margin": self.margin}
+
+
+def _spreadtable(nlines: int) -> np.ndarray:
+    """Table that moves bit j of a byte to bit j * `nlines`"""
+    byte = np.arange(256, dtype="<u4")
+    table = np.zeros(256, "<u4")
+    for j in range(8):
+        table |= ((byte >> j) & 1) << (j * nlines)
+    return table
+
+
 class BinaryWriter:
+    MAXENCODED = 64 << 20 # Bytes of converted output to encode in advance
+
     def __init__(self, dev: "PicoDAQ", nscans: int,
                  asources: Dict[int, "Sampled"],
                  dsources: Dict[int, "Sampled"]):
@@ -26,9 +135,12 @@ class BinaryWriter:
         self.scale = {}
         self.offset = {}
         self.raw = {}
+        self.gain = {} # raw units per unit of data, or None if raw
+        self.rawoffset = {} # raw units added after scaling
         self.channels = []
         self.ddata = {}
         self.dgen = {}
+        self.draw = {}
         self.lines = []
         for c, src in asources.items():
             if src is None:
@@ -43,16 +155,24 @@ class BinaryWriter:
             self.scale[c] = src.scale
             self.offset[c] = src.offset
             self.raw[c] = src.raw
+            if src.raw:
+                self.gain[c] = None
+                self.rawoffset[c] = 0.0
+            else:
+                ogain, ooffset = dev.outputcalibration(c)
+                self.gain[c] = src.scale.as_('V') * ogain
+                self.rawoffset[c] = src.offset.as_('V') * ogain + ooffset
             self.channels.append(c)
         self.channels.sort()
         for c, src in dsources.items():
             if src is None:
                 continue
+            self.draw[c] = src.raw
             if callable(src.data):
                 self.dgen[c] = src.data() # yields an iterable
-                self.ddata[c] = next(self.dgen[c])
+                self.ddata[c] = self._tobits(c, next(self.dgen[c]))
             else:
-                self.ddata[c] = src.data
+                self.ddata[c] = self._tobits(c, src.data)
             self.lines.append(c)
         self.lines.sort()
 
@@ -67,8 +187,40 @@ class BinaryWriter:
         dchans = " ".join([f"D{c}" for c in dsources if dsources[c]])
         dev.command(f"sampled {achans} {dchans}")
 
+        # Chunks are assembled alternately in two preallocated arrays,
+        # so that the previous chunk remains intact while the next one
+        # is being prepared.
+        self._chunks = [np.empty(self.blocksperchunk*32, np.int16)
+                        for k in range(2)]
+        self._scratch = np.empty(self.nscans, np.float64)
+        self._dbits = np.zeros((self.nscans, len(self.lines)), bool)
+        self._dbytes = np.zeros(self.nscans // 8, np.uint8)
+
         self.chunkno = 0
         self.finished = False
+        self.clipped = 0 # number of analog samples that were saturated
+        self._produced = 0 # number of chunks assembled so far
+        self._prepared = collections.deque() # (chunk, islast) not yet sent
+
+        self.flow = None # FlowControl, to be set up by the device
+        self.feeder = None
+        self.feederror = None # exception raised in feeder thread
+        self.underruns = 0 # times the device reported an empty queue
+        self.lowwater = None # lowest output queue depth reported
+        self.late = 0 # status reports received with input backlog
+
+        # Finite stimuli are encoded in their entirety right away, so
+        # that sending them costs no more than a serial write. Raw
+        # data take no more memory encoded than as given; data that
+        # need converting are encoded in advance only up to
+        # MAXENCODED bytes, and chunk by chunk beyond that.
+        self._encoded = None
+        self._checksums = None
+        if not self.agen and not self.dgen:
+            nchunks = self._finitechunks()
+            allraw = all(self.raw.values()) and all(self.draw.values())
+            if allraw or nchunks*self.blocksperchunk*64 <= self.MAXENCODED:
+                self._encodeall(nchunks)
 
     @property
     def productionfinished(self):
@@ -88,20 +240,33 @@ class BinaryWriter:
         return self.finished
 
 
-    def _filladata(self, data: np.ndarray) -> Tuple[int, int]:
-        def _toraw(c, yy):
-            if debug:
-                if len(yy):
-                    log.debug(f"filla {yy.shape} {yy.dtype} {np.std(yy)}")
-                else:
-                    log.debug(f"filla {yy.shape} {yy.dtype}")
-            if self.raw[c]:
-                return yy
-            y1 = (yy * self.scale[c].as_('V')
-                  + self.offset[c].as_('V')) * self.dev.ogain
-            y1.clip(-32767, 32767)
-            return y1.astype(np.int16)
+    def _toraw(self, c: int, yy: np.ndarray, out: np.ndarray) -> None:
+        """Convert data for channel `c` to raw values, writing into `out`
+
+        Values that exceed the range of the DAC are saturated and
+        counted in ``clipped``.
+        """
+        if debug:
+            if len(yy):
+                log.debug(f"filla {yy.shape} {yy.dtype} {np.std(yy)}")
+            else:
+                log.debug(f"filla {yy.shape} {yy.dtype}")
+        gain = self.gain[c]
+        if gain is None:
+            out[:] = yy
+            return
+        y1 = self._scratch[:len(out)]
+        np.multiply(yy, gain, out=y1)
+        y1 += self.rawoffset[c]
+        if len(y1) and (y1.min() < -32767 or y1.max() > 32767):
+            nclip = np.count_nonzero(np.abs(y1) > 32767)
+            if not self.clipped:
+                log.warning(f"Output data for channel {c} out of range")
+            self.clipped += nclip
+            np.clip(y1, -32767, 32767, out=y1)
+        np.copyto(out, y1, casting="unsafe")
 
+    def _filladata(self, data: np.ndarray) -> Tuple[int, int]:
         fin = 0
         i0 = 2 # halfword offset into output data; skip header
         for k, c in enumerate(self.channels):
@@ -111,14 +276,15 @@ class BinaryWriter:
                 if debug:
                     log.debug(f"binwr {k} {c} {n0} {M}")
                 if self.adata[c] is None:
-                    data[i0:i0+M] = _toraw(c, np.array([0]))
+                    self._toraw(c, np.zeros(1), data[i0:i0+1])
+                    data[i0+1:i0+M] = data[i0]
                     fin += 1
                     i0 += M
                     n0 += M
                     break
                 else:
                     M = min(M, len(self.adata[c]))
-                    data[i0:i0+M] = _toraw(c, self.adata[c][:M])
+                    self._toraw(c, self.adata[c][:M], data[i0:i0+M])
                     n0 += M
                     i0 += M
                     if M < len(self.adata[c]):
@@ -134,36 +300,180 @@ class BinaryWriter:
                         self.adata[c] = None
         return fin, i0
 
+    def _tobits(self, c: int, yy) -> np.ndarray:
+        """Prepare a block of digital data for line `c`
+
+        Pre-packed bytes (`raw` sources) are kept packed, eight scans
+        to a byte, first scan in the least significant bit. Other data
+        are passed through.
+        """
+        if self.draw[c]:
+            return np.asarray(yy, np.uint8)
+        return np.asarray(yy)
+
+    def _dlength(self, c: int) -> int:
+        """Number of scans left in the current block for line `c`"""
+        n = len(self.ddata[c])
+        return 8*n if self.draw[c] else n
+
+    def _take(self, c: int, out: np.ndarray) -> bool:
+        """Copy the next chunk's worth of data for line `c` into `out`
+
+        For `raw` sources, `out` receives bytes, eight scans to a
+        byte; otherwise, it receives one boolean per scan. Past the
+        end of the data, `out` is zeroed.
+
+        Returns True if the line has run out of data.
+        """
+        N = len(out)
+        n0 = 0
+        while n0 < N:
+            if self.ddata[c] is None:
+                out[n0:] = 0
+                return True
+            M = min(N - n0, len(self.ddata[c]))
+            if self.draw[c]:
+                out[n0:n0+M] = self.ddata[c][:M]
+            else:
+                np.not_equal(self.ddata[c][:M], 0, out=out[n0:n0+M])
+            n0 += M
+            if M < len(self.ddata[c]):
+                self.ddata[c] = self.ddata[c][M:]
+            elif c in self.dgen:
+                try:
+                    self.ddata[c] = self._tobits(c, next(self.dgen[c]))
+                except StopIteration:
+                    self.ddata[c] = None
+            else:
+                self.ddata[c] = None
+        return False
+
     def _fillddata(self, data: np.ndarray, i0: int) -> int:
-        if not self.lines:
+        L = len(self.lines)
+        if not L:
             return 0
-        ddat = np.zeros((self.nscans, len(self.lines)), np.uint8)
+        out = data.view(np.uint8)[2*i0:2*i0 + self.nscans*L//8]
+        bits = self._dbits
+        if L == 1:
+            c = self.lines[0]
+            if self.draw[c]:
+                return int(self._take(c, out))
+            fin = self._take(c, bits[:, 0])
+            out[:] = np.packbits(bits, bitorder="little")
+            return int(fin)
+        # Scans are consecutive groups of bits, one per line, in the
+        # same order as digital input data. At the size of a chunk,
+        # packing a matrix of bits at once is quicker than merging
+        # packed lines as _encodeall() does.
         fin = 0
         for k, c in enumerate(self.lines):
-            n0 = 0
-            while n0 < self.nscans:
-                M = self.nscans - n0                
-                if self.ddata[c] is None:
-                    # ddat[n0:n0+M, k] = 0
-                    fin += 1
-                    n0 += M
-                    break
-                else:
-                    M = min(M, len(self.ddata[c]))
-                    ddat[n0:n0+M,k] = _toraw(c, self.ddata[c][:M])
-                    n0 += M
-                    if M < len(self.ddata[c]):
-                        self.ddata[c] = self.ddata[c][M:]
-                    elif c in self.dgen:
-                        self.ddata[c] = next(self.dgen[c])
-                    else:
-                        self.ddata[c] = None
-        ddat = np.packbits(ddat)
-        N = len(ddat)
-        data[i0:i0+N//2] = np.frombuffer(ddat.tobytes(), np.int16)
+            if self.draw[c]:
+                fin += self._take(c, self._dbytes)
+                bits[:, k] = np.unpackbits(self._dbytes, bitorder="little")
+            else:
+                fin += self._take(c, bits[:, k])
+        out[:] = np.packbits(bits, axis=None, bitorder="little")
         return fin
-                
-    
+
+    def _packall(self, c: int, out: np.ndarray) -> None:
+        """Pack all remaining finite data for line `c` into `out`
+
+        `out` must be long enough; the remainder is zeroed.
+        """
+        src = self.ddata[c]
+        if self.draw[c]:
+            out[:len(src)] = src
+            out[len(src):] = 0
+        else:
+            bits = np.zeros(8 * len(out), bool)
+            np.not_equal(src, 0, out=bits[:len(src)])
+            out[:] = np.packbits(bits, bitorder="little")
+        self.ddata[c] = None
+
+    @staticmethod
+    def _interleave(packed: np.ndarray) -> np.ndarray:
+        """Merge packed lines into consecutive groups of bits
+
+        `packed` has one row of bytes per line. The result holds one
+        bit per line for each scan, in the same order as digital input
+        data: the bits of each byte are spread out to every L-th
+        position, shifted into place, and merged.
+        """
+        L = len(packed)
+        if L == 1:
+            return packed[0]
+        spread = _spreadtable(L)
+        words = spread[packed[0]]
+        tmp = np.empty_like(words)
+        for k in range(1, L):
+            np.take(spread, packed[k], out=tmp)
+            tmp <<= k
+            words |= tmp
+        return words.view(np.uint8).reshape(-1, 4)[:, :L].reshape(-1)
+
+    def _assemble(self, data: np.ndarray, chunkno: int) -> bool:
+        """Fill `data` with the next chunk
+
+        Returns True if this is the last chunk.
+        """
+        data[0] = FLAGS_BINARY
+        data[1] = chunkno
+        afin, i0 = self._filladata(data)
+        dfin = self._fillddata(data, i0)
+        if afin == len(self.channels) and dfin == len(self.lines):
+            data[0] |= FLAGS_LAST
+            return True
+        return False
+
+    def _finitechunks(self) -> int:
+        """Number of chunks needed for finite data"""
+        # A source of n scans ends in chunk n // nscans. (If n is a
+        # multiple of nscans, that chunk is all padding, as with
+        # chunk-by-chunk assembly.)
+        lengths = [len(self.adata[c]) for c in self.channels] \
+            + [self._dlength(c) for c in self.lines]
+        return max(lengths, default=0) // self.nscans + 1
+
+    def _encodeall(self, nchunks: int) -> None:
+        """Encode all `nchunks` chunks of finite data in advance"""
+        self._encoded = np.zeros((nchunks, self.blocksperchunk*32), np.int16)
+        for k in range(nchunks):
+            data = self._encoded[k]
+            data[0] = FLAGS_BINARY
+            data[1] = k
+            afin, i0 = self._filladata(data)
+        if afin != len(self.channels):
+            raise RuntimeError("Encoded output does not end with its last chunk")
+        self._encoded[-1, 0] |= FLAGS_LAST
+        # Digital data are packed for all chunks at once
+        if self.lines:
+            L = len(self.lines)
+            packed = np.empty((L, nchunks * self.nscans // 8), np.uint8)
+            for k, c in enumerate(self.lines):
+                self._packall(c, packed[k])
+            out = self._encoded.view(np.uint8)
+            out[:, 2*i0:2*i0 + self.nscans*L//8] \
+                = self._interleave(packed).reshape(nchunks, -1)
+        self._checksums = checksum(self._encoded)
+
+    def _produce(self) -> Tuple[np.ndarray, bool]:
+        """Assemble the next chunk; returns the chunk and whether it is last"""
+        k = self._produced
+        self._produced += 1
+        if self._encoded is not None:
+            return self._encoded[k], k == len(self._encoded) - 1
+        data = self._chunks[k % len(self._chunks)]
+        return data, self._assemble(data, k)
+
+    def _prefetch(self) -> None:
+        """Assemble chunks ahead of time, up to the size of the pool"""
+        while len(self._prepared) < len(self._chunks) - 2:
+            if self._prepared and self._prepared[-1][1]:
+                break
+            if not self._prepared and self.finished:
+                break
+            self._prepared.append(self._produce())
+
     def sendchunk(self, pre: bool):
         """Send a single chunk of data to the device
 
@@ -184,42 +494,184 @@ class BinaryWriter:
         """
         if self.finished:
             return False
-        data = np.empty(self.blocksperchunk*32, np.int16)
-        data[0] = FLAGS_BINARY
-        data[1] = self.chunkno
-        C = len(self.channels)
-        afin, i0 = self._filladata(data)
-        L = len(self.lines)
-        dfin = self._fillddata(data, i0)
-
-        if afin == C and dfin == L:
-            data[0] |= FLAGS_LAST
-            self.finished = True
+        if self._prepared:
+            data, self.finished = self._prepared.popleft()
+        else:
+            data, self.finished = self._produce()
 
         if debug:
             self.dump(data)
             
-        if pre:
-            cmd = f"outdata {self.chunkno} {self.blocksperchunk}"
-            self.dev.command(cmd, feedback=False)
         if debug and len(data) > 50:
             log.debug(f"(outdata) {data.shape} {data[0]} {data[1]} {np.mean(data[2:49]):.3f} {np.std(data[2:49]):.3f} {np.mean(data[50:]):.3f} {np.std(data[50:]):.3f}")
-        dat = data.tobytes()
         if debug:
-            log.debug(f"binwriter write {len(dat)}")
-        self.dev.ser.write(dat)
+            log.debug(f"binwriter write {data.nbytes}")
+        with self.dev._writelock:
+            if pre:
+                cmd = f"outdata {self.chunkno} {self.blocksperchunk}"
+                self.dev.command(cmd, feedback=False)
+            self.dev._write(memoryview(data).cast("B"))
         if debug:
             log.debug("binwriter wrote")
         if pre:
-            self.dev._getfeedback("outdata")
-            chk = checksum(data)
+            # while the device calculates its own
+            if self._checksums is not None:
+                chk = self._checksums[self.chunkno]
+            else:
+                chk = checksum(data)
+            self.dev._getfeedback("+outdata")
             if f"{self.dev.params['outdata']}" != f"{chk}":
                 log.error("checksum failed {chk} != {self.dev.params['outdata']}")
                 raise ValueError("Checksum failed")
 
         self.chunkno += 1
         return not self.finished
-    
+
+    @property
+    def target(self) -> int | None:
+        """Number of chunks to keep queued in the device"""
+        return self.flow.depth if self.flow else None
+
+    def queued(self, scans: int) -> int:
+        """Upper bound on the number of chunks in the device's queue
+
+        Parameter
+
+            scans - number of scans the reader has received so far
+
+        The status the device reports lags behind what has been sent:
+        it says nothing about chunks sent after it was reported, and
+        after a bulk read it may be several chunks old. The device
+        plays one output scan for every input scan, so counting what
+        has been sent against what must have been played is a safer
+        estimate. A partially played chunk still counts as queued.
+        """
+        return self.chunkno - scans // self.nscans
+
+    def observe(self, flags: int, status: int) -> None:
+        """Take note of the flags and status reported by the device
+
+        The status is the number of chunks in the device's output
+        queue. If it reaches zero before all data have been sent, the
+        output underran.
+        """
+        if self.finished:
+            return # the queue is draining, as it should
+        if self.lowwater is None or status < self.lowwater:
+            self.lowwater = status
+        if self.flow:
+            self.flow.service(status)
+        if (flags & FLAGS_INBUFMASK) != FLAGS_INBUF_EMPTY:
+            self.late += 1
+        if status == 0 and (flags & FLAGS_STIMACTIVE) and self.chunkno:
+            if not self.underruns:
+                log.warning("Output buffer underrun")
+            self.underruns += 1
+
+    def stats(self) -> Dict[str, int]:
+        """Statistics about the output so far
+
+        Returns a dictionary with the following entries:
+
+            sent: number of chunks sent
+            clipped: number of analog samples that were out of range
+            underruns: number of times the device reported an empty
+                       output queue before all data were sent
+            lowwater: lowest output queue depth reported by the device
+            late: number of status reports that arrived while the
+                  device had a backlog of input data (so that the
+                  reported depth was out of date)
+
+        If flow control is set up, its ``stats()`` are included.
+        """
+        stats = {"sent": self.chunkno,
+                 "clipped": self.clipped,
+                 "underruns": self.underruns,
+                 "lowwater": self.lowwater,
+                 "late": self.late}
+        if self.flow:
+            stats.update(self.flow.stats())
+        return stats
+
+    def startfeeder(self, reader: "BinaryReader",
+                    prefetch: int = PREFETCH) -> None:
+        """Start a thread that keeps the device's output queue filled
+
+        Parameters:
+
+            reader: the ``BinaryReader``, which must be reading in the
+                    background
+            prefetch: number of chunks to assemble ahead of time
+
+        The thread sends a chunk whenever the queue depth, as last
+        reported by the device plus what has been sent since, falls
+        below the ``target`` set by flow control. Chunks are assembled
+        ahead of need, so that data from slow generators are ready
+        when the device asks for them. The thread keeps going, also
+        between episodes and while waiting for a trigger, until all
+        data have been sent, the acquisition ends, or
+        ``stopfeeder()`` is called.
+        """
+        if not reader.thread:
+            raise ValueError("Feeding requires background reading")
+        if not self.flow:
+            raise ValueError("Feeding requires flow control")
+        W = self.blocksperchunk * 32
+        while len(self._chunks) < prefetch + 2:
+            self._chunks.append(np.empty(W, np.int16))
+        self.reader = reader
+        self._stopfeeding = False
+        self.feeder = threading.Thread(target=self._feed,
+                                       name="picodaq-writer",
+                                       daemon=True)
+        self.feeder.start()
+
+    def _feed(self):
+        """Body of the feeder thread"""
+        reader = self.reader
+        seen = reader.nn
+        depth = self.queued(reader.scans)
+        try:
+            while not self.finished:
+                self._prefetch()
+                with reader._cond:
+                    while not self._stopfeeding and reader._running \
+                          and reader.nn == seen and depth >= self.target:
+                        reader._cond.wait(0.1)
+                    if self._stopfeeding or not reader._running:
+                        break
+                    news = reader.nn != seen
+                    seen = reader.nn
+                    flags = int(reader.lastflags)
+                    status = int(reader.laststatus)
+                    scans = reader.scans
+                if news:
+                    self.observe(flags, status)
+                    depth = self.queued(scans)
+                while depth < self.target and not self.finished:
+                    self.sendchunk(False)
+                    depth += 1
+        except Exception as e:
+            self.feederror = e
+
+    def checkfeeder(self) -> None:
+        """Raise any error that the feeder thread encountered"""
+        if self.feederror:
+            err = self.feederror
+            self.feederror = None
+            raise err
+
+    def stopfeeder(self) -> None:
+        """Stop the feeder thread, if any"""
+        if self.feeder is None:
+            return
+        with self.reader._cond:
+            self._stopfeeding = True
+            self.reader._cond.notify_all()
+        self.feeder.join()
+        self.feeder = None
+        self.checkfeeder()
+
 
     def dump(self, data, ashex=True):
         if len(data)==0:
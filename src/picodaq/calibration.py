@@ -0,0 +1,110 @@
+"""Host-side per-channel calibration
+
+The device reports a single input and a single output calibration
+("islope" and "oslope"), which apply to all channels. Where channels
+differ measurably (see ``tests/calibrate_lite_*.py``), per-channel
+calibrations may be kept on the host, in a JSON file keyed by USB
+serial number::
+
+    {"<serno>": {"islope": [[0.5, 1.2], [0.4, 0.9], ...],
+                 "oslope": [[0.1, -0.3], ...]}}
+
+Each pair has the same meaning as the device's own calibration: a
+relative gain error in parts per thousand, and an offset in
+millivolts. Either table may be omitted, and so may trailing
+channels; the device's calibration then applies.
+
+The file lives in ``$XDG_CONFIG_HOME/picodaq`` (by default
+``~/.config/picodaq``). Set the environment variable
+``PICODAQ_CALIBRATION`` to use a different file, or to an empty
+string to ignore per-channel calibrations, as when calibrating.
+"""
+
+import os
+import json
+import numpy as np
+from numpy.typing import ArrayLike
+from typing import Dict, Optional, Tuple
+
+from . import devcache
+
+NCHANNELS = 4
+
+
+def calibrationfile() -> Optional[str]:
+    """Location of the calibration file, or None if disabled"""
+    path = os.environ.get("PICODAQ_CALIBRATION")
+    if path is not None:
+        return path or None
+    base = os.environ.get("XDG_CONFIG_HOME") \
+        or os.path.join(os.path.expanduser("~"), ".config")
+    return os.path.join(base, "picodaq", "calibration.json")
+
+
+def inputconversion(vmax: float, slope: ArrayLike
+                    ) -> Tuple[np.ndarray, np.ndarray]:
+    """Gain and offset for converting raw input to volts
+
+    Parameters:
+
+        vmax: upper end of the input range, in volts
+        slope: one or more (gain error, offset) pairs, in the
+               units of the "islope" command
+
+    Returns volts per raw unit and offset in volts, such that
+    ``volts = gain * raw + offset``.
+    """
+    slope = np.asarray(slope, float)
+    return vmax * (1 - slope[..., 0]/1e3) / 32767.5, -slope[..., 1]/1e3
+
+
+def outputconversion(vmax: float, slope: ArrayLike
+                     ) -> Tuple[np.ndarray, np.ndarray]:
+    """Gain and offset for converting volts to raw output
+
+    Like ``inputconversion``, but for the "oslope" command, and
+    such that ``raw = gain * volts + offset``.
+    """
+    slope = np.asarray(slope, float)
+    gain = 32767.99 / vmax / (1 + slope[..., 0]/1e3)
+    return gain, -gain * slope[..., 1]/1e3
+
+
+def lookup(serno: Optional[str]) -> Dict[str, np.ndarray]:
+    """Per-channel calibration for a device
+
+    Returns a dictionary that may contain "islope" and "oslope"
+    tables, as arrays of shape (`n`, 2), where `n` is at most the
+    number of channels.
+    """
+    path = calibrationfile()
+    if not serno or not path:
+        return {}
+    entry = devcache.load(path).get(serno)
+    if not isinstance(entry, dict):
+        return {}
+    tables = {}
+    for key in ("islope", "oslope"):
+        if key in entry:
+            table = np.asarray(entry[key], float).reshape(-1, 2)
+            tables[key] = table[:NCHANNELS]
+    return tables
+
+
+def store(serno: str, islope: ArrayLike | None = None,
+          oslope: ArrayLike | None = None) -> None:
+    """Record per-channel calibration for a device
+
+    Tables that are not given are left as they are.
+    """
+    path = calibrationfile()
+    if not serno or not path:
+        raise ValueError("No calibration file")
+    with devcache.update(path) as entries:
+        entry = entries.get(serno)
+        if not isinstance(entry, dict):
+            entry = {}
+        for key, table in (("islope", islope), ("oslope", oslope)):
+            if table is not None:
+                entry[key] = np.asarray(table, float).reshape(-1, 2).tolist()
+        entries[serno] = entry
@@ -5,7 +5,7 @@ from typing import Optional, Iterable
 import logging
 
 from .device import PicoDAQ
-from .stream import Stream
+from .stream import Stream, BACKGROUNDBUFFER
 from .stimulus import Pulse, Train, Series, Parametrized, Sampled, TTL, Wave
 from .units import V, mV, s, ms, Hz, kHz, Time, Voltage, Frequency, Quantity
 from .decorators import with_doc
@@ -27,13 +27,14 @@ def _poll(dev, _forceqty=None):
         return True
     if not dev.writer:
         return False
-    outcnt = dev.reader.laststatus
-    if dev.aheadchunks < 128:
-        N = min(4, dev.aheadchunks - outcnt)
-    else:
-        N = min(4, 200 - outcnt)
-    # We must send multiple chunks if the writechunk is smaller than
-    # the readchunk. The limit 4 is arbitrary.
+    if dev.writer.feeder:
+        dev.writer.checkfeeder()
+        return False
+    dev.writer.observe(dev.reader.lastflags, dev.reader.laststatus)
+    # Top the queue up to the depth chosen by flow control, counting
+    # chunks the reported status does not include yet.
+    outcnt = dev.writer.queued(dev.reader.scans)
+    N = dev.writer.target - outcnt
     if _forceqty is not None:
         N = _forceqty
     if debug:
@@ -42,7 +43,6 @@ def _poll(dev, _forceqty=None):
         if debug:
             log.debug("sendchunk")
         dev.writer.sendchunk(False)
-        dev.reader.laststatus += 1
         if debug:
             log.debug("sentchunk")
         if dev.writer.finished:
@@ -82,6 +82,8 @@ class AnalogOut(Stream):
         rate: Sampling frequency for output
         port: Serial port to open
         maxahead: Max. number of samples to preload
+        flow: How to choose the amount of data kept in the device
+        feeder: Whether to send sampled data from a background thread
 
     The `rate` may be specified in Hz or kHz. When using multiple
     streams, the rates must all be the same and only need to be
@@ -99,6 +101,23 @@ class AnalogOut(Stream):
     common reason to set it explicitly is to reduce latency for
     dynamically generated "sampled" outputs.
 
+    Alternatively, `flow` lets the amount of data kept in the device
+    adapt to how promptly your code calls ``poll()`` or ``read()``
+    (or the feeder thread gets to run). With `flow` = "latency", the
+    amount is the least that would have avoided underruns recently.
+    With a number, e.g., `flow` = 1e-6, that is the target probability
+    of an underrun between successive polls. In either case, the
+    amount starts at `maxahead` and never exceeds it. The chosen
+    amount and the measured timing are reported by ``outputstats()``.
+
+    Normally, "sampled" data are only sent to the device while you
+    call ``poll()``, ``run()``, or ``read()`` on an input stream, so
+    that a pause in your code can starve the device's output
+    buffer. If `feeder` is set, a dedicated thread keeps that buffer
+    filled and evaluates data generators ahead of time instead. This
+    implies background reading (see ``AnalogIn``). Use
+    ``outputstats()`` to check for underruns.
+
     The stimuli themselves are added by calling the ``stimulus()`` or
     ``sampled()`` methods on the individual channels, which may be
     accessed using indexing syntax, as in the following example::
@@ -115,12 +134,16 @@ class AnalogOut(Stream):
                  rate: Frequency | None = None,
                  port: str | None = None,
                  maxahead: int | Time | None = None,
-                 serno: str | None = None):
+                 serno: str | None = None,
+                 flow: str | float | None = None,
+                 feeder: bool = False):
         super().__init__(port, rate, serno=serno)
         self.stimuli = {} # dict of channel to Parametrized or Sampled
         if isinstance(maxahead, Quantity):
             maxahead = int((self.dev.rate * maxahead).plain())
         self.maxahead = maxahead
+        self.flow = flow
+        self.feeder = feeder
         self.committed = False
 
     def __getitem__(self, channel: int):
@@ -158,11 +181,12 @@ class AnalogOut(Stream):
         self.stimuli[channel] = Sampled(data, scale, offset, raw)
         self.committed = False
 
-    def _Vtodigital(self, y: Voltage) -> int:
-        """Convert a voltage to a digital value.
+    def _Vtodigital(self, chan: int, y: Voltage) -> int:
+        """Convert a voltage to a digital value for a given channel.
 
         """
-        y = y.as_(V) * self.dev.ogain + self.dev.ooffset
+        gain, offset = self.dev.outputcalibration(chan)
+        y = y.as_(V) * gain + offset
         return min(max(round(y + .5), -32767), 32767)
         
 
@@ -175,33 +199,34 @@ class AnalogOut(Stream):
         return round((t * self.dev.rate).plain())
 
     def _configwave(self, chan, data, amp, pd_relscale, td_relscale):
-        bindata = data * amp.as_("V") * self.dev.ogain + self.dev.ooffset
+        gain, offset = self.dev.outputcalibration(chan)
+        bindata = data * amp.as_("V") * gain + offset
         bindata[bindata < -32767] = -32767
         bindata[bindata > 32767] = 32767
         bindata = bindata.astype(np.int16)
         pdA1 = round(pd_relscale * 256)
         tdA1 = round(td_relscale * 256)
-        self.dev.sendwave(chan, bindata)
-        self.dev.command(f"pulse A{chan} wave {chan}")
-        return pdA1, tdA1
+        slot = self.dev.loadwave(bindata)
+        return pdA1, tdA1, slot
 
     def _configstim(self, chan: int, stim: Parametrized):
+        cmds = []
         def sendcmd(cmd, *args):
             pfx = f"{cmd} A{chan}"
-            self.dev.command(pfx + "".join([f" {a}" for a in args]))
+            cmds.append(pfx + "".join([f" {a}" for a in args]))
             
         name = stim.series.train.pulse.name
         a1 = stim.series.train.pulse.amplitude1
-        A1 = self._Vtodigital(a1)
-        A2 = self._Vtodigital(stim.series.train.pulse.amplitude2)
+        A1 = self._Vtodigital(chan, a1)
+        A2 = self._Vtodigital(chan, stim.series.train.pulse.amplitude2)
         T1 = self._Ttosamples(stim.series.train.pulse.duration1)
         T2 = self._Ttosamples(stim.series.train.pulse.duration2)
         npulse = stim.series.train.pulsecount
         pulseival = self._Ttosamples(stim.series.train.pulseperiod)
         pda1 = stim.series.train.perpulse.amplitude1
-        pdA1 = self._Vtodigital(pda1)
+        pdA1 = self._Vtodigital(chan, pda1)
         pda2 = stim.series.train.perpulse.amplitude2
-        pdA2 = self._Vtodigital(pda2)
+        pdA2 = self._Vtodigital(chan, pda2)
         pdT1 = self._Ttosamples(stim.series.train.perpulse.duration1)
         pdT2 = self._Ttosamples(stim.series.train.perpulse.duration2)
         pdpival = self._Ttosamples(stim.series.train.perpulse.pulseperiod)
@@ -211,8 +236,8 @@ class AnalogOut(Stream):
         ntrain = stim.series.traincount
 
         tda1 = stim.series.pertrain.amplitude1
-        tdA1 = self._Vtodigital(tda1)
-        tdA2 = self._Vtodigital(stim.series.pertrain.amplitude2)
+        tdA1 = self._Vtodigital(chan, tda1)
+        tdA2 = self._Vtodigital(chan, stim.series.pertrain.amplitude2)
         tdT1 = self._Ttosamples(stim.series.pertrain.duration1)
         tdT2 = self._Ttosamples(stim.series.pertrain.duration2)
         tdpival = self._Ttosamples(stim.series.train.perpulse.pulseperiod)
@@ -221,15 +246,16 @@ class AnalogOut(Stream):
 
         trepeat = self._Ttosamples(stim.repeat) if stim.repeat else None
 
-        offset = self._Vtodigital(stim.offset)
+        offset = self._Vtodigital(chan, stim.offset)
 
         sendcmd("aorange", "S10")
         if name == "wave":
-            pdA1, tdA1 = self._configwave(chan,
-                                          stim.series.train.pulse.data,
-                                          a1,
-                                          (pda1/a1).plain(),
-                                          (tda1/a1).plain())
+            pdA1, tdA1, slot = self._configwave(chan,
+                                                stim.series.train.pulse.data,
+                                                a1,
+                                                (pda1/a1).plain(),
+                                                (tda1/a1).plain())
+            sendcmd("pulse", "wave", slot)
         else:
             sendcmd("pulse", name, A1, T1, A2, T2)
         sendcmd("train", npulse, pulseival)
@@ -241,13 +267,24 @@ class AnalogOut(Stream):
             sendcmd("repeat", trepeat)
         else:
             sendcmd("once")   
+        self.dev.setstim(f"A{chan}", cmds)
 
             
     @with_doc(Stream.open)
     def open(self):
+        """If the stream was constructed with the `feeder` option,
+        the device is switched to background reading."""
         self.committed = False
+        if self.feeder:
+            self.dev.feeder = True
+            if self.dev.background is None:
+                self.dev.background = BACKGROUNDBUFFER
         super().open()
 
+    @with_doc(PicoDAQ.outputstats)
+    def outputstats(self):
+        return self.dev.outputstats()
+
     @with_doc(Stream.close)
     def close(self):
         super().close()
@@ -277,21 +314,24 @@ class AnalogOut(Stream):
             return
 
         adata = {}
-        for chan in range(self.dev.info['analog_out_count']):
-            if chan in self.stimuli:
-                if isinstance(self.stimuli[chan], Parametrized):
-                    self._configstim(chan, self.stimuli[chan])
-                    adata[chan] = None
-                elif isinstance(self.stimuli[chan], Sampled):
-                    adata[chan] = self.stimuli[chan]
+        with self.dev.batch():
+            for chan in range(self.dev.info['analog_out_count']):
+                if chan in self.stimuli:
+                    if isinstance(self.stimuli[chan], Parametrized):
+                        self._configstim(chan, self.stimuli[chan])
+                        adata[chan] = None
+                    elif isinstance(self.stimuli[chan], Sampled):
+                        adata[chan] = self.stimuli[chan]
+                        self.dev.forgetstims(f"A{chan}")
+                    else:
+                        raise ValueError("Confusion about stimulus")
                 else:
-                    raise ValueError("Confusion about stimulus")
-            else:
-                self.dev.command(f"off A{chan}")
+                    self.dev.setstim(f"A{chan}", None)
         if not self.dev.verify(True):
+            self.dev.forgetstims()
             raise ValueError("Not verified")
         self.committed = True
-        self.dev.commit(adata=adata, maxahead=self.maxahead)
+        self.dev.commit(adata=adata, maxahead=self.maxahead, flow=self.flow)
 
     @with_doc(Stream.start)
     def start(self):
@@ -364,6 +404,9 @@ class DigitalOut(Stream):
     If you do not specify a port, the most recently opened device is
     used, or the first device on the system if none was opened before.
 
+    The `maxahead`, `flow`, and `feeder` options work as for
+    ``AnalogOut``.
+
     The stimuli themselves are added by calling the ``stimulus()`` or
     ``sampled()`` methods on the individual lines, which may be accessed
     using indexing syntax, as in the following example::
@@ -387,12 +430,16 @@ class DigitalOut(Stream):
                  rate: Frequency | None = None,
                  port: str | None = None,
                  maxahead: int | Time | None = None,
-                 serno: str | None = None):
+                 serno: str | None = None,
+                 flow: str | float | None = None,
+                 feeder: bool = False):
         super().__init__(port, rate, serno=serno)
         self.stimuli = {}
         if isinstance(maxahead, Quantity):
-            maxahead = (self.dev.rate * maxahead).plain()
+            maxahead = int((self.dev.rate * maxahead).plain())
         self.maxahead = maxahead # always store as samples
+        self.flow = flow
+        self.feeder = feeder
         self.committed = False
 
     def __getitem__(self, line: int):
@@ -430,6 +477,13 @@ class DigitalOut(Stream):
         self.stimuli[line] = para
         self.committed = False
 
+    def _sampled(self, line: int,
+                 data: ArrayLike | Iterable[ArrayLike],
+                 scale: Voltage = 1*V, offset: Voltage = 0*V,
+                 raw: bool = False):
+        self.stimuli[line] = Sampled(data, raw=raw)
+        self.committed = False
+
     @with_doc(AnalogOut._Ttosamples)
     def _Ttosamples(self, t: Time):
         return round((t * self.dev.rate).plain())
@@ -440,19 +494,20 @@ class DigitalOut(Stream):
         We achieve this through a zero-length TTL pulse that never gets
         sent because we define an empty train.
         """
-        self.dev.command(f"ttl D{line} 0")
-        self.dev.command(f"train D{line} 0")
-        self.dev.command(f"offset D{line} 0")
-        self.dev.command(f"once D{line}")
+        self.dev.setstim(f"D{line}", [f"ttl D{line} 0",
+                                      f"train D{line} 0",
+                                      f"offset D{line} 0",
+                                      f"once D{line}"])
 
     def _configstim(self, line, stim):
+        cmds = []
         def sendcmd(cmd, *args):
             pfx = f"{cmd} D{line}"
-            self.dev.command(pfx + "".join([f" {a}" for a in args]))
+            cmds.append(pfx + "".join([f" {a}" for a in args]))
             
         name = stim.series.train.pulse.name
         if name != "ttl":
-            self.dev.command(f"off D{line}")
+            self.dev.setstim(f"D{line}", None)
             return
         
         activelow = stim.series.train.pulse.amplitude1
@@ -486,7 +541,7 @@ class DigitalOut(Stream):
             sendcmd("repeat", trepeat)
         else:
             sendcmd("once")
-        
+        self.dev.setstim(f"D{line}", cmds)
     
     def commit(self):
         """Send all defined stimulus sequences to the device.
@@ -512,30 +567,43 @@ class DigitalOut(Stream):
             firstline = 0
             lastline = 3
         ddata = {}
-        for line in range(self.dev.info['digital_out_count']):
-            if line in self.stimuli:
-                if isinstance(self.stimuli[line], Parametrized):
-                    self._configstim(line, self.stimuli[line])
+        with self.dev.batch():
+            for line in range(self.dev.info['digital_out_count']):
+                if line in self.stimuli:
+                    if isinstance(self.stimuli[line], Parametrized):
+                        self._configstim(line, self.stimuli[line])
+                        ddata[line] = None
+                    elif isinstance(self.stimuli[line], Sampled):
+                        ddata[line] = self.stimuli[line]
+                        self.dev.forgetstims(f"D{line}")
+                    else:
+                        raise ValueError("Confusion about stimulus")
+                elif line >= firstline and line <= lastline:
                     ddata[line] = None
-                elif isinstance(self.stimuli[line], Sampled):
-                    ddata[line] = self.stimuli[line]
+                    self._confignostim(line)
                 else:
-                    raise ValueError("Confusion about stimulus")
-            elif line >= firstline and line <= lastline:
-                ddata[line] = None
-                self._confignostim(line)
-            else:
-                self.dev.command(f"off D{line}")
+                    self.dev.setstim(f"D{line}", None)
         if not self.dev.verify(True):
+            self.dev.forgetstims()
             raise ValueError("Not verified")
         self.committed = True
-        self.dev.commit(ddata=ddata, maxahead=self.maxahead)
+        self.dev.commit(ddata=ddata, maxahead=self.maxahead, flow=self.flow)
 
     @with_doc(Stream.open)
     def open(self):
+        """If the stream was constructed with the `feeder` option,
+        the device is switched to background reading."""
         self.committed = False
+        if self.feeder:
+            self.dev.feeder = True
+            if self.dev.background is None:
+                self.dev.background = BACKGROUNDBUFFER
         super().open()
 
+    @with_doc(PicoDAQ.outputstats)
+    def outputstats(self):
+        return self.dev.outputstats()
+
     @with_doc(Stream.close)
     def close(self):
         super().close()
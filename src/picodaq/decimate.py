@@ -0,0 +1,93 @@
+import numpy as np
+
+
+class Decimator:
+    """Anti-aliasing filter and downsampler for streaming data
+
+    Parameters:
+
+        factor: downsampling factor
+        nchannels: number of channels
+        ftype: "iir" for a Chebyshev type I filter (applied as
+               second-order sections), or "fir" for a Hamming-window
+               FIR filter
+        order: order of the filter; by default, 8 for "iir" and
+               30 × `factor` for "fir", as in ``scipy.signal.decimate``
+
+    Data are passed through in successive blocks of any length. The
+    filter state and the phase of the downsampling are kept from one
+    block to the next, so that the result is the same as if all data
+    had been processed at once. Output sample `k` corresponds to input
+    sample `k` × `factor`.
+
+    The FIR filter is applied in polyphase fashion: only the retained
+    outputs are computed. Unlike ``scipy.signal.decimate``, filtering
+    is causal, which delays the output by the group delay of the
+    filter. That delay is reported, in input samples, as `delay`: it
+    is exactly half the order for "fir", and the delay at low
+    frequencies for "iir", whose delay varies somewhat across the
+    passband.
+
+    This is a low-level class not intended for typical users; see the
+    `decimate` option of ``AnalogIn``.
+    """
+    def __init__(self, factor: int, nchannels: int, ftype: str = "iir",
+                 order: int | None = None):
+        from scipy import signal
+        self._signal = signal
+        if factor != int(factor) or factor < 1:
+            raise ValueError("Decimation factor must be a positive integer")
+        self.factor = int(factor)
+        self.nchannels = nchannels
+        self.ftype = ftype
+        if ftype == "iir":
+            order = order or 8
+            self.sos = signal.cheby1(order, 0.05, 0.8 / self.factor,
+                                     output="sos")
+            self.zi = np.zeros((len(self.sos), 2, nchannels))
+            self.delay = float(sum(
+                signal.group_delay((sos[:3], sos[3:]), w=[0])[1][0]
+                for sos in self.sos))
+        elif ftype == "fir":
+            order = order or 30 * self.factor
+            self.taps = signal.firwin(order + 1, 1 / self.factor,
+                                      window="hamming")[::-1].copy()
+            self.history = np.zeros((order, nchannels))
+            self.delay = order / 2
+        else:
+            raise ValueError("Filter type must be 'iir' or 'fir'")
+        self.inputs = 0 # number of input samples processed
+        self.outputs = 0 # number of output samples produced
+
+    def inputsfor(self, n: int) -> int:
+        """Number of further inputs needed to produce `n` outputs"""
+        if n <= 0:
+            return 0
+        return (-self.inputs) % self.factor + (n - 1) * self.factor + 1
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        """Filter and downsample a block of data
+
+        Parameters:
+
+            x: a `T` × `C` array
+
+        Returns:
+
+            The downsampled data, as a `T'` × `C` array of 32-bit
+            floats.
+        """
+        first = (-self.inputs) % self.factor
+        if self.ftype == "iir":
+            y, self.zi = self._signal.sosfilt(self.sos, x, axis=0,
+                                              zi=self.zi)
+            y = y[first::self.factor]
+        else:
+            buf = np.concatenate((self.history, x), 0)
+            windows = np.lib.stride_tricks.sliding_window_view(
+                buf, len(self.taps), axis=0)[first:len(x):self.factor]
+            y = windows @ self.taps
+            self.history = buf[len(buf) - len(self.history):]
+        self.inputs += len(x)
+        self.outputs += len(y)
+        return y.astype(np.float32, copy=False)
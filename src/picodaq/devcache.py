@@ -0,0 +1,151 @@
+"""On-disk cache of device information
+
+To avoid talking to a picoDAQ just to learn what it is, the responses
+to its "picodaq", "info", "islope", and "oslope" commands are kept in
+a small JSON file, keyed by USB serial number. An entry is only valid
+for the firmware version that produced it.
+
+The file lives in ``$XDG_CACHE_HOME/picodaq`` (by default
+``~/.cache/picodaq``). Set the environment variable ``PICODAQ_CACHE``
+to use a different file, or to an empty string to disable caching.
+"""
+
+import os
+import json
+import threading
+import contextlib
+import logging
+from typing import Dict, Iterator, Optional
+
+log = logging.getLogger()
+
+_lock = threading.Lock()
+
+
+def cachefile() -> Optional[str]:
+    """Location of the cache file, or None if caching is disabled"""
+    path = os.environ.get("PICODAQ_CACHE")
+    if path is not None:
+        return path or None
+    base = os.environ.get("XDG_CACHE_HOME") \
+        or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "picodaq", "devices.json")
+
+
+def _load(path: str) -> Dict[str, Dict[str, str]]:
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def _save(path: str, cache: Dict[str, Dict[str, str]]) -> None:
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(cache, f, indent=1)
+        os.replace(tmp, path)
+    except OSError as e:
+        log.debug(f"Could not write device cache: {e}")
+
+
+def load(path: str) -> Dict[str, Dict]:
+    """Contents of a JSON file of entries keyed by serial number
+
+    Returns an empty dictionary if the file is missing or unreadable.
+    Besides the device cache, this serves other per-device files, such
+    as the calibration file.
+    """
+    with _lock:
+        return _load(path)
+
+
+@contextlib.contextmanager
+def update(path: str) -> Iterator[Dict[str, Dict]]:
+    """Modify a JSON file of entries keyed by serial number
+
+    Use as::
+
+        with devcache.update(path) as entries:
+            entries[serno] = entry
+
+    Other threads cannot touch the file while the block runs. The file
+    is rewritten afterwards, unless the block raises an exception.
+    """
+    with _lock:
+        entries = _load(path)
+        yield entries
+        _save(path, entries)
+
+
+def firmware(entry: Dict[str, str]) -> str:
+    """Firmware version recorded in a cache entry"""
+    return entry["picodaq"].split(" ")[1]
+
+
+def lookup(serno: Optional[str], firmware_version: Optional[str] = None
+           ) -> Optional[Dict[str, str]]:
+    """Cached information for a device
+
+    Parameters:
+
+        serno: USB serial number of the device
+        firmware_version: if given, the firmware version the device
+                          currently reports
+
+    Returns:
+
+        A dictionary with the raw "picodaq", "info", "islope", and
+        "oslope" responses, or None if the device is not known.
+
+    If `firmware_version` is given and does not match the cache, the
+    entry is dropped.
+    """
+    path = cachefile()
+    if not serno or not path:
+        return None
+    with _lock:
+        cache = _load(path)
+        entry = cache.get(serno)
+        if entry is None:
+            return None
+        try:
+            valid = firmware_version is None \
+                or firmware(entry) == firmware_version
+        except (KeyError, IndexError, AttributeError):
+            valid = False
+        if not valid:
+            del cache[serno]
+            _save(path, cache)
+            return None
+        return entry
+
+
+def store(serno: Optional[str], entry: Dict[str, str]) -> None:
+    """Record information for a device"""
+    path = cachefile()
+    if not serno or not path:
+        return
+    with _lock:
+        cache = _load(path)
+        cache[serno] = entry
+        _save(path, cache)
+
+
+def forget(serno: Optional[str] = None) -> None:
+    """Drop a device from the cache, or all devices if none is given"""
+    path = cachefile()
+    if not path:
+        return
+    with _lock:
+        cache = _load(path)
+        if serno is None:
+            cache = {}
+        elif serno in cache:
+            del cache[serno]
+        else:
+            return
+        _save(path, cache)
@@ -1,16 +1,24 @@
 import serial
 import serial.tools.list_ports
 import time
+import threading
+import contextlib
+import hashlib
+import collections
+import concurrent.futures
 import numpy as np
 from numpy.typing import ArrayLike
-from typing import Dict, Optional, List, Iterable, Any, Tuple
+from typing import Dict, Optional, List, Iterable, Any, Tuple, Callable
 import logging
 
 from .units import Hz, kHz, ms, Time
 from .utils import NScanCalc, makemask, checksum
 from .binreader import BinaryReader
-from .binwriter import BinaryWriter
+from .binwriter import BinaryWriter, FlowControl
+from .recorder import Recorder
 from .errors import DeviceError
+from . import devcache
+from . import calibration
 
 
 log = logging.getLogger()
@@ -67,7 +75,7 @@ def picodaqheader(port: str) -> str:
     Raises exception if not a picodaq
     """
 
-    ser = serial.Serial(port, timeout=1)
+    ser = Serial(port, timeout=1)
 
     ser.write(b"picodaq\n")
     while True:
@@ -96,9 +104,20 @@ def isapicodaq(port: str) -> bool:
     try:
         header = picodaqheader(port)
         return True
-    except (serial.SerialException, ValueError):
+    except (serial.SerialException, ValueError, DeviceError):
         return False
 
+
+def _probe(port: str, serno: str) -> bool:
+    """Test whether device is a picoDAQ, and check the cache against it"""
+    try:
+        header = picodaqheader(port)
+    except (serial.SerialException, ValueError, DeviceError):
+        devcache.forget(serno)
+        return False
+    devcache.lookup(serno, header.split(" ")[1])
+    return True
+
     
 def devices() -> Dict[str, str]:
     """Enumerate the PicoDAQs connected to the computer
@@ -107,11 +126,20 @@ def devices() -> Dict[str, str]:
 
         A dictionary mapping serial port names to serial numbers
 
+    All candidate ports are probed concurrently. Cached information
+    about devices whose firmware has changed is discarded in the
+    process.
+
     See also ``find``.
     """
-    return {port: serno
-            for port, serno in picos().items()
-            if isapicodaq(port)}
+    candidates = picos()
+    if not candidates:
+        return {}
+    with concurrent.futures.ThreadPoolExecutor(len(candidates)) as pool:
+        found = pool.map(_probe, candidates.keys(), candidates.values())
+        return {port: serno
+                for (port, serno), ok in zip(candidates.items(), found)
+                if ok}
 
 
 def picodaqs() -> None:
@@ -147,6 +175,22 @@ def find(serno: str) -> str:
     raise DeviceError(f"No picoDAQ found with serial number {serno}")
 
 
+def _haskey(line: str, key: str) -> bool:
+    """True if `key` occurs in `line` as a complete word"""
+    idx = line.find(key)
+    while idx >= 0:
+        end = idx + len(key)
+        if end == len(line) or line[end] == " ":
+            return True
+        idx = line.find(key, idx + 1)
+    return False
+
+
+def _isreply(line: str, key: str) -> bool:
+    """True if `line` is the "+key ..." line that concludes a reply"""
+    return line == key or line.startswith(key + " ")
+
+
 def _vrange(vr: str) -> Tuple[float, float]:
     if vr.startswith("±"):
         vv = float(vr[1:])
@@ -200,6 +244,11 @@ class PicoDAQ:
     If no port is given, connects to the first device identified
     by ``devices()`` as a suitable candidate.
 
+    Information about the device is taken from the on-disk cache
+    (see ``devcache``) if possible, so that constructing the object
+    need not communicate with the device. The cache is checked
+    against the device's firmware version when the device is opened.
+
     You typically do not need to use this class directly. The
     ``AnalogIn``, ``DigitalIn``, ``AnalogOut``, and ``DigitalOut``
     classes can find the picoDAQ by themselves.
@@ -217,7 +266,7 @@ class PicoDAQ:
             for dev in PicoDAQ._opendevs:
                 if dev.port==port:
                     return dev
-            if isapicodaq(port):
+            if devcache.lookup(picos().get(port)) or isapicodaq(port):
                 return PicoDAQ(port)
             raise DeviceError(f"No picoDAQ found on port {port}")
         else:
@@ -238,11 +287,19 @@ class PicoDAQ:
 
         self._reset()
         
-        self._bytes = bytes()
+        self._bytes = bytearray() # received but not yet consumed
+        self._batch = None # commands queued by batch()
+        self._writelock = threading.RLock() # see _write()
         self.reader = None
         self.writer = None
         self.nscans = None # meaningfully set by open()
         self.maxahead = None
+        self.flow = None
+        self._nearfull = None # (callback, threshold) for new readers
+        self._instats = None # stats of the most recent run
+        self._outstats = None
+        self.gaps = [] # chunks lost during the current or latest run
+        self.recorder = None # Recorder for the next or current run
 
         if not port:
             ports = list(devices().keys())
@@ -254,16 +311,42 @@ class PicoDAQ:
             if port == dev.port:
                 raise DeviceError(f"A connection already exists to {port}")
         
-        self.ser = Serial(port, timeout=0.1, write_timeout=0.2)
-        log.info(f"Connected to PicoDAQ at {port}")
-        self._getinfo()
-        self.ser.close()
+        self.serno = picos().get(port)
+        cached = devcache.lookup(self.serno)
+        if cached:
+            self._parseinfo(cached)
+            self._checkfirmware = True
+        else:
+            self._connect()
+            log.info(f"Connected to PicoDAQ at {port}")
+            self._getinfo()
+            self.ser.close()
+            self._checkfirmware = False
+        self.caltables = calibration.lookup(self.serno)
+
+    def _connect(self):
+        if self.ser is None:
+            self.ser = Serial(self.port, timeout=0.1, write_timeout=0.2)
+        else:
+            self.ser.open()
 
     def _getinfo(self):
-        h1 = self.command("picodaq")[-1]
-        h2 = self.command("info")[-1]
-        self.command("islope")
-        self.command("oslope")
+        with self.batch():
+            h1 = self.command("picodaq")
+            h2 = self.command("info")
+            self.command("islope")
+            self.command("oslope")
+        entry = {"picodaq": h1[-1],
+                 "info": h2[-1]}
+        entry["islope"] = self.params["islope"]
+        entry["oslope"] = self.params["oslope"]
+        info = self._parseinfo(entry)
+        devcache.store(self.serno, entry)
+        return info
+
+    def _parseinfo(self, entry: Dict[str, str]) -> Dict[str, Any]:
+        h1 = entry["picodaq"]
+        h2 = entry["info"]
         _, vsn, ser = h1.split(" ")
         info = {"firmware": vsn,
                 "serialno": ser}
@@ -280,14 +363,16 @@ class PicoDAQ:
         info["analog_in_range_V"] = _vrange(aux["VI"])
         info["analog_out_range_V"] = _vrange(aux["VO"])
 
-        islp = [float(x) for x in self.params["islope"].split(",")]
-        oslp = [float(x) for x in self.params["oslope"].split(",")]
-        self.igain = (info["analog_in_range_V"][1]
-                      * (1 - islp[0]/1e3) / 32767.5)
-        self.ioffset = -islp[1]/1e3 # volts
-        self.ogain = (32767.99 / info["analog_out_range_V"][1]
-                      / (1 + oslp[0]/1e3))
-        self.ooffset = -self.ogain * oslp[1]/1e3
+        islp = [float(x) for x in entry["islope"].split(",")]
+        oslp = [float(x) for x in entry["oslope"].split(",")]
+        igain, ioffset = calibration.inputconversion(
+            info["analog_in_range_V"][1], islp)
+        ogain, ooffset = calibration.outputconversion(
+            info["analog_out_range_V"][1], oslp)
+        self.igain = float(igain)
+        self.ioffset = float(ioffset) # volts
+        self.ogain = float(ogain)
+        self.ooffset = float(ooffset)
         info["analog_in_rawgain_V"] = self.igain
         info["analog_in_rawoffset_V"] = self.ioffset
         info["analog_out_rawgain_perV"] = self.ogain
@@ -296,6 +381,85 @@ class PicoDAQ:
         return info
         
 
+    def inputcalibration(self, channels: Iterable[int]
+                         ) -> Tuple[np.ndarray, np.ndarray]:
+        """Conversion from raw input to volts
+
+        Parameters:
+
+            channels: analog input channels
+
+        Returns:
+
+            Vectors of gains and offsets, one per channel, such that
+            ``volts = gain * raw + offset``.
+
+        Channels that have a host-side calibration (see the
+        ``calibration`` module and ``setcalibration()``) use it;
+        others use the device-wide ``igain`` and ``ioffset``.
+        """
+        channels = np.asarray(channels, int)
+        gain = np.full(len(channels), self.igain)
+        offset = np.full(len(channels), self.ioffset)
+        table = self.caltables.get("islope")
+        if table is not None:
+            mine = channels < len(table)
+            g, o = calibration.inputconversion(
+                self.info["analog_in_range_V"][1], table[channels[mine]])
+            gain[mine] = g
+            offset[mine] = o
+        return gain, offset
+
+    def outputcalibration(self, channel: int) -> Tuple[float, float]:
+        """Conversion from volts to raw output
+
+        Parameters:
+
+            channel: analog output channel
+
+        Returns:
+
+            Gain and offset such that ``raw = gain * volts + offset``.
+
+        As for ``inputcalibration()``, a host-side calibration takes
+        precedence over the device-wide ``ogain`` and ``ooffset``.
+        """
+        table = self.caltables.get("oslope")
+        if table is None or channel >= len(table):
+            return self.ogain, self.ooffset
+        gain, offset = calibration.outputconversion(
+            self.info["analog_out_range_V"][1], table[channel])
+        return float(gain), float(offset)
+
+    def setcalibration(self, islope: ArrayLike | None = None,
+                       oslope: ArrayLike | None = None,
+                       store: bool = False) -> None:
+        """Use per-channel calibration
+
+        Parameters:
+
+            islope: (gain error, offset) pairs for each analog input
+            oslope: (gain error, offset) pairs for each analog output
+            store: whether to save the calibration in the host-side
+                   calibration file, so it is used automatically in
+                   the future
+
+        Gain errors are in parts per thousand and offsets in
+        millivolts, as in the device's own calibration. Tables that
+        are not given are left as they are. Pass an empty table to
+        revert to the device's calibration. Changes take effect when
+        the device is next started.
+        """
+        for key, table in (("islope", islope), ("oslope", oslope)):
+            if table is not None:
+                table = np.asarray(table, float).reshape(-1, 2)
+                if len(table):
+                    self.caltables[key] = table[:calibration.NCHANNELS]
+                else:
+                    self.caltables.pop(key, None)
+        if store:
+            calibration.store(self.serno, islope, oslope)
+
     def setaichannels(self, channels: Iterable[int]) -> None:
         self.aichannels = channels
         self.aimask = makemask(channels)
@@ -437,8 +601,20 @@ class PicoDAQ:
             for k, v in self.params.items():
                 log.error(f"  {k}: {v}")
             raise DeviceError("Unsupported parameters")
-        self.reader = BinaryReader(self)
+        maxchunks = None
+        if self.background is not None:
+            maxchunks = int(np.ceil((self.background * self.rate).plain()
+                                    / self.nscans))
+            maxchunks = max(2, maxchunks)
+        elif self.recorder:
+            maxchunks = 2 # Recording needs the background thread
+        self.gaps = []
+        self.reader = BinaryReader(self, maxchunks,
+                                   self.gaps if self.fillgaps else None,
+                                   self.recorder)
         self.nscans = self.params["nscans"]
+        if self.feeder and self.writer:
+            self.writer.startfeeder(self.reader)
         log.debug("params = ", self.params)
 
     def stop(self) -> None:
@@ -459,10 +635,92 @@ class PicoDAQ:
             self._stopping = False
             raise
 
+        try:
+            if self.writer:
+                self.writer.stopfeeder()
+        finally:
+            if self.reader:
+                try:
+                    self.reader.close()
+                finally:
+                    self._instats = self.reader.telemetry.stats()
+                    if self.recorder:
+                        recorder = self.recorder
+                        self.recorder = None
+                        recorder.close(self.params.get("stop"))
+                self.command("nop")
+            if self.writer:
+                self._outstats = self.writer.stats()
+            self.writer = None
+
+    def outputstats(self) -> Dict[str, int] | None:
+        """Statistics about sampled output
+
+        Returns the ``BinaryWriter.stats()`` for the current run, or
+        for the most recent run if the device is stopped, or None if
+        there has been no sampled output.
+        """
+        if self.writer:
+            return self.writer.stats()
+        return self._outstats
+
+    def stats(self) -> Dict[str, Any]:
+        """Statistics about data transfer
+
+        Returns a dictionary with entries "input" and "output". The
+        former contains the ``Telemetry.stats()`` accumulated from the
+        flags and status of every chunk of the current run (or the
+        most recent run if the device is stopped); the latter contains
+        the ``outputstats()``. Either is None if there is nothing to
+        report.
+        """
         if self.reader:
-            self.reader.close()
-            self.command("nop")
-        self.writer = None
+            instats = self.reader.telemetry.stats()
+        else:
+            instats = self._instats
+        return {"input": instats, "output": self.outputstats()}
+
+    def record(self, path: str) -> Recorder:
+        """Send data from the next run to a file instead of to ``read()``
+
+        Parameters:
+
+            path: name of the file to create
+
+        Returns:
+
+            The ``Recorder``, which may be consulted for progress
+
+        Must be called before the acquisition starts. Recording ends
+        when the acquisition is stopped. See the ``recorder`` module
+        for the file format.
+        """
+        if self.reader:
+            raise ValueError("Cannot start recording while acquiring")
+        if self.recorder:
+            self.recorder.close()
+        self.recorder = Recorder(path)
+        return self.recorder
+
+    def onnearfull(self, callback: Callable[[str, Dict[str, Any]], None]
+                   | None, threshold: str = "nearfull") -> None:
+        """Get notified when the device's input buffer fills up
+
+        Parameters:
+
+            callback: function to call, or None to stop notifications
+            threshold: "continue", "nearfull", or "full"
+
+        The `callback` is called with the name of the level reached
+        and the current ``stats()["input"]`` whenever a chunk reports
+        that the input buffer has risen to the `threshold` level.
+        This gives the opportunity to shed load (e.g., by reading more
+        often) before the device aborts the acquisition. With
+        background reading, the callback runs in the reader thread.
+        """
+        self._nearfull = (callback, threshold) if callback else None
+        if self.reader:
+            self.reader.telemetry.setcallback(callback, threshold)
 
     def __enter__(self):
         self.open()
@@ -483,7 +741,9 @@ class PicoDAQ:
         matched.
         """
         if len(self.openstreams) == 0:
-            self.ser.open()
+            self._connect()
+            if self._checkfirmware:
+                self._revalidate()
             PicoDAQ._opendevs.append(self)
         self.openstreams.add(stream)
         if self.rate is None:
@@ -493,49 +753,66 @@ class PicoDAQ:
             self._postopen()
         
 
+    def _revalidate(self):
+        """Refresh cached device information if firmware has changed"""
+        self.command("picodaq")
+        if "picodaq" not in self.params:
+            devcache.forget(self.serno)
+            self.ser.close()
+            raise DeviceError(f"No picoDAQ found on port {self.port}")
+        if not devcache.lookup(self.serno, str(self.params["picodaq"])):
+            log.info("Firmware changed; refreshing device information")
+            self._getinfo()
+        self._checkfirmware = False
+
     def _postopen(self):        
         rate_Hz = round(self.rate.as_(Hz))
-        self.command(f"rate {rate_Hz}")
-        self.command(f"aimask {self.aimask}")
-        self.command(f"dimask {self.dimask}")
-        
-        if self.trg_source is None:
-            self.command("immediate")
-        else:
-            self.command(f"trigger {self.trg_source} {self.trg_polarity}")
-            
         calc = NScanCalc(self.aimask, self.dimask)
-        if self.epi_dur is None:
-            self.command("nchunks 0")
-            nscans = calc.bestforcont()
-            self.command(f"nscans {nscans}")
-            self.nscans = self.params["nscans"] # get updated value from device
+        with self.batch():
+            self.command(f"rate {rate_Hz}")
+            self.command(f"aimask {self.aimask}")
+            self.command(f"dimask {self.dimask}")
 
-        else:
-            scansperepi = int(np.ceil((self.epi_dur * self.rate).plain()))
-            nscans = calc.bestforepi(scansperepi)
-            self.command(f"nscans {nscans}")
-            self.nscans = self.params["nscans"] # get updated value from device
-            nchunks = (scansperepi + self.nscans - 1) // nscans
-            self.command(f"nchunks {nchunks}")
-            if self.epi_per is None:
-                self.command("period 0")
+            if self.trg_source is None:
+                self.command("immediate")
             else:
-                self.command(f"period {round(self.epi_per.as_('ms'))}")
-            if self.epi_count is None:
-                self.command(f"nepis 0")
+                self.command(f"trigger {self.trg_source}"
+                             + f" {self.trg_polarity}")
+
+            if self.epi_dur is None:
+                self.command("nchunks 0")
+                nscans = calc.bestforcont()
             else:
-                self.command(f"nepis {self.epi_count}")
+                scansperepi = int(np.ceil((self.epi_dur
+                                           * self.rate).plain()))
+                nscans = calc.bestforepi(scansperepi)
+            self.command(f"nscans {nscans}")
+        self.nscans = self.params["nscans"] # get updated value from device
+
+        if self.epi_dur is not None:
+            nchunks = (scansperepi + self.nscans - 1) // nscans
+            with self.batch():
+                self.command(f"nchunks {nchunks}")
+                if self.epi_per is None:
+                    self.command("period 0")
+                else:
+                    self.command(f"period {round(self.epi_per.as_('ms'))}")
+                if self.epi_count is None:
+                    self.command(f"nepis 0")
+                else:
+                    self.command(f"nepis {self.epi_count}")
 
         if "verify" in self.params:
             del self.params["verify"]
 
 
-    def commit(self, adata=None, ddata=None, maxahead=None):
+    def commit(self, adata=None, ddata=None, maxahead=None, flow=None):
         if not self.isopen():
             raise DeviceError("Not open")
         if maxahead:
             self.maxahead = maxahead
+        if flow is not None:
+            self.flow = flow
         if self._committing:
             """This state variable allows one stream to start the commit
             process with its data, while the other stream is called from
@@ -584,6 +861,8 @@ class PicoDAQ:
         if self.maxahead:
             nchunks = max(2, min(nchunks, self.maxahead // nscans))
         self.aheadchunks = nchunks
+        self.writer.flow = FlowControl(nscans / self.rate.as_("Hz"),
+                                       nchunks, self.flow)
         if debug:
             log.debug(f"nchunks is {nchunks}")
         for k in range(nchunks):
@@ -618,6 +897,9 @@ class PicoDAQ:
                     if self.reader:
                         del self.reader
                         self.reader = None 
+                    if self.recorder: # never started
+                        self.recorder.close()
+                        self.recorder = None
                     PicoDAQ._opendevs.remove(self)
                     self.ser.close()
                     self._reset()
@@ -662,6 +944,11 @@ class PicoDAQ:
         self.epi_count = None
         self.trg_source = None
         self.trg_polarity = 0
+        self.background = None
+        self.feeder = False
+        self.fillgaps = False
+        self.forgetstims()
+        self._waves = collections.OrderedDict() # wave hash -> slot
 
     def __del__(self):
         if self.ser and self.ser.is_open:
@@ -669,22 +956,78 @@ class PicoDAQ:
             self.ser.close()
 
     def _ungets(self, bts: bytes):
-        self._bytes += bts
-
-    def _readlinesfrombytes(self):
-        if b"\n" not in self._bytes:
-            return []
-        bits = self._bytes.split(b"\n")
-        self._bytes = bits[-1]
-        lines = []
-        for bit in bits[:-1]:
-            try:
-                a = str(bit, "utf8")
-            except UnicodeDecodeError:
-                log.error(f"Unicode failure {a}")
-                a = ""
-            lines.append(a)
-        return lines
+        self._bytes[:0] = bts
+
+    def _inwaiting(self) -> int:
+        """Number of bytes that can be read without waiting"""
+        return len(self._bytes) + self.ser.in_waiting
+
+    def _read(self, size: int) -> bytes:
+        """Read up to `size` bytes, using buffered bytes first"""
+        if self._bytes:
+            res = bytes(self._bytes[:size])
+            del self._bytes[:size]
+            if len(res) == size:
+                return res
+            return res + self.ser.read(size - len(res))
+        return self.ser.read(size)
+
+    def _readinto(self, buf: memoryview) -> int:
+        """Read into `buf`, using buffered bytes first
+
+        Returns the number of bytes read, which may be less than the
+        size of `buf` even when more bytes are on their way.
+        """
+        if self._bytes:
+            n = min(len(buf), len(self._bytes))
+            buf[:n] = self._bytes[:n]
+            del self._bytes[:n]
+            return n
+        return self.ser.readinto(buf)
+
+    def _readuntil(self, expected: bytes, size: int | None = None) -> bytes:
+        """Like ``Serial.read_until``, but using buffered bytes first"""
+        if self._bytes:
+            idx = self._bytes.find(expected)
+            end = len(self._bytes) if idx < 0 else idx + len(expected)
+            if size is not None:
+                end = min(end, size)
+            res = bytes(self._bytes[:end])
+            del self._bytes[:end]
+            if idx >= 0 or len(res) == size:
+                return res
+            return res + self.ser.read_until(expected,
+                                             None if size is None
+                                             else size - len(res))
+        return self.ser.read_until(expected, size)
+
+    def _readline(self) -> bytes | None:
+        """Read a line, without its newline, or None on timeout
+
+        Reads whatever the device has sent in one go, keeping any
+        bytes after the line for later.
+        """
+        while True:
+            idx = self._bytes.find(b"\n")
+            if idx >= 0:
+                line = bytes(self._bytes[:idx])
+                del self._bytes[:idx+1]
+                return line
+            data = self.ser.read(max(1, self.ser.in_waiting))
+            if not data: # Timeout
+                return None
+            self._bytes += data
+
+    def _storeparam(self, line: str) -> None:
+        """Record the value from a "+key value" feedback line"""
+        if line[:1] == '+':
+            kv = line[1:].split(" ")
+            if len(kv) >= 2:
+                k, v = kv[:2]
+                try:
+                    self.params[k] = int(v)
+                except ValueError:
+                    self.params[k] = v
 
 
     def _handlestop(self, unexpected: bool):
@@ -720,48 +1063,33 @@ class PicoDAQ:
     def _getfeedback(self, until=None) -> List[str]:
         """Collect and return feedback from PicoDAQ device.
         
-        If UNTIL is given and not null, returns when that string
-        appears in a feedback line. Otherwise, continues to collect
-        until a gap in output of 100 ms occurs.
+        If UNTIL is given and not null, returns as soon as a feedback
+        line with that key arrives, e.g., "+rate" for "+rate 10000",
+        but not for "+ratex 1". Otherwise, continues to collect until
+        a gap in output of 100 ms occurs.
         
         Result is a (possibly empty) list of lines.
         """
-
         lines = []
         while True:
-            a = self.ser.readline()
-            if not a: # Timeout
-                if lines:
-                    return lines
-                else:
-                    return self._readlinesfrombytes()
-            if self._bytes:
-                a = self._bytes + a
-                self._bytes = bytes()
+            a = self._readline()
+            if a is None: # Timeout
+                return lines
             try:
-                a = str(a, "utf8")
+                line = str(a, "utf8")
             except UnicodeDecodeError:
                 log.error(f"Unicode failure {a}")
-                a = ""
-            a = a[:-1]
-            for line in a.split("\n"):
-                log.debug(f"{time.time() - t0:.3f} << {line}")
-                if line[:1] == '+':
-                    kv = a[1:].split(" ")
-                    if len(kv) >= 2:
-                        k, v = kv[:2]
-                        try:
-                            self.params[k] = int(v)
-                        except ValueError:
-                            self.params[k] = v
-                lines.append(line) # drop the newline
-            if until and until in a: # Key found
+                line = ""
+            log.debug(f"{time.time() - t0:.3f} << {line}")
+            self._storeparam(line)
+            lines.append(line)
+            if until and _haskey(line, until):
                 return lines
 
     def deviceinfo(self) -> Dict[str, str]:
         wasopen = self.isopen()
         if not wasopen:
-            self.ser.open()
+            self._connect()
         try:
             self.command("picodaq")
             self.command("info")
@@ -788,16 +1116,266 @@ class PicoDAQ:
         hardware API for details.
 
         If `feedback` is True, waits for and returns feedback.
-        Otherwise returns immediately and returns None.
+        Otherwise returns immediately and returns None. Errors
+        reported by the device (lines starting with "!") are logged
+        and returned with the feedback, not raised; see ``batch()``
+        for the stricter policy there.
+
+        Inside a ``batch()``, the command is queued instead, and the
+        returned list is only filled with feedback once the batch is
+        sent.
 
         """
-        log.debug(f"{time.time() - t0:.3f} >> {cmd}")
-        self.ser.write(bytes(cmd + "\n", "utf8"))
         if feedback:
             key = cmd.split(" ")[0]
             self.params[key] = None
-            return self._getfeedback("+" + key)
+        if self._batch is not None:
+            if feedback:
+                reply = []
+                self._batch.append((cmd, reply))
+                return reply
+            # The caller will collect the feedback itself
+            self._flushbatch()
+        self._send(cmd)
+        if feedback:
+            return self._collectfeedback(cmd)
+
+    def _send(self, cmd: str) -> None:
+        log.debug(f"{time.time() - t0:.3f} >> {cmd}")
+        self._write(bytes(cmd + "\n", "utf8"))
+
+    def _write(self, data) -> None:
+        """Write to the serial port
+
+        Writes are serialized, because the feeder thread (see
+        ``BinaryWriter.startfeeder()``) sends data while commands may
+        be sent from other threads. Hold ``_writelock`` to keep
+        several writes together.
+        """
+        with self._writelock:
+            self.ser.write(data)
+
+    def _collectfeedback(self, cmd: str) -> List[str]:
+        lines = self._getfeedback("+" + cmd.split(" ")[0])
+        for line in lines:
+            if line.startswith("!"):
+                log.error(f"{cmd}: {line[1:]}")
+        return lines
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Send several commands together
+
+        Use as::
+
+            with dev.batch():
+                dev.command("rate 10000")
+                dev.command("aimask 3")
+
+        Commands issued inside the block are queued and written to the
+        device in a single transfer when the block ends. Feedback is
+        then collected for each command in turn, so the whole batch
+        costs roughly one round trip rather than one per command. The
+        lists returned by ``command()`` are filled at that time. If any
+        command fails, a ``DeviceError`` is raised for the first one
+        that did, after the replies to all commands have been read.
+
+        This is stricter than ``command()`` outside a batch, which
+        only logs errors reported by the device and returns them with
+        the rest of its feedback for the caller to inspect. Inside a
+        batch, the caller cannot look at a reply before the commands
+        that follow it have been sent, so a failure must not go
+        unnoticed.
+
+        Because feedback is not available until the end of the block,
+        code inside it must not depend on ``params`` set by commands
+        in the same batch. Batches may be nested; the outermost one
+        determines when commands are sent.
+        """
+        if self._batch is not None:
+            yield
+            return
+        self._batch = []
+        try:
+            yield
+        finally:
+            try:
+                self._flushbatch()
+            finally:
+                self._batch = None
+
+    def _flushbatch(self):
+        """Send commands queued by ``batch()`` and collect feedback"""
+        queue = self._batch
+        pending = self._pendingstims
+        self._pendingstims = {}
+        if not queue:
+            self._stims.update(pending)
+            return
+        self._batch = []
+        for cmd, reply in queue:
+            log.debug(f"{time.time() - t0:.3f} >> {cmd}")
+        self._write(bytes("".join(cmd + "\n" for cmd, reply in queue),
+                          "utf8"))
+        keys = ["+" + cmd.split(" ")[0] for cmd, reply in queue]
+        failure = None
+        silent = False
+        for k, (cmd, reply) in enumerate(queue):
+            if silent:
+                lines, complete = [], None # no point in waiting again
+            else:
+                lines, complete = self._readreply(keys[k], keys[k+1:])
+                silent = complete is None
+            reply.extend(lines)
+            if failure is None:
+                errors = [line[1:] for line in lines if line.startswith("!")]
+                if errors:
+                    failure = (cmd, errors[0])
+                elif not complete:
+                    failure = (cmd, None)
+        if failure:
+            # The stimuli are in an unknown state
+            for spec in pending:
+                self._stims.pop(spec, None)
+            cmd, error = failure
+            if error is None:
+                raise DeviceError(f"No reply to {cmd}")
+            log.error(f"{cmd}: {error}")
+            raise DeviceError(f"{cmd}: {error}")
+        self._stims.update(pending)
+
+    def _readreply(self, key: str, later: List[str]
+                   ) -> Tuple[List[str], bool | None]:
+        """Read the reply to one of several commands sent together
+
+        Parameters:
+
+            key: the reply key of the command, e.g., "+rate"
+            later: the reply keys of commands sent after it
+
+        The reply ends with the command's own "+key" line, or with an
+        error line, which the firmware normally follows with "+key ??".
+        If the device sends the "+key" line of a later command first,
+        the reply is incomplete, and that line is left for the later
+        command.
+
+        Returns the lines of the reply and True if it was complete,
+        False if it was incomplete, or None if the device fell silent.
+        """
+        lines = []
+        while True:
+            a = self._readline()
+            if a is None: # Timeout
+                return lines, None
+            line = str(a, "utf8", "replace")
+            if line.startswith("+") and not _isreply(line, key) \
+               and any(_isreply(line, k) for k in later):
+                self._ungets(a + b"\n")
+                return lines, False
+            log.debug(f"{time.time() - t0:.3f} << {line}")
+            self._storeparam(line)
+            lines.append(line)
+            if _isreply(line, key):
+                return lines, True
+            if line.startswith("!"):
+                a = self._readline()
+                if a is not None:
+                    line = str(a, "utf8", "replace")
+                    if _isreply(line, key):
+                        self._storeparam(line)
+                        lines.append(line)
+                    else:
+                        self._ungets(a + b"\n")
+                return lines, True
         
+    def setstim(self, spec: str, cmds: List[str] | None) -> None:
+        """Configure the stimulus on one output channel
+
+        Parameters:
+
+            spec: the channel, e.g., "A0" or "D1"
+            cmds: the complete list of commands that define the
+                  stimulus, or None to switch the channel off
+
+        The device remembers what was last sent for each channel, and
+        only commands that differ from that are actually sent. For
+        instance, if only a train's pulse count changed since the
+        previous commit, only the "train" command is sent.
+
+        Inside a ``batch()``, the device is only taken to remember the
+        commands once the batch has been sent without error.
+
+        Normally called by ``AnalogOut`` and ``DigitalOut`` during
+        ``commit()``.
+        """
+        if cmds is None:
+            cmds = [f"off {spec}"]
+        fingerprint = tuple(cmds)
+        old = self._pendingstims.get(spec) or self._stims.get(spec)
+        if old and old[0] == fingerprint:
+            return
+        sent = old[1] if old else {}
+        if "off" in sent:
+            sent = {} # switching off forgets all settings
+        new = {}
+        for cmd in cmds:
+            verb = cmd.split(" ")[0]
+            key = "repeat" if verb == "once" else verb
+            new[key] = cmd
+            if sent.get(key) != cmd:
+                self.command(cmd)
+        if self._batch is not None:
+            self._pendingstims[spec] = (fingerprint, new)
+        else:
+            self._stims[spec] = (fingerprint, new)
+
+    def forgetstims(self, spec: str | None = None) -> None:
+        """Forget what was sent by ``setstim()``
+
+        Parameters:
+
+            spec: the channel to forget about, or None for all
+
+        The next ``setstim()`` for the channel then sends all commands.
+        """
+        if spec is None:
+            self._stims = {}
+            self._pendingstims = {} # set while a batch is being queued
+        else:
+            self._stims.pop(spec, None)
+            self._pendingstims.pop(spec, None)
+
+    def loadwave(self, wav: np.ndarray) -> int:
+        """Make wave data available on the device
+
+        Parameters:
+           wav: the raw data as int16
+
+        Returns:
+           the index of the wave slot that holds the data
+
+        The device remembers which data were last uploaded into each
+        of its wave slots (one per analog output channel). If
+        identical data are already present, they are not sent again.
+        Otherwise, the data are sent to an unused slot, or else to
+        the least recently used one.
+        """
+        if wav.dtype != np.int16:
+            raise DeviceError("Wave must be int16")
+        key = hashlib.sha1(np.ascontiguousarray(wav)).hexdigest()
+        slot = self._waves.pop(key, None)
+        if slot is None:
+            nslots = self.info["analog_out_count"]
+            used = set(self._waves.values())
+            free = [k for k in range(nslots) if k not in used]
+            if free:
+                slot = free[0]
+            else:
+                _, slot = self._waves.popitem(last=False)
+            self.sendwave(slot, wav)
+        self._waves[key] = slot
+        return slot
+
     def sendwave(self, idx: int, wav: np.ndarray) -> None:
         """Send wave data
 
@@ -812,8 +1390,20 @@ class PicoDAQ:
             raise DeviceError("Wave must be int16")
         chk = checksum(wav)
         N = len(wav)
-        self.command(f"wave {idx} {N}", feedback=False)
-        self.ser.write(wav.tobytes())
+        if self._batch is not None:
+            # Wave data must directly follow the command
+            self._flushbatch()
+        for key, slot in list(self._waves.items()):
+            if slot == idx:
+                del self._waves[key]
+        for spec, (fingerprint, sent) in list(self._stims.items()):
+            if sent.get("pulse", "").endswith(f" wave {idx}"):
+                # The pulse must be redefined to pick up the new wave
+                del sent["pulse"]
+                self._stims[spec] = (None, sent)
+        with self._writelock: # wave data must directly follow the command
+            self._send(f"wave {idx} {N}")
+            self._write(wav.tobytes())
         self._getfeedback("+wave")
         if f"{self.params['wave']}" != f"{chk}":
             # (string comparison to catch "??" response)
@@ -0,0 +1,967 @@
+"""Software emulation of a picoDAQ device
+
+This module provides an in-process stand-in for picoDAQ hardware. The
+emulated device speaks the same line-based command protocol and the
+same binary chunk format as the firmware, so that ``PicoDAQ``,
+``BinaryReader``, ``BinaryWriter``, and all the streams run unchanged
+without a board attached.
+
+The emulator plugs in through the module-level ``Serial`` hook in
+``picodaq.device``. Typical use::
+
+    from picodaq import emulator, AnalogIn, kHz
+    emulator.install()
+    with AnalogIn(channel=0, rate=10*kHz) as ai:
+        data = ai.read(1000)
+    emulator.uninstall()
+
+Ports that are not emulated continue to be opened as real serial
+ports.
+
+By default, the emulated device produces data in real time, fills an
+input buffer of limited size when the host does not keep up, and stops
+with an error when that buffer overflows, just like the hardware. With
+`realtime` = ``False``, data are instead produced as fast as the host
+reads them, which is what you want for throughput benchmarks.
+
+Without further configuration, analog input channel `c` reports the
+raw value (`n` + 8192 `c`) modulo 2^16 at scan `n`, and digital input
+line `l` reports bit `l` + 3 of `n`. With `loopback` = ``True``, each
+analog (digital) input instead reports what is being sent to the
+analog (digital) output with the same number. Parametrized stimuli are
+timed (they drive the "stimulus active" flag) but only their offset is
+rendered into the loopback signal.
+
+"""
+
+from __future__ import annotations
+import numpy as np
+import serial
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+import logging
+
+from . import device
+from .utils import checksum, countmask, stepsize
+from .binreader import FLAGS_BINARY, FLAGS_STIMACTIVE
+from .binreader import FLAGS_FIRSTINEPISIDE, FLAGS_LASTINEPISIDE
+from .binreader import FLAGS_INBUF_EMPTY, FLAGS_INBUF_CONTINUE
+from .binreader import FLAGS_INBUF_NEARFULL, FLAGS_INBUF_FULL
+from .binwriter import FLAGS_LAST
+
+log = logging.getLogger()
+
+MAXBLOCKS = 640 # Largest chunk the firmware supports, in 64-byte blocks
+MAXSTATUS = 255 # Output queue depth is reported in a single byte
+
+Source = Callable[[np.ndarray], Tuple[np.ndarray, np.ndarray]]
+
+
+def pattern(scans: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Default test signal of the emulated device
+
+    Parameters:
+
+        scans: vector of scan numbers (counting from start of run)
+
+    Returns:
+
+        analog: an `N` × 4 array of raw int16 values
+        digital: an `N` × 4 array of zeros and ones
+
+    Analog channel `c` reports (`n` + 8192 `c`) modulo 2^16,
+    interpreted as a signed number. Digital line `l` reports bit `l` +
+    3 of the scan number `n`.
+    """
+    scans = np.asarray(scans, np.int64)
+    analog = ((scans[:, None] + 8192 * np.arange(4)) & 0xffff)
+    analog = analog.astype(np.uint16).view(np.int16)
+    digital = ((scans[:, None] >> (np.arange(4) + 3)) & 1).astype(np.uint8)
+    return analog, digital
+
+
+def chunkblocks(nanalog: int, ndigital: int, nscans: int) -> int:
+    """Number of 64-byte blocks in a chunk
+
+    Parameters:
+
+        nanalog: number of analog channels
+        ndigital: number of digital lines
+        nscans: number of scans per chunk
+
+    Includes the four-byte chunk header.
+    """
+    nbytes = 4 + 2 * nanalog * nscans + ndigital * nscans // 8
+    return (nbytes + 63) // 64
+
+
+def _channel(spec: str) -> Tuple[str, int]:
+    """Split "A2" into ("A", 2)"""
+    return spec[:1], int(spec[1:])
+
+
+class _Stim:
+    """Parametrized stimulus as configured on one output"""
+    def __init__(self):
+        self.duration = 0
+        self.npulse = 0
+        self.pulseival = 0
+        self.pdpival = 0
+        self.pdT = 0
+        self.delay = 0
+        self.ntrain = 0
+        self.trainival = 0
+        self.tdtival = 0
+        self.tdn = 0
+        self.tdpival = 0
+        self.tdT = 0
+        self.offset = 0
+        self.repeat = None
+
+    def traindur(self, k: int) -> int:
+        """Tight duration (in scans) of train number k"""
+        npulse = self.npulse + k * self.tdn
+        dur = 0
+        for p in range(npulse):
+            pdur = self.duration + k * self.tdT + p * self.pdT
+            if p == npulse - 1:
+                dur += pdur
+            else:
+                dur += max(self.pulseival + k * self.tdpival
+                           + p * self.pdpival, pdur)
+        return dur
+
+    def end(self) -> Optional[int]:
+        """Scan at which the stimulus is complete, or None if never"""
+        if self.npulse <= 0 or self.ntrain <= 0:
+            return 0
+        if self.repeat:
+            return None
+        t = self.delay
+        for k in range(self.ntrain):
+            dur = self.traindur(k)
+            if k == self.ntrain - 1:
+                t += dur
+            else:
+                t += max(self.trainival + k * self.tdtival, dur)
+        return t
+
+
+class VirtualPicoDAQ:
+    """Emulated picoDAQ firmware
+
+    Parameters:
+
+        serno: serial number reported by the device
+        realtime: produce data at the sampling rate (see module doc)
+        loopback: connect outputs to like-numbered inputs
+        source: callable producing the input signals
+        inbufblocks: size of the input buffer, in 64-byte blocks
+        outbufblocks: size of the output buffer, in 64-byte blocks
+        maxbytespersec: sustained USB throughput that "verify" allows,
+                        or None for no limit
+        islope: input calibration reported by the device
+        oslope: output calibration reported by the device
+
+    The `source`, if given, is called with a vector of scan numbers
+    and must return analog and digital data in the format returned by
+    ``pattern``, which is the default.
+
+    You do not normally construct this class directly; use
+    ``install()``.
+
+    """
+
+    firmware = "0.9-emu"
+    hardware = "emu"
+
+    def __init__(self, serno: str = "E000000000000000",
+                 realtime: bool = True,
+                 loopback: bool = False,
+                 source: Source | None = None,
+                 inbufblocks: int = 1536,
+                 outbufblocks: int = 1024,
+                 maxbytespersec: float | None = 660e3,
+                 islope: str = "0,0",
+                 oslope: str = "0,0"):
+        self.serno = serno
+        self.realtime = realtime
+        self.loopback = loopback
+        self.source = source if source else pattern
+        self.inbufblocks = inbufblocks
+        self.outbufblocks = outbufblocks
+        self.maxbytespersec = maxbytespersec
+        self.islope = islope
+        self.oslope = oslope
+        self.vrange = 10
+        self.maxrate_kHz = 330
+
+        self.lock = threading.RLock()
+        self._tohost = bytearray()
+        self._fromhost = bytearray()
+        self._payload = None # (handler, nbytes, args) of pending binary
+        self.binary = False
+        self.commandcount = 0
+
+        self.rate = 10000
+        self.aimask = 0
+        self.dimask = 0
+        self.nscans = 0
+        self.nchunks = 0
+        self.period_ms = 0
+        self.nepis = 0
+        self.trigger = None # (line, polarity)
+        self.stims: Dict[str, _Stim] = {}
+        self.waves: Dict[int, np.ndarray] = {}
+        self.outnscans = 0
+        self.outchannels: List[int] = []
+        self.outlines: List[int] = []
+        self.sampled = False
+        self._outqueue = deque()
+        self._outlast = True
+        self._consumed = 0
+        self._setcalibration()
+
+    # ------------------------------------------------------------------
+    # Calibration
+
+    def _setcalibration(self):
+        islp = [float(x) for x in self.islope.split(",")]
+        oslp = [float(x) for x in self.oslope.split(",")]
+        self._igain = self.vrange * (1 - islp[0]/1e3) / 32767.5
+        self._ioffset = -islp[1]/1e3
+        self._ogain = 32767.99 / self.vrange / (1 + oslp[0]/1e3)
+        self._ooffset = -self._ogain * oslp[1]/1e3
+
+    def _outtoin(self, raw: np.ndarray) -> np.ndarray:
+        """Convert raw output values to raw input values"""
+        volts = (raw.astype(np.float64) - self._ooffset) / self._ogain
+        inraw = np.round((volts - self._ioffset) / self._igain)
+        return np.clip(inraw, -32768, 32767).astype(np.int16)
+
+    # ------------------------------------------------------------------
+    # Host side of the serial connection
+
+    def available(self) -> int:
+        with self.lock:
+            self._advance()
+            return len(self._tohost)
+
+    def take(self, n: int) -> bytes:
+        """Remove up to `n` bytes from the host-bound buffer"""
+        with self.lock:
+            bts = bytes(self._tohost[:n])
+            del self._tohost[:n]
+            self._consumed += len(bts)
+            return bts
+
+    def produce(self, n: int) -> None:
+        """Make at least `n` bytes available to host if possible
+
+        Only relevant when not running in real time. In real time,
+        data become available as the clock progresses.
+        """
+        with self.lock:
+            self._advance()
+            if self.realtime or not self.binary:
+                return
+            while self.binary and len(self._tohost) < n:
+                self._emit()
+
+    def find(self, expected: bytes, size: int | None = None) -> int | None:
+        """Number of bytes up to and including `expected`
+
+        Returns None if `expected` is not (yet) in the host-bound
+        buffer and fewer than `size` bytes are available.
+        """
+        with self.lock:
+            self._advance()
+            while True:
+                idx = self._tohost.find(expected)
+                if idx >= 0:
+                    n = idx + len(expected)
+                    return n if size is None else min(n, size)
+                if size is not None and len(self._tohost) >= size:
+                    return size
+                if self.realtime or not self.binary:
+                    return None
+                self._emit()
+
+    def nextdue(self) -> float | None:
+        """Time until more data become available, in seconds"""
+        with self.lock:
+            if not self.binary or not self.realtime:
+                return None
+            due = self._due(self._chunk)
+            if due is None:
+                return None
+            return max(0, self._t0 + due / self.rate - time.monotonic())
+
+    def receive(self, data: bytes) -> None:
+        """Process bytes sent by the host"""
+        with self.lock:
+            self._advance()
+            self._fromhost += data
+            while True:
+                if self._payload:
+                    handler, nbytes, args = self._payload
+                    if len(self._fromhost) < nbytes:
+                        return
+                    payload = bytes(self._fromhost[:nbytes])
+                    del self._fromhost[:nbytes]
+                    self._payload = None
+                    handler(payload, *args)
+                elif self._fromhost and self._fromhost[0] & FLAGS_BINARY:
+                    # Output chunks still in transit after an abort
+                    # are dropped
+                    nbytes = 64 * self._outblocks()
+                    if len(self._fromhost) < nbytes:
+                        return
+                    payload = bytes(self._fromhost[:nbytes])
+                    del self._fromhost[:nbytes]
+                    if self.binary:
+                        self._queueoutput(payload)
+                else:
+                    idx = self._fromhost.find(b"\n")
+                    if idx < 0:
+                        return
+                    line = str(self._fromhost[:idx], "utf8").strip()
+                    del self._fromhost[:idx+1]
+                    if line:
+                        self._command(line)
+
+    def reset(self) -> None:
+        """Discard pending host-bound data (as if a port were reopened)"""
+        with self.lock:
+            if not self.binary:
+                self._tohost.clear()
+            self._fromhost.clear()
+            self._payload = None
+
+    def _reply(self, *lines: str) -> None:
+        for line in lines:
+            self._tohost += bytes(line + "\n", "utf8")
+
+    # ------------------------------------------------------------------
+    # Command interpreter
+
+    def _command(self, line: str) -> None:
+        self.commandcount += 1
+        words = line.split(" ")
+        cmd = words[0]
+        args = [w for w in words[1:] if w]
+        if self.binary:
+            # Only "stop" is understood during acquisition
+            if cmd == "stop":
+                self._stop("ok")
+            return
+        handler = getattr(self, "_cmd_" + cmd, None)
+        if handler is None:
+            self._reply(f"!Unknown command {cmd}", f"+{cmd} ??")
+            return
+        try:
+            res = handler(*args)
+        except (TypeError, ValueError, IndexError, KeyError) as e:
+            self._reply(f"!Bad arguments for {cmd}: {e}", f"+{cmd} ??")
+            return
+        if res is not None:
+            self._reply(f"+{cmd} {res}")
+
+    def _cmd_picodaq(self):
+        return f"{self.firmware} {self.serno}"
+
+    def _cmd_info(self):
+        return (f"HW={self.hardware},AI=4,AO=4,DI=4,DO=4,"
+                + f"F={self.maxrate_kHz},"
+                + f"VI=±{self.vrange},VO=±{self.vrange}")
+
+    def _cmd_islope(self):
+        return self.islope
+
+    def _cmd_oslope(self):
+        return self.oslope
+
+    def _cmd_nop(self):
+        return "ok"
+
+    def _cmd_rate(self, hz):
+        self.rate = int(hz)
+        return self.rate
+
+    def _cmd_aimask(self, msk):
+        self.aimask = int(msk)
+        return self.aimask
+
+    def _cmd_dimask(self, msk):
+        self.dimask = int(msk)
+        return self.dimask
+
+    def _cmd_immediate(self):
+        self.trigger = None
+        return "ok"
+
+    def _cmd_trigger(self, line, polarity):
+        self.trigger = (int(line), int(polarity))
+        return f"{line} {polarity}"
+
+    def _cmd_nscans(self, n):
+        self.nscans = int(n)
+        return self.nscans
+
+    def _cmd_nchunks(self, n):
+        self.nchunks = int(n)
+        return self.nchunks
+
+    def _cmd_period(self, ms):
+        self.period_ms = int(ms)
+        return self.period_ms
+
+    def _cmd_nepis(self, n):
+        self.nepis = int(n)
+        return self.nepis
+
+    def _problems(self) -> List[str]:
+        problems = []
+        if self.rate < 100 or self.rate > 1000*self.maxrate_kHz:
+            problems.append("Unsupported rate")
+        lines = [l for l in range(4) if self.dimask & (1<<l)]
+        if len(lines) == 3 \
+           or (lines and lines[-1] - lines[0] != len(lines) - 1) \
+           or (len(lines) == 2 and lines[0] & 1):
+            problems.append("Unsupported digital lines")
+        step = stepsize(self.aimask, self.dimask)
+        if self.nscans <= 0 or self.nscans % step:
+            problems.append("Unsupported scans per chunk")
+        elif self._inblocks() > MAXBLOCKS:
+            problems.append("Chunk too large")
+        if self.maxbytespersec:
+            bps = self.rate * (2*countmask(self.aimask)
+                               + countmask(self.dimask)/8)
+            if bps > self.maxbytespersec:
+                problems.append("Data rate exceeds USB capacity")
+        return problems
+
+    def _cmd_verify(self):
+        problems = self._problems()
+        for p in problems:
+            self._reply("!" + p)
+        return "failed" if problems else "ok"
+
+    def _cmd_start(self):
+        problems = self._problems()
+        if problems:
+            for p in problems:
+                self._reply("!" + p)
+            self._reply("+verify failed")
+            return "failed"
+        self._reply("+verify ok", "+start ok",
+                    f"**BINARY {self._inblocks()}")
+        self._begin()
+        return None
+
+    def _cmd_stop(self):
+        return "ok"
+
+    def _stimfor(self, spec: str) -> _Stim:
+        if spec not in self.stims:
+            self.stims[spec] = _Stim()
+        return self.stims[spec]
+
+    def _cmd_off(self, spec):
+        self.stims.pop(spec, None)
+        return "ok"
+
+    def _cmd_aorange(self, spec, rng):
+        self._stimfor(spec)
+        return "ok"
+
+    def _cmd_pulse(self, spec, name, *args):
+        stim = self._stimfor(spec)
+        if name == "wave":
+            stim.duration = len(self.waves.get(int(args[0]), []))
+        else:
+            stim.duration = int(args[1]) + int(args[3])
+        return "ok"
+
+    def _cmd_ttl(self, spec, dur):
+        self._stimfor(spec).duration = int(dur)
+        return "ok"
+
+    def _cmd_train(self, spec, npulse, ival):
+        stim = self._stimfor(spec)
+        stim.npulse = int(npulse)
+        stim.pulseival = int(ival)
+        return "ok"
+
+    def _cmd_perpulse(self, spec, ival, a1, t1, a2, t2):
+        stim = self._stimfor(spec)
+        stim.pdpival = int(ival)
+        stim.pdT = int(t1) + int(t2)
+        return "ok"
+
+    def _cmd_series(self, spec, delay, ntrain, ival, tdtival, tdn):
+        stim = self._stimfor(spec)
+        stim.delay = int(delay)
+        stim.ntrain = int(ntrain)
+        stim.trainival = int(ival)
+        stim.tdtival = int(tdtival)
+        stim.tdn = int(tdn)
+        return "ok"
+
+    def _cmd_pertrain(self, spec, ival, a1, t1, a2, t2):
+        stim = self._stimfor(spec)
+        stim.tdpival = int(ival)
+        stim.tdT = int(t1) + int(t2)
+        return "ok"
+
+    def _cmd_offset(self, spec, value):
+        self._stimfor(spec).offset = int(value)
+        return "ok"
+
+    def _cmd_repeat(self, spec, period):
+        self._stimfor(spec).repeat = int(period)
+        return "ok"
+
+    def _cmd_once(self, spec):
+        self._stimfor(spec).repeat = None
+        return "ok"
+
+    def _cmd_wave(self, idx, n):
+        self._payload = (self._gotwave, 2*int(n), (int(idx),))
+        return None
+
+    def _gotwave(self, payload: bytes, idx: int):
+        self.waves[idx] = np.frombuffer(payload, np.int16).copy()
+        self._reply(f"+wave {checksum(self.waves[idx])}")
+
+    def _cmd_outnscans(self, n):
+        self.outnscans = int(n)
+        return self.outnscans
+
+    def _cmd_sampled(self, *specs):
+        self.outchannels = []
+        self.outlines = []
+        for spec in specs:
+            kind, idx = _channel(spec)
+            if kind == "A":
+                self.outchannels.append(idx)
+            else:
+                self.outlines.append(idx)
+        self.outchannels.sort()
+        self.outlines.sort()
+        self.sampled = True
+        self._outqueue.clear()
+        self._outlast = False
+        return self._outcapacity()
+
+    def _cmd_outdata(self, chunkno, nblocks):
+        self._payload = (self._gotoutdata, 64*int(nblocks), ())
+        return None
+
+    def _gotoutdata(self, payload: bytes):
+        self._reply(f"+outdata {checksum(np.frombuffer(payload, np.int16))}")
+        self._queueoutput(payload)
+
+    # ------------------------------------------------------------------
+    # Output side
+
+    def _outblocks(self) -> int:
+        return chunkblocks(len(self.outchannels), len(self.outlines),
+                           self.outnscans)
+
+    def _outcapacity(self) -> int:
+        """Number of output chunks that fit in the output buffer"""
+        return min(MAXSTATUS, max(1, self.outbufblocks // self._outblocks()))
+
+    def _queueoutput(self, payload: bytes) -> None:
+        if not self.sampled:
+            return
+        if len(self._outqueue) >= self._outcapacity():
+            self._abort("Output buffer overflow")
+            return
+        words = np.frombuffer(payload, np.int16)
+        N = self.outnscans
+        C = len(self.outchannels)
+        L = len(self.outlines)
+        last = bool(words[0] & FLAGS_LAST)
+        adata = words[2:2+C*N].reshape(C, N).T
+        if L:
+            i0 = 2 * (2 + C*N)
+            bts = np.frombuffer(payload, np.uint8)[i0:i0 + N*L//8]
+            ddata = np.unpackbits(bts, bitorder="little").reshape(N, L)
+        else:
+            ddata = np.zeros((N, 0), np.uint8)
+        self._outqueue.append([adata, ddata, last, 0])
+
+    def _playoutput(self, N: int) -> Tuple[np.ndarray, np.ndarray] | None:
+        """Consume N scans of output; returns None on underrun"""
+        aout = np.empty((N, 4), np.int16)
+        aout[:] = self._alevel
+        dout = np.empty((N, 4), np.uint8)
+        dout[:] = self._dlevel
+        if not self.sampled or self._outlast:
+            return aout, dout
+        n0 = 0
+        while n0 < N:
+            if not self._outqueue:
+                return None
+            item = self._outqueue[0]
+            adata, ddata, last, used = item
+            M = min(N - n0, len(adata) - used)
+            aout[n0:n0+M, self.outchannels] = adata[used:used+M]
+            dout[n0:n0+M, self.outlines] = ddata[used:used+M]
+            n0 += M
+            item[3] += M
+            if item[3] >= len(adata):
+                self._outqueue.popleft()
+                if len(adata):
+                    self._alevel[self.outchannels] = adata[-1]
+                    self._dlevel[self.outlines] = ddata[-1]
+                if last:
+                    self._outlast = True
+                    aout[n0:] = self._alevel
+                    dout[n0:] = self._dlevel
+                    break
+        return aout, dout
+
+    def _stimactive(self, scan: int, episode: int) -> bool:
+        if self.sampled and not self._outlast:
+            return True
+        for stim in self.stims.values():
+            if self.nchunks:
+                if stim.npulse > 0 and (stim.repeat or episode < stim.ntrain):
+                    return True
+            else:
+                end = stim.end()
+                if end is None or scan < end:
+                    return True
+        return False
+
+    # ------------------------------------------------------------------
+    # Input side
+
+    def _inblocks(self) -> int:
+        return chunkblocks(countmask(self.aimask), countmask(self.dimask),
+                           self.nscans)
+
+    def _begin(self) -> None:
+        self.binary = True
+        self._t0 = time.monotonic()
+        self._chunk = 0 # number of chunks produced
+        self._consumed = -len(self._tohost) # don't count the text reply
+        self._stoppedat = None
+        self._epistart = None # scan at which current episode starts
+        self._epiidx = None
+        self._alevel = np.zeros(4, np.int16)
+        self._dlevel = np.zeros(4, np.uint8)
+        if not self.sampled:
+            self._outlast = True
+        for spec, stim in self.stims.items():
+            kind, idx = _channel(spec)
+            if kind == "A":
+                self._alevel[idx] = stim.offset
+            else:
+                self._dlevel[idx] = 1 if stim.offset else 0
+        self._leader = [c for c in (0, 1) if self.aimask & (1<<c)]
+        self._follower = [c for c in (2, 3) if self.aimask & (1<<c)]
+        if not self._leader:
+            self._leader, self._follower = self._follower, []
+        self._lines = [l for l in range(4) if self.dimask & (1<<l)]
+
+    def _findtrigger(self, scan: int) -> int:
+        """First scan at or after `scan` that satisfies the trigger"""
+        if self.trigger is None:
+            return scan
+        line, polarity = self.trigger
+        win = max(1024, self.rate // 10)
+        for k in range(600):
+            _, dig = self.source(np.arange(scan - 1, scan + win))
+            x = dig[:, line].astype(np.int8)
+            dx = np.diff(x)
+            hits = np.nonzero(dx > 0 if polarity > 0 else dx < 0)[0]
+            if len(hits):
+                return scan + int(hits[0])
+            scan += win
+        return scan
+
+    def _chunkstart(self, k: int) -> int:
+        """Scan number at which chunk `k` starts"""
+        N = self.nscans
+        if not self.nchunks:
+            if self._epistart is None:
+                self._epistart = self._findtrigger(0)
+            return self._epistart + k * N
+        epi, j = divmod(k, self.nchunks)
+        if j == 0 and self._epiidx != epi:
+            # First chunk of a new episode
+            if epi == 0:
+                earliest = 0
+            else:
+                period = self.period_ms * self.rate // 1000
+                earliest = self._epistart + max(period, self.nchunks * N)
+            self._epistart = self._findtrigger(earliest)
+            self._epiidx = epi
+        return self._epistart + j * N
+
+    def _due(self, k: int) -> int | None:
+        """Scan number at which chunk `k` is complete"""
+        if self._stoppedat is not None:
+            return None
+        if self.nchunks and self.nepis and k >= self.nchunks * self.nepis:
+            return None
+        return self._chunkstart(k) + self.nscans
+
+    def _advance(self) -> None:
+        """Produce any chunks that are due according to the clock"""
+        if not self.binary or not self.realtime:
+            return
+        now = (time.monotonic() - self._t0) * self.rate
+        while self.binary:
+            due = self._due(self._chunk)
+            if due is None or due > now:
+                break
+            self._emit()
+
+    def _emit(self) -> None:
+        """Produce the next chunk"""
+        k = self._chunk
+        N = self.nscans
+        start = self._chunkstart(k)
+        epi, j = divmod(k, self.nchunks) if self.nchunks else (0, k)
+        out = self._playoutput(N)
+        if out is None:
+            self._abort("Output buffer underrun")
+            return
+        chunkbytes = 64 * self._inblocks()
+        queued = len(self._tohost)
+        capacity = 64 * self.inbufblocks
+        if queued + chunkbytes > capacity:
+            self._abort("Input buffer overflow")
+            return
+        flags = FLAGS_BINARY
+        if queued >= capacity * 3 // 4:
+            flags |= FLAGS_INBUF_FULL if queued + 2*chunkbytes > capacity \
+                else FLAGS_INBUF_NEARFULL
+        elif queued >= chunkbytes:
+            flags |= FLAGS_INBUF_CONTINUE
+        else:
+            flags |= FLAGS_INBUF_EMPTY
+        if self._stimactive(start, epi):
+            flags |= FLAGS_STIMACTIVE
+        if self.nchunks:
+            if j == 0:
+                flags |= FLAGS_FIRSTINEPISIDE
+            if j == self.nchunks - 1:
+                flags |= FLAGS_LASTINEPISIDE
+        status = min(MAXSTATUS, len(self._outqueue))
+
+        analog, digital = self.source(np.arange(start, start + N))
+        if self.loopback:
+            analog = self._outtoin(out[0])
+            digital = out[1]
+        self._tohost += self._encode(k, int(flags), status,
+                                     analog, digital)
+        self._chunk += 1
+        if self.nchunks and self.nepis and self._chunk >= self.nchunks*self.nepis:
+            self._stop("ok")
+
+    def _encode(self, chunkno: int, flags: int, status: int,
+                analog: np.ndarray, digital: np.ndarray) -> bytes:
+        N = self.nscans
+        words = np.zeros(32 * self._inblocks(), np.uint16)
+        words[0] = flags | (status << 8)
+        words[1] = chunkno & 0xffff
+        i0 = 2
+        for chans in (self._leader, self._follower):
+            if not chans:
+                continue
+            vals = analog[:, chans].reshape(-1)
+            if len(chans) == 1:
+                vals = vals.reshape(-1, 2)[:, ::-1].reshape(-1)
+            words[i0:i0 + len(vals)] = vals.view(np.uint16)
+            i0 += len(vals)
+        if self._lines:
+            bts = np.packbits(digital[:, self._lines].reshape(-1),
+                              bitorder="little")
+            words.view(np.uint8)[2*i0:2*i0 + len(bts)] = bts
+        return words.tobytes()
+
+    def _stop(self, result: str, reason: str | None = None) -> None:
+        self._advance()
+        self.binary = False
+        self._stoppedat = self._chunk
+        self.sampled = False
+        msg = "**ASCII\n"
+        if reason:
+            msg += f"!{reason}\n"
+        msg += f"+stop {result}\n"
+        self._tohost += bytes(msg, "utf8")
+
+    def _abort(self, reason: str) -> None:
+        """Stop because of an error, dropping unread data"""
+        log.debug(f"emulator abort: {reason}")
+        chunkbytes = 64 * self._inblocks()
+        keep = (-self._consumed) % chunkbytes
+        del self._tohost[keep:]
+        self.binary = False
+        self._stoppedat = self._chunk
+        self.sampled = False
+        self._tohost += bytes(f"**ASCII\n!{reason}\n+stop failed\n", "utf8")
+
+
+class VirtualSerial:
+    """Serial port connected to a ``VirtualPicoDAQ``
+
+    This implements the subset of the ``serial.Serial`` interface that
+    the picodaq library uses.
+    """
+    def __init__(self, port: str | None = None,
+                 timeout: float | None = None,
+                 write_timeout: float | None = None,
+                 **kwargs):
+        self.port = port
+        self.timeout = timeout
+        self.write_timeout = write_timeout
+        self.is_open = False
+        self.dev = None
+        if port is not None:
+            self.open()
+
+    def open(self) -> None:
+        if self.is_open:
+            raise serial.SerialException("Port is already open")
+        if self.port not in _devices:
+            raise serial.SerialException(f"No emulated device on {self.port}")
+        self.dev = _devices[self.port]
+        self.dev.reset()
+        self.is_open = True
+
+    def close(self) -> None:
+        self.is_open = False
+
+    def _check(self):
+        if not self.is_open:
+            raise serial.PortNotOpenError()
+
+    @property
+    def in_waiting(self) -> int:
+        self._check()
+        return self.dev.available()
+
+    def write(self, data: bytes) -> int:
+        self._check()
+        self.dev.receive(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def reset_input_buffer(self) -> None:
+        self._check()
+        self.dev.reset()
+
+    def _wait(self, satisfied: Callable[[], int | None]) -> int | None:
+        """Wait until `satisfied` returns a byte count or timeout expires
+
+        Returns the byte count, or None on timeout.
+        """
+        deadline = None if self.timeout is None \
+            else time.monotonic() + self.timeout
+        while True:
+            n = satisfied()
+            if n is not None:
+                return n
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                return None
+            wait = self.dev.nextdue()
+            if deadline is not None:
+                wait = deadline - now if wait is None \
+                    else min(wait, deadline - now)
+            elif wait is None:
+                wait = 0.1
+            time.sleep(max(wait, 1e-4))
+
+    def read(self, size: int = 1) -> bytes:
+        self._check()
+        def satisfied():
+            self.dev.produce(size)
+            return size if self.dev.available() >= size else None
+        n = self._wait(satisfied)
+        return self.dev.take(size if n else self.dev.available())
+
+    def readinto(self, buf) -> int:
+        mv = memoryview(buf).cast("B")
+        data = self.read(len(mv))
+        mv[:len(data)] = data
+        return len(data)
+
+    def read_until(self, expected: bytes = b"\n",
+                   size: int | None = None) -> bytes:
+        self._check()
+        n = self._wait(lambda: self.dev.find(expected, size))
+        return self.dev.take(n if n else self.dev.available())
+
+    def readline(self) -> bytes:
+        return self.read_until(b"\n")
+
+
+_devices: Dict[str, VirtualPicoDAQ] = {}
+_saved = None
+
+
+def _serial(port: str | None = None, *args, **kwargs):
+    if port in _devices:
+        return VirtualSerial(port, *args, **kwargs)
+    return _saved[0](port, *args, **kwargs)
+
+
+def _picos() -> Dict[str, str]:
+    devs = {port: dev.serno for port, dev in _devices.items()}
+    try:
+        devs.update(_saved[1]())
+    except Exception:
+        pass # e.g., no USB support on this system
+    return devs
+
+
+def install(port: str = "emu0", **kwargs) -> VirtualPicoDAQ:
+    """Install an emulated picoDAQ
+
+    Parameters:
+
+        port: name under which the device appears
+        **kwargs: passed on to ``VirtualPicoDAQ``
+
+    Returns:
+
+        The emulated device
+
+    The emulated device becomes visible to ``devices()``, ``find()``,
+    and the streams. Emulated devices are listed before real ones.
+    Call ``install()`` again with a different `port` to emulate more
+    than one device.
+
+    """
+    global _saved
+    if _saved is None:
+        _saved = (device.Serial, device.picos)
+        device.Serial = _serial
+        device.picos = _picos
+    dev = VirtualPicoDAQ(**kwargs)
+    _devices[port] = dev
+    return dev
+
+
+def uninstall() -> None:
+    """Remove all emulated devices
+
+    This restores the original ``Serial`` hook in ``picodaq.device``.
+    """
+    global _saved
+    _devices.clear()
+    if _saved is not None:
+        device.Serial, device.picos = _saved
+        _saved = None
@@ -24,7 +24,7 @@ def rtime():
 #log.setLevel(logging.ERROR)
 
 def usage() -> int:
-    print("Usage: pdserver port rate_Hz channels", file=sys.stderr)
+    print("Usage: pdserver port rate_Hz channels [decN]", file=sys.stderr)
     return 1
 
 
@@ -111,9 +111,10 @@ def run(stdin, stdout,
         aochans: List[int],
         dolines: List[int],
         aoidx: List[int],
-        doidx: List[int]):
+        doidx: List[int],
+        decimate: int = 1):
 
-    ai = AnalogIn(port=port, rate=rate, channels=aichans)
+    ai = AnalogIn(port=port, rate=rate, channels=aichans, decimate=decimate)
     ai.open()
     if aochans:
         ao = AnalogOut(port=port, rate=rate, maxahead=300*ms)
@@ -171,9 +172,12 @@ def main() -> int:
     dolines = []
     aoidx = []
     doidx = []
+    decimate = 1
     k = 0
     for arg in sys.argv[3:]:
-        if arg.startswith("ai"):
+        if arg.startswith("dec"):
+            decimate = int(arg[3:])
+        elif arg.startswith("ai"):
             aichans.append(int(arg[2:]))
         elif arg.startswith("ao"):
             aochans.append(int(arg[2:]))
@@ -191,6 +195,7 @@ def main() -> int:
     log.info(f"AI channels {aichans}")
     log.info(f"AO channels {aochans} ({aoidx})")
     log.info(f"DO lines {dolines} ({doidx})")
+    log.info(f"Decimation {decimate}")
 
     with io.FileIO(sys.stdout.fileno(), "wb") as stdout:
         with io.FileIO(sys.stdin.fileno(), "rb") as stdin:
@@ -198,7 +203,7 @@ def main() -> int:
                        port, rate,
                        aichans,
                        aochans, dolines,
-                       aoidx, doidx)
+                       aoidx, doidx, decimate)
 
         
 if __name__ == "__main__":
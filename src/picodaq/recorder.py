@@ -0,0 +1,380 @@
+"""Recording straight to disk
+
+A recording is a file that starts with a header of ``HEADERSIZE``
+bytes, followed by binary chunks exactly as they were received from
+the device. The header consists of the line ``MAGIC`` and a JSON
+dictionary, padded with spaces. It describes the layout of the
+chunks and carries everything needed to interpret the data:
+
+    version: format version (currently 1)
+    rate_Hz: sampling rate
+    nscans: number of scans per chunk
+    chunkbytes: size of each chunk, in bytes
+    channels: analog input channels, in the order of ``read()``
+    lines: digital input lines
+    igain, ioffset: conversion from raw values to volts, per channel
+    epichunks: number of chunks per episode (0 if continuous)
+    starttime: host time (as in ``time.time()``) of the start
+    chunks: number of chunks in the file
+    gaps: list of [scan, chunks, time] for each gap in the data
+    stop: how the acquisition ended ("ok" or an error)
+
+The last three entries are filled in when the recording is closed.
+
+Chunks lost in transfer (see ``fillgaps`` in ``AnalogIn``) are
+replaced by placeholder chunks, so that chunk `k` is always found at
+byte offset ``HEADERSIZE + k * chunkbytes``, and episode `n` always
+begins at chunk ``n * epichunks``. Placeholders have a first word of
+zero (rather than the binary flag), analog values of ``GAPFILL``,
+and digital values of zero.
+
+Use ``Recording`` to read a recording back.
+"""
+
+import numpy as np
+import json
+import time
+import threading
+import os
+import logging
+from typing import Dict, Any, List
+
+from .binreader import GAPFILL, FLAGS_BINARY, Gap, demuxplan
+from .units import Hz, Frequency, Time, Quantity
+from .timebase import TimeBase
+
+MAGIC = b"picodaq recording\n"
+HEADERSIZE = 65536
+VERSION = 1
+MINWRITE = 1 << 20 # Size of writes to aim for, in bytes
+MAXDELAY = 0.5 # Longest time data are held back, in seconds
+
+log = logging.getLogger()
+
+
+class Recorder:
+    """Background writer of binary chunks to a file
+
+    Parameters:
+
+        path: name of the file to create
+
+    The ``BinaryReader`` hands chunks to ``put()`` as they arrive; a
+    dedicated thread collects them and writes them to disk in large
+    sequential writes. This keeps the cost to the reader down to a
+    single copy of the data.
+
+    This is a low-level class not intended for typical users. Use
+    ``AnalogIn.record()`` or ``DigitalIn.record()`` instead.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "wb")
+        self.header: Dict[str, Any] = {}
+        self.chunks = 0 # number of chunks received, including fill
+        self.written = 0 # number of bytes written, excluding header
+        self.error = None # exception raised in writer thread
+        self._pending = []
+        self._pendingbytes = 0
+        self._cond = threading.Condition()
+        self._closing = False
+        self._fill = None
+        self.thread = None
+
+    def begin(self, reader: "BinaryReader") -> None:
+        """Write the header and start the writer thread"""
+        dev = reader.dev
+        W = 32 * reader.blocksperchunk
+        igain, ioffset = dev.inputcalibration(dev.aichannels)
+        self.header = {"version": VERSION,
+                       "rate_Hz": dev.rate.as_("Hz"),
+                       "nscans": reader.nscans,
+                       "chunkbytes": 2 * W,
+                       "channels": [int(c) for c in dev.aichannels],
+                       "lines": [int(l) for l in dev.dilines],
+                       "igain": igain.tolist(),
+                       "ioffset": ioffset.tolist(),
+                       "epichunks": int(dev.params.get("nchunks", 0)),
+                       "starttime": reader.t0,
+                       "chunks": 0,
+                       "gaps": [],
+                       "stop": None}
+        self._writeheader()
+        fill = np.full(W, GAPFILL)
+        fill[0] = 0
+        if reader.nlines:
+            digistart = 2 * (2 + reader.nscans * reader.nchannels)
+            nbytes = reader.nscans * reader.nlines // 8
+            fill.view(np.uint8)[digistart:digistart + nbytes] = 0
+        self._fill = fill
+        self.thread = threading.Thread(target=self._write,
+                                       name="picodaq-recorder",
+                                       daemon=True)
+        self.thread.start()
+
+    def put(self, raw: np.ndarray) -> None:
+        """Queue consecutive chunks for writing"""
+        data = raw.tobytes()
+        with self._cond:
+            self._pending.append(data)
+            self._pendingbytes += len(data)
+            self.chunks += len(raw)
+            if self._pendingbytes >= MINWRITE:
+                self._cond.notify_all()
+        self._raise()
+
+    def fill(self, gap: Gap, chunkno: int) -> None:
+        """Queue placeholders for chunks lost in transfer
+
+        `chunkno` is the number of the first missing chunk.
+        """
+        chunks = np.tile(self._fill, (gap.chunks, 1))
+        chunks[:, 1] = (chunkno + np.arange(gap.chunks)) & 65535
+        self.header["gaps"].append(list(gap))
+        self.put(chunks)
+
+    def close(self, stop: str | None = None) -> None:
+        """Write out remaining data and finalize the header"""
+        if self.file.closed:
+            return
+        try:
+            if self.thread:
+                with self._cond:
+                    self._closing = True
+                    self._cond.notify_all()
+                self.thread.join()
+            self.header["chunks"] = self.chunks
+            self.header["stop"] = stop
+            self._writeheader()
+        finally:
+            self.file.close()
+        self._raise()
+
+    def stats(self) -> Dict[str, Any]:
+        """Progress so far
+
+        Returns a dictionary with the number of chunks received, the
+        number of bytes written to disk, and the number of bytes
+        waiting to be written.
+        """
+        with self._cond:
+            return {"chunks": self.chunks,
+                    "written": self.written,
+                    "backlog": self._pendingbytes}
+
+    def _writeheader(self):
+        text = json.dumps(self.header).encode()
+        if len(MAGIC) + len(text) + 1 > HEADERSIZE:
+            log.warning("Too many gaps to list in recording header")
+            header = dict(self.header)
+            header["gaps"] = None
+            text = json.dumps(header).encode()
+        pos = self.file.tell()
+        self.file.seek(0)
+        self.file.write((MAGIC + text).ljust(HEADERSIZE - 1) + b"\n")
+        self.file.seek(max(pos, HEADERSIZE))
+
+    def _write(self):
+        """Body of the writer thread"""
+        try:
+            while True:
+                with self._cond:
+                    deadline = time.monotonic() + MAXDELAY
+                    while self._pendingbytes < MINWRITE \
+                          and not self._closing:
+                        left = deadline - time.monotonic()
+                        if left <= 0:
+                            break
+                        self._cond.wait(left)
+                    pending = self._pending
+                    self._pending = []
+                    closing = self._closing
+                if pending:
+                    data = b"".join(pending)
+                    self.file.write(data)
+                    with self._cond:
+                        self._pendingbytes -= len(data)
+                        self.written += len(data)
+                if closing:
+                    break
+        except Exception as e:
+            self.error = e
+
+    def _raise(self):
+        if self.error:
+            err = self.error
+            self.error = None
+            raise err
+
+
+class Recording:
+    """Random access to a file written by ``Recorder``
+
+    Parameters:
+
+        path: name of the file to open
+
+    The file is memory-mapped rather than read, so that opening even
+    a very large recording is instantaneous, and only the parts that
+    are actually accessed are brought into memory. Analog data are
+    demultiplexed and converted to volts one window at a time.
+
+    Data may be accessed sequentially through ``read()``, like from an
+    ``AnalogIn``, or at random by slicing, e.g.::
+
+        rec = Recording("data.pdaq")
+        data = rec[1*s:2*s] # T × C array, in volts
+        data = rec[30000:60000] # same, assuming 30 kS/s
+
+    Digital data are available through ``digital()``.
+
+    A recording that is still being written may be opened; it then
+    contains whatever was on disk when it was opened.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            head = f.read(HEADERSIZE)
+        if not head.startswith(MAGIC) or len(head) < HEADERSIZE:
+            raise ValueError("Not a picodaq recording")
+        self.header = json.loads(head[len(MAGIC):])
+        if self.header["version"] > VERSION:
+            raise ValueError("Unsupported recording version")
+        chunkbytes = self.header["chunkbytes"]
+        nchunks = self.header["chunks"]
+        if not nchunks: # recording not finalized
+            nchunks = (os.path.getsize(path) - HEADERSIZE) // chunkbytes
+        self.chunks = np.memmap(path, np.int16, "r", HEADERSIZE,
+                                (nchunks, chunkbytes // 2))
+        self.rate: Frequency = self.header["rate_Hz"] * Hz
+        self.channels: List[int] = self.header["channels"]
+        self.lines: List[int] = self.header["lines"]
+        self.nscans: int = self.header["nscans"] # per chunk
+        self.epichunks: int = self.header["epichunks"]
+        self.gaps = [Gap(*gap) for gap in self.header["gaps"] or []]
+        self._demux = demuxplan(tuple(self.channels), self.nscans)
+        self._gain = np.asarray(self.header["igain"], np.float32)
+        self._offset = np.asarray(self.header["ioffset"], np.float32)
+        self.offset = 0 # position of ``read()``, in scans
+
+    def __len__(self) -> int:
+        """Number of scans in the recording"""
+        return len(self.chunks) * self.nscans
+
+    @property
+    def duration(self) -> Time:
+        """Duration of the recording"""
+        return Time(len(self) / self.rate.as_("Hz"), "s")
+
+    def __getitem__(self, index: slice) -> np.ndarray:
+        if not isinstance(index, slice) or index.step is not None:
+            raise ValueError("Only simple slices are supported")
+        return self.analog(index.start, index.stop)
+
+    def _window(self, start, stop):
+        """Convert start and stop to scan indices"""
+        def scan(t, default):
+            if t is None:
+                return default
+            if isinstance(t, Quantity):
+                t = round((t * self.rate).plain())
+            return int(t)
+        start, stop, _ = slice(scan(start, 0),
+                               scan(stop, len(self))).indices(len(self))
+        return start, max(start, stop)
+
+    def analog(self, start: Time | int | None = None,
+               stop: Time | int | None = None,
+               raw: bool = False) -> np.ndarray:
+        """Analog data from a window
+
+        Parameters:
+            start: start of the window, in units of time or as a scan
+                index (default: start of the recording)
+            stop: end of the window, likewise (default: end of the
+                recording)
+            raw: whether to return raw values rather than volts
+
+        Returns:
+            A `T` × `C` array: signed 16-bit values if `raw` is set,
+            otherwise 32-bit floats in volts. Data lost in transfer
+            read as -32768 or NaN, respectively.
+
+        Negative indices count from the end, as for lists.
+        """
+        start, stop = self._window(start, stop)
+        if not self.channels:
+            return np.zeros((stop - start, 0),
+                            np.int16 if raw else np.float32)
+        N = self.nscans
+        k0 = start // N
+        k1 = -(-stop // N)
+        block = self.chunks[k0:k1]
+        W = block.shape[1]
+        plan = W * np.arange(k1 - k0)[:, None, None] + self._demux[None]
+        plan = plan.reshape(-1, len(self.channels))[start - k0*N:stop - k0*N]
+        data = np.asarray(block).reshape(-1)[plan]
+        if raw:
+            return data
+        conv = np.multiply(data, self._gain, dtype=np.float32)
+        conv += self._offset
+        # Placeholders for lost chunks lack the binary flag
+        lost = (np.asarray(block[:, 0]) & FLAGS_BINARY) == 0
+        if np.any(lost):
+            conv[np.repeat(lost, N)[start - k0*N:stop - k0*N]] = np.nan
+        return conv
+
+    def digital(self, start: Time | int | None = None,
+                stop: Time | int | None = None) -> np.ndarray:
+        """Digital data from a window
+
+        Parameters are as for ``analog()``. Returns a `T` × `L` array
+        of zeros and ones. Data lost in transfer read as zeros.
+        """
+        start, stop = self._window(start, stop)
+        N = self.nscans
+        L = len(self.lines)
+        if not L:
+            return np.zeros((stop - start, 0), np.uint8)
+        k0 = start // N
+        k1 = -(-stop // N)
+        digistart = 2 * (2 + N * len(self.channels))
+        bts = self.chunks[k0:k1].view(np.uint8)[:, digistart:
+                                                digistart + N*L//8]
+        bits = np.unpackbits(np.asarray(bts).reshape(-1), bitorder="little")
+        return bits.reshape(-1, L)[start - k0*N:stop - k0*N]
+
+    def read(self, amount: Time | int | None = None,
+             raw: bool = False,
+             times: bool = False) -> np.ndarray:
+        """Sequential access to analog data
+
+        Parameters:
+            amount: Amount of data to be read, either in units of time,
+                or as an integer number of scans.
+            raw: Whether to return raw values rather than volts
+            times: Whether to return a vector of time stamps
+
+        Returns:
+            data — A `T` × `C` array, as from ``analog()``.
+            times — A corresponding ``TimeBase``: time stamps, in
+                seconds since start of run (or of episode, in episodic
+                mode); only if the `times` flag is set.
+
+        Reading starts at the beginning of the recording and continues
+        where the previous ``read()`` left off. If no `amount` is
+        specified, a single chunk is read in continuous mode, or a
+        full episode in episodic mode. Near the end of the recording,
+        less data than requested may be returned.
+        """
+        if amount is None:
+            amount = self.nscans * (self.epichunks or 1)
+        elif isinstance(amount, Quantity):
+            amount = round((amount * self.rate).plain())
+        start = self.offset
+        self.offset = min(start + amount, len(self))
+        data = self.analog(start, self.offset, raw)
+        if not times:
+            return data
+        return data, TimeBase(start, self.offset - start, self.rate.as_("Hz"),
+                              self.epichunks * self.nscans)
@@ -0,0 +1,116 @@
+import numpy as np
+
+
+class RingBuffer:
+    """First-in, first-out buffer of array rows
+
+    Parameters:
+
+        capacity: initial number of rows that fit in the buffer
+        rowshape: shape of each row, e.g., ``(C,)`` for analog scans
+                  or ``()`` for bytes
+        dtype: data type of the stored values
+
+    Data are kept in a single preallocated array that is used
+    circularly. If more rows are stored than fit, the buffer is
+    enlarged, but it never shrinks, so that memory use stays flat as
+    long as data are taken out as quickly as they are put in.
+
+    This is a low-level class not intended for typical users.
+    """
+    def __init__(self, capacity: int, rowshape: tuple = (),
+                 dtype: np.dtype = np.int16):
+        self._data = np.empty((max(capacity, 1),) + tuple(rowshape), dtype)
+        self._head = 0 # index of the first row stored
+        self._count = 0 # number of rows stored
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def capacity(self) -> int:
+        return len(self._data)
+
+    def put(self, data: np.ndarray) -> None:
+        """Append rows to the end of the buffer"""
+        n = len(data)
+        if self._count + n > self.capacity:
+            self._grow(self._count + n)
+        cap = self.capacity
+        tail = (self._head + self._count) % cap
+        n1 = min(n, cap - tail)
+        self._data[tail:tail+n1] = data[:n1]
+        self._data[:n-n1] = data[n1:]
+        self._count += n
+
+    def gather(self, source: np.ndarray, index: np.ndarray) -> None:
+        """Append ``source[index]`` to the end of the buffer
+
+        This is equivalent to ``put(source[index])``, but writes
+        directly into the buffer without an intermediate array.
+        """
+        n = len(index)
+        if self._count + n > self.capacity:
+            self._grow(self._count + n)
+        cap = self.capacity
+        tail = (self._head + self._count) % cap
+        n1 = min(n, cap - tail)
+        np.take(source, index[:n1], out=self._data[tail:tail+n1])
+        if n1 < n:
+            np.take(source, index[n1:], out=self._data[:n-n1])
+        self._count += n
+
+    def get(self, n: int) -> np.ndarray:
+        """Remove up to `n` rows from the front of the buffer
+
+        Returns a freshly allocated array.
+        """
+        n = min(n, self._count)
+        cap = self.capacity
+        n1 = min(n, cap - self._head)
+        if n1 == n:
+            res = self._data[self._head:self._head+n].copy()
+        else:
+            res = np.concatenate((self._data[self._head:],
+                                  self._data[:n-n1]), 0)
+        self._head = (self._head + n) % cap
+        self._count -= n
+        return res
+
+    def getinto(self, out: np.ndarray, transform=None) -> int:
+        """Remove up to ``len(out)`` rows from the front into `out`
+
+        Parameters:
+
+            out: array to fill, with rows of the same shape as ours
+            transform: function ``transform(src, dst)`` that writes
+                       rows `src` into `dst`; by default, they are
+                       simply copied (with casting if needed)
+
+        Returns the number of rows taken. `transform` is called once
+        or twice, depending on whether the rows wrap around the end of
+        our storage, so no intermediate array is needed.
+        """
+        n = min(len(out), self._count)
+        if transform is None:
+            transform = lambda src, dst: np.copyto(dst, src,
+                                                   casting="unsafe")
+        cap = self.capacity
+        n1 = min(n, cap - self._head)
+        transform(self._data[self._head:self._head+n1], out[:n1])
+        if n1 < n:
+            transform(self._data[:n-n1], out[n1:n])
+        self._head = (self._head + n) % cap
+        self._count -= n
+        return n
+
+    def _grow(self, needed: int) -> None:
+        cap = self.capacity
+        while cap < needed:
+            cap *= 2
+        data = np.empty((cap,) + self._data.shape[1:], self._data.dtype)
+        count = self._count
+        data[:count] = self.get(count)
+        self._data = data
+        self._head = 0
+        self._count = count
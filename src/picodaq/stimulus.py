@@ -630,7 +630,11 @@ class Sampled:
 
     When digital data are represented as a ``Sampled``, nonzero values
     map to digital 1 and zero values to digital 0. In this case, the
-    `scale`, `offset`, and `raw` parameters are ignored.
+    `scale` and `offset` parameters are ignored. Specifying `raw` =
+    ``True`` for digital data means that the data are already packed
+    as bytes, eight scans per byte, with the first scan in the least
+    significant bit (as produced by ``np.packbits(...,
+    bitorder="little")``).
 
     """
     def __init__(self, data: ArrayLike | Iterable[ArrayLike],
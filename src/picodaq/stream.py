@@ -1,13 +1,18 @@
 from __future__ import annotations
 import numpy as np
 import logging
+from typing import List
 
 from .device import PicoDAQ, find
-from .units import Hz, kHz, Time, Frequency, Quantity
+from .binreader import Gap
+from .recorder import Recorder
+from .timebase import TimeBase
+from .units import Hz, kHz, s, Time, Frequency, Quantity
 from .decorators import with_doc
 
 MINRATE = 100 * Hz
 MAXRATE = 330 * kHz
+BACKGROUNDBUFFER = 10 * s
 
 log = logging.getLogger()
 
@@ -130,6 +135,14 @@ class Stream:
     @with_doc(PicoDAQ.immediate)
     def immediate(self):
         self.dev.immediate()
+
+    @with_doc(PicoDAQ.stats)
+    def stats(self):
+        return self.dev.stats()
+
+    @with_doc(PicoDAQ.onnearfull)
+    def onnearfull(self, callback, threshold="nearfull"):
+        self.dev.onnearfull(callback, threshold)
         
     def commit(self):
         pass
@@ -137,8 +150,78 @@ class Stream:
 class IStream(Stream):
     def __init__(self, port: str | None = None,
                  rate: Frequency = None,
-                 serno: str | None = None):
+                 serno: str | None = None,
+                 background: bool | Time = False,
+                 fillgaps: bool = False):
         super().__init__(port, rate, serno=serno)
+        if background is True:
+            background = BACKGROUNDBUFFER
+        self.background = background if background else None
+        self.fillgaps = fillgaps
+
+    @with_doc(Stream.open)
+    def open(self) -> None:
+        """If the stream was constructed with the `background` option,
+        the device is switched to background reading. Likewise, the
+        `fillgaps` option switches the device to gap-tolerant
+        reading. These options affect all streams on the device."""
+        if self.background is not None:
+            self.dev.background = self.background
+        if self.fillgaps:
+            self.dev.fillgaps = True
+        super().open()
+
+    @property
+    def gaps(self) -> List[Gap]:
+        """Chunks lost during the current or most recent run
+
+        Only populated when the stream was constructed with the
+        `fillgaps` option. Each entry is a ``Gap`` recording the
+        number of scans acquired before the gap, the number of
+        chunks lost, and the host time (as in ``time.time()``) at
+        which the loss was detected. The missing scans take up
+        their proper place in the data returned by ``read()``, so
+        timing after a gap is preserved.
+        """
+        return list(self.dev.gaps)
+
+    def record(self, path: str,
+               amount: Time | int | None = None) -> Recorder:
+        """Record data straight to disk
+
+        Parameters:
+            path: Name of the file to create
+            amount: Amount of data to record, either in units of time,
+                or as an integer number of scans.
+
+        Returns:
+            The ``Recorder``, which reports progress through its
+            ``stats()`` method.
+
+        Data from all input streams on the device are written to the
+        file, in the form in which they arrive from the device, by a
+        background thread. Because nothing is kept in memory, there
+        is no limit to the duration of a recording other than disk
+        space. See the ``recorder`` module for the file format.
+
+        Recording starts the acquisition, which must not already be
+        running. If an `amount` is given, this waits until that much
+        data has been recorded and then stops the acquisition.
+        Otherwise, this returns immediately, and recording continues
+        until the stream is stopped or closed. In the meantime,
+        ``read()`` is not available.
+
+        """
+        if not self.isopen:
+            raise ValueError("Not open")
+        recorder = self.dev.record(path)
+        self.start()
+        if amount is not None:
+            if isinstance(amount, Quantity):
+                amount = round((amount * self.dev.rate).plain())
+            self.dev.reader.awaitscans(amount)
+            self.stop()
+        return recorder
 
     def readchunk(self):
         raise ValueError("Stream does not support reading")
@@ -186,18 +269,11 @@ class IStream(Stream):
         If no `amount` is specified at all, a single chunk is read in
         continuous mode, or a full episode in episodic mode.
 
+        Time stamps are returned as a ``TimeBase``, which behaves like
+        an array but only computes the times when they are used.
+
         """
-        if not self.isopen:
-            raise ValueError("Not open")
-        if not self.dev.reader:
-            self.start() 
-        epichunks = self.dev.params.get('nchunks', 0)
-        if isinstance(amount, Quantity):
-            amount = round((amount * self.dev.rate).plain())
-        elif amount is None:
-            amount = self.dev.nscans
-            if epichunks:
-                amount *= epichunks
+        amount = self._prepareread(amount)
         data = []
         got = 0
         while got < amount:
@@ -206,22 +282,61 @@ class IStream(Stream):
                 break
             data.append(dat)
             got += len(dat) * self.scanspersample
-        if data:
+        if len(data) == 1:
+            data = data[0]
+        elif data:
             data = np.concatenate(data, 0)
         else:
             if times:
-                return np.array([]), np.array([])
+                return np.array([]), self._advance(0, True)
             else:
                 return np.array([])
+        times1 = self._advance(len(data) * self.scanspersample, times)
         if times:
-            times = self.offset + np.arange(len(data) * self.scanspersample,
-                                            dtype=np.float32)
-            if epichunks:
-                times %= epichunks * self.dev.nscans
-            times /= self.dev.rate.as_("Hz")
-            self.offset += len(data) * self.scanspersample
-            return data, times
+            return data, times1
         else:
-            self.offset += len(data) * self.scanspersample
             return data
+
+    def _prepareread(self, amount: Time | int | None) -> int:
+        """Start if needed and convert `amount` to a number of scans"""
+        if not self.isopen:
+            raise ValueError("Not open")
+        if self.dev.recorder:
+            raise ValueError("Data are being recorded to disk")
+        if not self.dev.reader:
+            self.start() 
+        if isinstance(amount, Quantity):
+            amount = round((amount * self.dev.rate).plain())
+        elif amount is None:
+            amount = self.dev.nscans
+            epichunks = self.dev.params.get('nchunks', 0)
+            if epichunks:
+                amount *= epichunks
+        return amount
+
+    def _advance(self, nscans: int, times: bool) -> TimeBase | None:
+        """Account for `nscans` scans read
+
+        Returns their time stamps if `times` is set.
+        """
+        if times:
+            epichunks = self.dev.params.get('nchunks', 0)
+            times = TimeBase(self.offset, nscans, self.dev.rate.as_("Hz"),
+                             epichunks * self.dev.nscans)
+        else:
+            times = None
+        self.offset += nscans
+        return times
+
+    def _scantimes(self, scans: np.ndarray) -> np.ndarray:
+        """Time stamps of scans, in seconds since start of run
+
+        In episodic mode, times are relative to the start of each
+        episode. `scans` is modified in place if it is floating point.
+        """
+        epichunks = self.dev.params.get('nchunks', 0)
+        if epichunks:
+            scans %= epichunks * self.dev.nscans
+        return np.divide(scans, self.dev.rate.as_("Hz"),
+                         out=scans if scans.dtype.kind == "f" else None)
         
@@ -0,0 +1,123 @@
+import numpy as np
+import time
+from typing import Callable, Dict, Any
+
+INBUFLEVELS = ("empty", "continue", "nearfull", "full")
+
+# Edges of the histogram of chunk inter-arrival times, in seconds
+ARRIVALBINS = np.concatenate(([0], 10.0 ** np.arange(-5, 1.01, 0.25),
+                              [np.inf]))
+
+
+class Telemetry:
+    """Running statistics from the flags and status of every chunk
+
+    Parameters:
+
+        chunktime: duration of a chunk of input, in seconds
+
+    The first word of every chunk of binary data carries the flags and
+    the status (output queue depth). Rather than keeping only those of
+    the most recent chunk, this class accumulates:
+
+    - a histogram of the input buffer level (the FLAGS_INBUF_* bits)
+    - the number of times the level rose to "nearfull" or to "full"
+    - a histogram of the output queue depth
+    - a histogram of chunk inter-arrival times
+
+    Chunks arriving in a single read are assumed to have arrived
+    evenly spread over the time since the previous read.
+
+    An optional callback is called whenever the input buffer level
+    rises to a given threshold, so that the host can shed load before
+    the device overflows. When reading in the background, the callback
+    runs in the reader thread and should return promptly.
+
+    This is a low-level class not intended for typical users.
+    """
+    def __init__(self, chunktime: float):
+        self.chunktime = chunktime
+        self.chunks = 0
+        self.inbuf = np.zeros(len(INBUFLEVELS), np.int64)
+        self.rises = np.zeros(len(INBUFLEVELS), np.int64)
+        self.outqueue = np.zeros(256, np.int64)
+        self.arrival = np.zeros(len(ARRIVALBINS) - 1, np.int64)
+        self.maxarrival = 0.0
+        self.level = 0 # input buffer level of the latest chunk
+        self.lastarrival = time.monotonic()
+        self.callback = None
+        self.threshold = 2
+
+    def setcallback(self, callback: Callable[[str, Dict[str, Any]], None]
+                    | None, threshold: str = "nearfull") -> None:
+        """Call `callback` when the input buffer level reaches `threshold`
+
+        The callback receives the name of the level reached and the
+        current ``stats()``. Pass None to remove the callback.
+        """
+        if threshold not in INBUFLEVELS[1:]:
+            raise ValueError(f"Threshold must be one of {INBUFLEVELS[1:]}")
+        self.callback = callback
+        self.threshold = INBUFLEVELS.index(threshold)
+
+    def update(self, words: np.ndarray, now: float | None = None) -> None:
+        """Take note of the first words of a series of chunks"""
+        n = len(words)
+        if n == 0:
+            return
+        if now is None:
+            now = time.monotonic()
+        words = words.astype(np.uint16)
+        levels = (words & 0x30) >> 4
+        self.inbuf += np.bincount(levels, minlength=len(INBUFLEVELS))
+        self.outqueue += np.bincount(words >> 8, minlength=256)
+        prev = np.concatenate(([self.level], levels[:-1]))
+        rising = levels > prev
+        risen = np.zeros(len(INBUFLEVELS), np.int64)
+        for lvl in range(2, len(INBUFLEVELS)):
+            risen[lvl] = np.count_nonzero(rising & (levels >= lvl)
+                                          & (prev < lvl))
+        self.rises += risen
+        crossed = np.any(rising & (levels >= self.threshold)
+                         & (prev < self.threshold))
+        self.level = int(levels[-1])
+        dt = (now - self.lastarrival) / n
+        self.arrival[np.searchsorted(ARRIVALBINS, dt, "right") - 1] += n
+        self.maxarrival = max(self.maxarrival, dt)
+        self.lastarrival = now
+        self.chunks += n
+        if crossed and self.callback:
+            self.callback(INBUFLEVELS[int(levels.max())], self.stats())
+
+    def stats(self) -> Dict[str, Any]:
+        """Statistics so far
+
+        Returns a dictionary with the following entries:
+
+            chunks: number of chunks received
+            inbuf: number of chunks reporting each input buffer level
+            nearfull: number of times the level rose to "nearfull"
+                      or beyond
+            full: number of times the level rose to "full"
+            level: input buffer level reported by the latest chunk
+            outqueue: histogram of output queue depth (256 bins)
+            meanoutqueue: mean output queue depth
+            arrivaledges: edges of the inter-arrival time bins, in
+                          seconds
+            arrival: histogram of chunk inter-arrival times
+            maxarrival: longest (estimated) inter-arrival time
+            chunktime: nominal time between chunks
+
+        """
+        n = max(self.chunks, 1)
+        return {"chunks": self.chunks,
+                "inbuf": dict(zip(INBUFLEVELS, self.inbuf.tolist())),
+                "nearfull": int(self.rises[2]),
+                "full": int(self.rises[3]),
+                "level": INBUFLEVELS[self.level],
+                "outqueue": self.outqueue.copy(),
+                "meanoutqueue": float(self.outqueue @ np.arange(256)) / n,
+                "arrivaledges": ARRIVALBINS,
+                "arrival": self.arrival.copy(),
+                "maxarrival": self.maxarrival,
+                "chunktime": self.chunktime}
@@ -0,0 +1,122 @@
+import numpy as np
+from numpy.lib.mixins import NDArrayOperatorsMixin
+from typing import Iterable, Tuple
+
+
+class TimeBase(NDArrayOperatorsMixin):
+    """Time stamps of a run of consecutive scans, computed on demand
+
+    Parameters:
+
+        start: index of the first scan since the start of the run
+        count: number of scans
+        rate: sampling rate, in Hz
+        period: number of scans per episode, or 0 in continuous mode
+        offset: time added to each time stamp, in seconds
+
+    Rather than an array of times, this holds just the index of the
+    first scan and the sampling rate, so that it takes no memory to
+    speak of, however many scans it covers. Time stamps are computed
+    from integer scan indices, so they remain exact (to double
+    precision) for arbitrarily long runs. In episodic mode, time
+    stamps are relative to the start of each episode. The `offset`
+    accounts for delays, such as that of a decimation filter.
+
+    A ``TimeBase`` behaves like a vector of times in seconds: it has a
+    length, may be indexed and sliced, takes part in arithmetic, and
+    is accepted by numpy functions, which see it as an array of 64-bit
+    floats. Use ``np.asarray()`` to obtain that array explicitly, or
+    ``scans`` for the (integer) scan indices. Like an array, it has
+    ``shape``, ``ndim``, ``size``, and ``dtype`` attributes, and an
+    ``astype()`` method.
+    """
+    ndim = 1
+    dtype = np.dtype(np.float64)
+
+    def __init__(self, start: int, count: int, rate: float,
+                 period: int = 0, offset: float = 0):
+        self.start = int(start)
+        self.count = int(count)
+        self.rate = float(rate)
+        self.period = int(period)
+        self.offset = float(offset)
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def shape(self) -> Tuple[int]:
+        return (self.count,)
+
+    @property
+    def size(self) -> int:
+        return self.count
+
+    def astype(self, dtype) -> np.ndarray:
+        """The time stamps as a new array of the given type"""
+        return np.asarray(self, dtype)
+
+    def __repr__(self) -> str:
+        return (f"TimeBase(start={self.start}, count={self.count}, "
+                f"rate={self.rate:g}, period={self.period}, "
+                f"offset={self.offset:g})")
+
+    @property
+    def scans(self) -> np.ndarray:
+        """Scan indices (since start of episode in episodic mode)"""
+        scans = np.arange(self.start, self.start + self.count,
+                          dtype=np.int64)
+        if self.period:
+            scans %= self.period
+        return scans
+
+    def time(self, k: int) -> float:
+        """Time stamp of the `k`-th scan, in seconds"""
+        if k < 0:
+            k += self.count
+        if k < 0 or k >= self.count:
+            raise IndexError("TimeBase index out of range")
+        scan = self.start + k
+        if self.period:
+            scan %= self.period
+        return scan / self.rate + self.offset
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.count)
+            if step == 1:
+                return TimeBase(self.start + start, max(stop - start, 0),
+                                self.rate, self.period, self.offset)
+        elif np.ndim(index) == 0:
+            return self.time(int(index))
+        return np.asarray(self)[index]
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        times = self.scans / self.rate
+        if self.offset:
+            times += self.offset
+        return times if dtype is None else times.astype(dtype, copy=False)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        inputs = [np.asarray(x) if isinstance(x, TimeBase) else x
+                  for x in inputs]
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    @staticmethod
+    def join(bases: Iterable["TimeBase"]) -> "TimeBase | np.ndarray":
+        """Combine time bases of successive reads
+
+        Returns a single ``TimeBase`` if the reads were consecutive,
+        or a plain array otherwise.
+        """
+        bases = list(bases)
+        first = bases[0]
+        start = first.start
+        for base in bases:
+            if base.start != start or base.rate != first.rate \
+               or base.period != first.period \
+               or base.offset != first.offset:
+                return np.concatenate([np.asarray(b) for b in bases])
+            start += base.count
+        return TimeBase(first.start, start - first.start,
+                        first.rate, first.period, first.offset)
@@ -1,10 +1,11 @@
 import numpy as np
 from typing import Iterable, Dict
-import warnings
 import logging
 
 log = logging.getLogger()
 
+JITMIN = 2_000_000 # Minimum length of data worth compiling the checksum for
+
 
 def makemask(channels: Iterable[int] | Dict) -> int:
     if isinstance(channels, dict):
@@ -43,18 +44,111 @@ def roundup(number: int, modulo: int):
     return modulo * ((number + modulo - 1) // modulo)
 
 
-def checksum(wav: np.ndarray) -> np.uint32:
-    chk = np.uint32(0)
-    with warnings.catch_warnings(action="ignore",
-                                 category=RuntimeWarning) as f:
-        for y in wav:
-            chk += np.uint16(y)
-            chk += chk << 10 # integer overflow ignored
-            chk = chk & 0x7fffffff
-            chk ^= (chk >> 5)
+def _checksumkernel(data) -> int:
+    chk = 0
+    for y in data:
+        # Same as the firmware's 32-bit arithmetic: chk += y;
+        # chk += chk << 10; chk &= 0x7fffffff; chk ^= chk >> 5
+        chk = ((chk + y) * 1025) & 0x7fffffff
+        chk ^= chk >> 5
     return chk
 
 
+def _checksumrows(data: np.ndarray) -> np.ndarray:
+    """Checksums of the rows of a 2-D array of uint16, computed together"""
+    chk = np.zeros(len(data), np.uint32)
+    tmp = np.empty_like(chk)
+    for y in np.ascontiguousarray(data.T):
+        # In uint32, (chk + y) * 1025 wraps modulo a multiple of 2^31
+        chk += y
+        chk *= 1025
+        chk &= 0x7fffffff
+        np.right_shift(chk, 5, out=tmp)
+        chk ^= tmp
+    return chk
+
+
+_checksumjit = None # compiled kernel, once needed; False if unavailable
+
+
+def _jit():
+    global _checksumjit
+    if _checksumjit is None:
+        try:
+            import numba
+        except ImportError:
+            _checksumjit = False
+        else:
+            _checksumjit = numba.njit(cache=True)(_checksumkernel)
+    return _checksumjit
+
+
+def checksum(wav: np.ndarray) -> np.uint32 | np.ndarray:
+    """Checksum of int16 data as calculated by the picoDAQ firmware
+
+    If `wav` is a 2-D array, the checksums of its rows are returned as
+    an array. They are calculated in lockstep, which is vectorized
+    with numpy and therefore much faster than calculating them one at
+    a time.
+
+    The checksum of a single vector is inherently sequential. Vectors
+    of at least `JITMIN` samples are compiled with numba, if that is
+    installed (``pip install picodaq[fast]``), which makes them several
+    hundred times faster. Shorter vectors do not repay the cost of
+    importing and compiling, unless that has already happened.
+    """
+    data = np.asarray(wav).astype(np.uint16)
+    if data.ndim == 2:
+        return _checksumrows(data)
+    if len(data) >= JITMIN or (_checksumjit and len(data) >= 1000):
+        jit = _jit()
+        if jit:
+            return np.uint32(jit(data))
+    return np.uint32(_checksumkernel(data.tolist()))
+
+
+def transitions(packed: np.ndarray, nlines: int,
+                last: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """Find state changes in packed digital data
+
+    Parameters:
+
+        packed: bytes of digital data, with `nlines` lines interleaved,
+                packed in little-endian bit order
+        nlines: number of lines (1, 2, or 4)
+        last: the byte preceding `packed` in the data stream, or None
+              to report the state of each line in the first scan as a
+              change
+
+    Returns:
+
+        bits — the positions of the changes in the stream of bits,
+            from which the scan is ``bits // nlines`` and the line
+            ``bits % nlines``
+        states — the new state of the line at each change
+
+    Each bit is compared to the bit `nlines` positions earlier by
+    shifting whole bytes, so that only bytes that actually contain a
+    change need to be unpacked.
+    """
+    packed = np.asarray(packed, np.uint8)
+    if len(packed) == 0:
+        return np.zeros(0, np.int64), np.zeros(0, np.uint8)
+    if last is None:
+        first = int(packed[0]) & ((1 << nlines) - 1)
+        last = (~first << (8 - nlines)) & 255
+    changed = np.left_shift(packed, nlines)
+    changed[0] |= last >> (8 - nlines)
+    changed[1:] |= packed[:-1] >> (8 - nlines)
+    changed ^= packed
+    idx = np.flatnonzero(changed)
+    flags = np.unpackbits(changed[idx], bitorder="little").reshape(-1, 8)
+    which, bit = np.nonzero(flags)
+    bits = 8 * idx[which].astype(np.int64) + bit
+    states = (packed[idx[which]] >> bit.astype(np.uint8)) & 1
+    return bits, states
+
+
 class NScanCalc:
     def __init__(self, aimask, dimask):
         self.aimask = aimask
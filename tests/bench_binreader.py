@@ -0,0 +1,133 @@
+#!env python3
+
+"""Benchmark of the host-side cost of reading binary data
+
+The byte stream is first recorded from the emulator and then replayed
+through a trivial serial port, so that only the work done by
+``BinaryReader`` is measured. The block-by-block reading loop that
+``BinaryReader`` used before bulk reads is included for comparison.
+
+Run as
+
+    python bench_binreader.py [megabytes]
+
+"""
+
+import sys
+import time
+import numpy as np
+
+sys.path.append("../software")
+
+from picodaq import emulator
+from picodaq.device import PicoDAQ
+from picodaq.binreader import BinaryReader
+from picodaq.utils import NScanCalc
+
+
+class ReplaySerial:
+    """Serial port that plays back recorded data"""
+    is_open = False
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.view = memoryview(data)
+        self.pos = 0
+
+    @property
+    def in_waiting(self):
+        return len(self.data) - self.pos
+
+    def write(self, data):
+        return len(data)
+
+    def read(self, size=1):
+        res = bytes(self.view[self.pos:self.pos+size])
+        self.pos += len(res)
+        return res
+
+    def readinto(self, buf):
+        n = min(len(buf), len(self.data) - self.pos)
+        buf[:n] = self.view[self.pos:self.pos+n]
+        self.pos += n
+        return n
+
+    def read_until(self, expected=b"\n", size=None):
+        idx = self.data.find(expected, self.pos)
+        end = len(self.data) if idx < 0 else idx + len(expected)
+        if size is not None:
+            end = min(end, self.pos + size)
+        return self.read(end - self.pos)
+
+    def readline(self):
+        return self.read_until(b"\n")
+
+
+class LegacyReader(BinaryReader):
+    """BinaryReader with the old block-by-block reading loop"""
+    def _readchunk(self):
+        data = []
+        while len(data) < self.blocksperchunk:
+            x = self.dev._read(64)
+            if not data and x.startswith(b"**ASCII"):
+                self.active = False
+                self.dev._ungets(x)
+                return self.dev._handlestop(True)
+            data.append(x)
+        self.nn += 1
+        self.parsedata(np.concatenate([np.frombuffer(blk, np.int16)
+                                       for blk in data]))
+
+
+def record(aimask: int, dimask: int, nscans: int, megabytes: float) -> bytes:
+    nblocks = int(megabytes * 1e6 / 64) + 1024
+    emu = emulator.VirtualPicoDAQ(realtime=False, maxbytespersec=None,
+                                  inbufblocks=nblocks)
+    emu.receive(bytes(f"rate 300000\naimask {aimask}\ndimask {dimask}\n"
+                      + f"nscans {nscans}\nstart\n", "utf8"))
+    emu.produce(emu.available() + int(megabytes * 1e6))
+    data = emu.take(emu.available())
+    emu.receive(b"stop\n")
+    return data + emu.take(emu.available())
+
+
+def bench(readerclass, channels, lines, megabytes):
+    aimask = sum(1 << c for c in channels)
+    dimask = sum(1 << l for l in lines)
+    nscans = int(NScanCalc(aimask, dimask).bestforcont())
+    stream = record(aimask, dimask, nscans, megabytes)
+    dev = PicoDAQ("emu0")
+    dev.setaichannels(channels)
+    dev.setdilines(lines)
+    dev.nscans = nscans
+    dev.ser = ReplaySerial(stream)
+    t0 = time.process_time()
+    reader = readerclass(dev)
+    while reader.active:
+        reader.read()
+        while reader.hasadata():
+            reader.fetchadata()
+        while reader.hasddata():
+            reader.fetchddata()
+    dt = time.process_time() - t0
+    return dt / (len(stream) / 1e6)
+
+
+def main():
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 20
+    emulator.install(realtime=False, maxbytespersec=None)
+    try:
+        print("Configuration      Legacy (ms/MB)  Current (ms/MB)")
+        for channels, lines in [([0], []),
+                                ([0, 1, 2, 3], []),
+                                ([0, 1, 2, 3], [0, 1, 2, 3])]:
+            old = bench(LegacyReader, channels, lines, megabytes)
+            new = bench(BinaryReader, channels, lines, megabytes)
+            cfg = f"AI {len(channels)} DI {len(lines)}"
+            print(f"{cfg:18} {1e3*old:14.1f}  {1e3*new:15.1f}")
+    finally:
+        emulator.uninstall()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!env python3
+
+"""Benchmark of the host-side cost of producing sampled digital output
+
+Chunks are prepared by ``BinaryWriter`` and written to a serial port
+that discards them, so that only the encoding is measured. The
+encoder that ``BinaryWriter`` used before packing each line directly,
+through a matrix of bits, is included for comparison.
+
+Run as
+
+    python bench_binwriter.py [seconds]
+
+where `seconds` is the duration of the output at the maximum rate.
+
+"""
+
+import sys
+import time
+import numpy as np
+
+sys.path.append("../software")
+
+from picodaq import emulator
+from picodaq.device import PicoDAQ
+from picodaq.binwriter import BinaryWriter
+from picodaq.stimulus import Sampled
+from picodaq.utils import NScanCalc, makemask, checksum
+
+
+RATE = 330e3
+
+
+class NullSerial:
+    """Serial port that discards everything"""
+    def write(self, data):
+        return len(data)
+
+
+class LegacyWriter(BinaryWriter):
+    """Encoding through a matrix of bits, as before direct packing
+
+    Every line is expanded into a column of booleans, and pre-packed
+    data are unpacked first, before the whole matrix is packed.
+    """
+    def _tobits(self, c, yy):
+        if self.draw[c]:
+            return np.unpackbits(np.asarray(yy, np.uint8), bitorder="little")
+        return np.asarray(yy)
+
+    def _finitechunks(self):
+        lengths = [len(self.adata[c]) for c in self.channels] \
+            + [len(self.ddata[c]) for c in self.lines]
+        return max(lengths, default=0) // self.nscans + 1
+
+    def _encodeall(self, nchunks):
+        self._encoded = np.zeros((nchunks, self.blocksperchunk*32), np.int16)
+        for k in range(nchunks):
+            self._assemble(self._encoded[k], k)
+        self._checksums = checksum(self._encoded)
+
+    def _fillddata(self, data, i0):
+        if not self.lines:
+            return 0
+        bits = np.zeros((self.nscans, len(self.lines)), bool)
+        fin = 0
+        for k, c in enumerate(self.lines):
+            n0 = 0
+            while n0 < self.nscans:
+                M = self.nscans - n0
+                if self.ddata[c] is None:
+                    fin += 1
+                    break
+                else:
+                    M = min(M, len(self.ddata[c]))
+                    np.not_equal(self.ddata[c][:M], 0, out=bits[n0:n0+M, k])
+                    n0 += M
+                    if M < len(self.ddata[c]):
+                        self.ddata[c] = self.ddata[c][M:]
+                    elif c in self.dgen:
+                        try:
+                            self.ddata[c] = self._tobits(c,
+                                                         next(self.dgen[c]))
+                        except StopIteration:
+                            self.ddata[c] = None
+                    else:
+                        self.ddata[c] = None
+        packed = np.packbits(bits, axis=None, bitorder="little")
+        data.view(np.uint8)[2*i0:2*i0+len(packed)] = packed
+        return fin
+
+
+def bench(cls, dev, lines, seconds, raw):
+    N = int(RATE * seconds)
+    rng = np.random.default_rng(1)
+    if raw:
+        dsources = {c: Sampled(rng.integers(0, 256, N // 8, np.uint8),
+                               raw=True) for c in lines}
+    else:
+        dsources = {c: Sampled(rng.random(N) < 0.5) for c in lines}
+    nscans = NScanCalc(0, makemask(lines)).bestforcont()
+    # Finite data are encoded when the writer is created, so that is
+    # part of the cost.
+    t0 = time.perf_counter()
+    writer = cls(dev, nscans, {}, dsources)
+    ser = dev.ser
+    dev.ser = NullSerial()
+    try:
+        nchunks = 0
+        while writer.sendchunk(False):
+            nchunks += 1
+        dt = time.perf_counter() - t0
+    finally:
+        dev.ser = ser
+    return dt / nchunks, nscans
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    emulator.install(realtime=False)
+    dev = PicoDAQ("emu0")
+    dev.open()
+    try:
+        print("Lines  Raw  Scans/chunk  Legacy (us/chunk)"
+              "  Current (us/chunk)  CPU load")
+        for raw in [False, True]:
+            for lines in [[0], [0, 1], [0, 1, 2, 3]]:
+                old, nscans = bench(LegacyWriter, dev, lines, seconds, raw)
+                new, nscans = bench(BinaryWriter, dev, lines, seconds, raw)
+                load = new * RATE / nscans
+                print(f"{len(lines):5}  {'yes' if raw else 'no':>3}"
+                      f"  {nscans:11}  {1e6*old:17.1f}"
+                      f"  {1e6*new:18.1f}  {100*load:7.2f}%")
+    finally:
+        dev.close()
+        emulator.uninstall()
+
+
+if __name__ == "__main__":
+    main()
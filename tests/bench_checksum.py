@@ -0,0 +1,66 @@
+#!env python3
+
+"""Benchmark of the checksum used for wave and output data uploads
+
+Run as
+
+    python bench_checksum.py [samples]
+
+"""
+
+import sys
+import time
+import warnings
+import numpy as np
+
+sys.path.append("../software")
+
+from picodaq import utils
+
+
+def reference(wav):
+    """The original sample-by-sample implementation"""
+    chk = np.uint32(0)
+    with warnings.catch_warnings(action="ignore",
+                                 category=RuntimeWarning) as f:
+        for y in wav:
+            chk += np.uint16(y)
+            chk += chk << 10 # integer overflow ignored
+            chk = chk & 0x7fffffff
+            chk ^= (chk >> 5)
+    return chk
+
+
+def timeit(func, wav, repeats=3):
+    best = np.inf
+    for k in range(repeats):
+        t0 = time.perf_counter()
+        res = func(wav)
+        best = min(best, time.perf_counter() - t0)
+    return best, res
+
+
+def main():
+    N = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    wav = np.random.default_rng(1).integers(-32768, 32768, N, np.int16)
+    jit = utils._jit() # compile, if numba is available
+    if jit:
+        jit(wav[:10].astype(np.uint16))
+    t_ref, chk_ref = timeit(reference, wav, 1)
+    t_py, chk_py = timeit(lambda w: utils._checksumkernel(
+        w.astype(np.uint16).tolist()), wav)
+    print(f"{N} samples")
+    print(f"  original:  {t_ref*1e3:9.1f} ms")
+    print(f"  python:    {t_py*1e3:9.1f} ms")
+    rows = wav[:len(wav) // 1000 * 1000].reshape(1000, -1)
+    t_rows, chk_rows = timeit(utils.checksum, rows)
+    print(f"  numpy:     {t_rows*1e3:9.1f} ms (as 1000 rows)")
+    if jit:
+        t_jit, chk_jit = timeit(lambda w: jit(w.astype(np.uint16)), wav)
+        print(f"  numba:     {t_jit*1e3:9.1f} ms")
+        assert chk_jit == chk_ref
+    assert chk_py == chk_ref
+
+
+if __name__ == "__main__":
+    main()
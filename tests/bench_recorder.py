@@ -0,0 +1,81 @@
+#!env python3
+
+"""Benchmark of the host-side cost of recording to disk
+
+As in ``bench_binreader.py``, a byte stream is first recorded from
+the emulator and then replayed, so that only host-side work is
+measured. Four analog channels at 300 kS/s are either read into
+memory or recorded to a file, and the CPU time is reported as a
+fraction of the duration of the data.
+
+Run as
+
+    python bench_recorder.py [seconds] [path]
+
+"""
+
+import sys
+import os
+import time
+import tempfile
+
+sys.path.append("../software")
+
+from picodaq import emulator
+from picodaq.device import PicoDAQ
+from picodaq.binreader import BinaryReader
+from picodaq.recorder import Recorder
+from picodaq.units import Hz
+from picodaq.utils import NScanCalc
+from bench_binreader import ReplaySerial, record
+
+
+RATE = 300000
+CHANNELS = [0, 1, 2, 3]
+
+
+def bench(stream, nscans, path):
+    dev = PicoDAQ("emu0")
+    dev.setaichannels(CHANNELS)
+    dev.nscans = nscans
+    dev.rate = RATE * Hz
+    dev.igain = 1.0
+    dev.ioffset = 0.0
+    dev.ser = ReplaySerial(stream)
+    recorder = Recorder(path) if path else None
+    t0 = time.process_time()
+    reader = BinaryReader(dev, 64, recorder=recorder)
+    if recorder:
+        reader.thread.join()
+        recorder.close()
+    else:
+        while reader.active:
+            reader.read()
+            while reader.hasadata():
+                reader.fetchadata(1 << 20)
+    return time.process_time() - t0
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    path = sys.argv[2] if len(sys.argv) > 2 \
+        else os.path.join(tempfile.gettempdir(), "bench_recorder.pdaq")
+    aimask = sum(1 << c for c in CHANNELS)
+    nscans = int(NScanCalc(aimask, 0).bestforcont())
+    megabytes = seconds * RATE * len(CHANNELS) * 2 / 1e6
+    emulator.install(realtime=False, maxbytespersec=None)
+    try:
+        stream = record(aimask, 0, nscans, megabytes)
+        inmem = bench(stream, nscans, None)
+        todisk = bench(stream, nscans, path)
+    finally:
+        emulator.uninstall()
+        if len(sys.argv) <= 2 and os.path.exists(path):
+            os.remove(path)
+    print(f"{seconds:.0f} s of 4 x 300 kS/s ({megabytes:.0f} MB)")
+    print(f"Read into memory:  {100*inmem/seconds:5.2f}% of one core")
+    print(f"Recorded to disk:  {100*todisk/seconds:5.2f}% of one core")
+
+
+if __name__ == "__main__":
+    main()
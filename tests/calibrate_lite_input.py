@@ -4,6 +4,7 @@
 # stored in firmware.
 
 import sys
+import os
 import time
 import numpy as np
 import matplotlib.pyplot as plt
@@ -13,6 +14,7 @@ from physfit import fit
 
 
 sys.path.append("../software")
+os.environ["PICODAQ_CALIBRATION"] = "" # ignore per-channel calibration
 
 from picodaq import stimulus, V, s, ms, kHz, AnalogOut, AnalogIn, mockstim, DigitalOut
 
@@ -2,6 +2,7 @@
 # AO0 or AO1
 
 import sys
+import os
 import time
 import numpy as np
 import matplotlib.pyplot as plt
@@ -11,6 +12,7 @@ from physfit import fit
 
 
 sys.path.append("../software")
+os.environ["PICODAQ_CALIBRATION"] = "" # ignore per-channel calibration
 
 from picodaq import stimulus, V, s, ms, kHz, AnalogOut, AnalogIn, mockstim, DigitalOut
 
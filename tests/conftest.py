@@ -0,0 +1,49 @@
+#!env python3
+
+import pytest
+import sys
+
+sys.path.append("../software")
+
+from picodaq import emulator
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "emulator(**options): options for the emu fixture")
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    """Device cache private to the test
+
+    Yields the path of the cache file. Emulated devices that the test
+    installs itself are removed afterwards.
+    """
+    path = tmp_path / "devices.json"
+    monkeypatch.setenv("PICODAQ_CACHE", str(path))
+    yield path
+    emulator.uninstall()
+
+
+@pytest.fixture
+def emu(request, cache):
+    """Emulated picoDAQ on port "emu0", with a private device cache
+
+    The emulator runs in real time unless told otherwise. Options for
+    ``emulator.install()`` are taken from an ``emulator`` marker on
+    the test or its module, as in
+
+        @pytest.mark.emulator(realtime=False)
+
+    or from indirect parametrization of this fixture, as in
+
+        @pytest.mark.parametrize("emu", [{"realtime": False}],
+                                 indirect=True)
+    """
+    options = {}
+    marker = request.node.get_closest_marker("emulator")
+    if marker:
+        options.update(marker.kwargs)
+    options.update(getattr(request, "param", {}))
+    yield emulator.install(**options)
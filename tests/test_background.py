@@ -0,0 +1,59 @@
+#!env python3
+
+import pytest
+import sys
+import time
+import numpy as np
+
+sys.path.append("../software")
+
+from picodaq import AnalogIn, DigitalIn, AnalogOut, kHz, ms, s, V, DeviceError
+from picodaq import emulator, stimulus
+
+
+def test_slow_consumer(emu):
+    # Without background reading, this pause overflows the device
+    with AnalogIn(channels=[0, 1], rate=20*kHz, background=True) as ai:
+        dat1 = ai.read(1000, raw=True)
+        time.sleep(1.5)
+        dat2 = ai.read(40000, raw=True)
+    expect, _ = emulator.pattern(np.arange(41000))
+    assert np.array_equal(np.concatenate([dat1, dat2]), expect[:, [0, 1]])
+
+
+def test_bounded(emu):
+    with AnalogIn(channels=[0, 1], rate=20*kHz, background=200*ms) as ai:
+        ai.read(1000)
+        time.sleep(1.5)
+        with pytest.raises(DeviceError):
+            ai.read(40000)
+
+
+def test_digital(emu):
+    with DigitalIn(lines=[0, 1], rate=10*kHz, background=True) as di:
+        time.sleep(0.2)
+        data = di.read(4000)
+    _, expect = emulator.pattern(np.arange(len(data)))
+    assert np.array_equal(data, expect[:, [0, 1]])
+
+
+def test_run(emu):
+    pulse = stimulus.Square(1*V, 10*ms)
+    train = stimulus.Train(pulse, 3, pulseperiod=100*ms)
+    with AnalogIn(channel=0, rate=10*kHz, background=True) as ai:
+        with AnalogOut() as ao:
+            ao[0].stimulus(train)
+            t0 = time.time()
+            ao.run()
+            dt = time.time() - t0
+            data = ai.readall()
+    assert 0.22 < dt < 0.4
+    assert len(data) >= 2200
+
+
+def test_episodic_end(emu):
+    with AnalogIn(channel=0, rate=10*kHz, background=True) as ai:
+        ai.episodic(duration=20*ms, period=30*ms, count=3)
+        data = [ai.read() for k in range(4)]
+    assert [len(d) for d in data[:3]] == [len(data[0])] * 3
+    assert len(data[3]) == 0
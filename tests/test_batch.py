@@ -0,0 +1,195 @@
+#!env python3
+
+import pytest
+import sys
+import time
+import numpy as np
+
+sys.path.append("../software")
+
+from picodaq import AnalogIn, AnalogOut, DigitalOut, kHz, ms, V
+from picodaq import stimulus
+from picodaq.device import PicoDAQ
+from picodaq.errors import DeviceError
+
+
+pytestmark = pytest.mark.emulator(realtime=False)
+
+
+@pytest.fixture
+def emu(emu, monkeypatch):
+    writes = []
+    receive = emu.receive
+    def counting(data):
+        writes.append(data)
+        receive(data)
+    monkeypatch.setattr(emu, "receive", counting)
+    emu.writes = writes
+    return emu
+
+
+def test_feedback(emu):
+    dev = PicoDAQ("emu0")
+    dev.open()
+    try:
+        with pytest.raises(DeviceError, match="bogus 1"):
+            with dev.batch():
+                r1 = dev.command("rate 20000")
+                r2 = dev.command("bogus 1")
+                r3 = dev.command("aimask 5")
+                assert r1 == []
+        assert dev.params["rate"] == 20000
+        assert dev.params["aimask"] == 5
+        assert r1[-1] == "+rate 20000"
+        assert any(line.startswith("!") for line in r2)
+        assert r3 == ["+aimask 5"]
+    finally:
+        dev.close()
+
+
+def test_unbatchederror(emu, caplog):
+    # Outside a batch, errors are logged and returned, not raised
+    dev = PicoDAQ("emu0")
+    dev.open()
+    try:
+        with caplog.at_level("ERROR"):
+            r1 = dev.command("bogus 1")
+        r2 = dev.command("aimask 5")
+        assert any(line.startswith("!") for line in r1)
+        assert "bogus 1" in caplog.text
+        assert r2 == ["+aimask 5"]
+    finally:
+        dev.close()
+
+
+def test_missingreply(emu, monkeypatch):
+    dev = PicoDAQ("emu0")
+    dev.open()
+    monkeypatch.setattr(emu, "_cmd_dimask", lambda msk: None)
+    try:
+        t0 = time.monotonic()
+        with pytest.raises(DeviceError, match="No reply to dimask"):
+            with dev.batch():
+                r1 = dev.command("rate 20000")
+                r2 = dev.command("dimask 1")
+                r3 = dev.command("aimask 5")
+                r4 = dev.command("bogus")
+        # The lack of a reply is detected from the next one, not by
+        # waiting for a timeout
+        assert time.monotonic() - t0 < 0.1
+        assert r1 == ["+rate 20000"]
+        assert r2 == []
+        assert r3 == ["+aimask 5"]
+        assert r4[-1] == "+bogus ??"
+        assert dev.command("nop") == ["+nop ok"]
+    finally:
+        dev.close()
+
+
+def test_single_write(emu):
+    pulse = stimulus.Square(1*V, 10*ms)
+    train = stimulus.Train(pulse, 3, pulseperiod=100*ms)
+    with AnalogOut(rate=10*kHz) as ao:
+        with DigitalOut() as do:
+            ao[0].stimulus(train)
+            ao[2].stimulus(train)
+            do[1].stimulus(stimulus.Train(stimulus.TTL(5*ms), 2,
+                                          pulseperiod=50*ms))
+            ao.commit()
+            do.commit()
+            ncommands = emu.commandcount
+            emu.writes.clear()
+            ao.committed = False
+            do.committed = False
+            ao.dev.forgetstims()
+            ao.commit()
+            do.commit()
+            ncommands = emu.commandcount - ncommands
+            assert ncommands > 30
+            assert len(emu.writes) < ncommands / 4
+
+
+def test_wave(emu):
+    wave = np.sin(np.arange(1000) * 2*np.pi / 100)
+    with AnalogIn(channel=0, rate=10*kHz) as ai:
+        with AnalogOut() as ao:
+            ao[0].stimulus(stimulus.Wave(wave, 1*V))
+            ao[1].stimulus(stimulus.Square(1*V, 10*ms))
+            ao.run()
+            assert ao.dev.params["wave"] != "??"
+
+
+def test_stimdiff(emu):
+    pulse = stimulus.Square(1*V, 10*ms)
+    with AnalogOut(rate=10*kHz) as ao:
+        ao[0].stimulus(stimulus.Train(pulse, 3, pulseperiod=100*ms))
+        ao[1].stimulus(stimulus.Train(pulse, 2, pulseperiod=100*ms))
+        ao.commit()
+        emu.writes.clear()
+        ao[0].stimulus(stimulus.Train(pulse, 4, pulseperiod=100*ms))
+        ao.commit()
+        assert emu.writes[:2] == [b"train A0 4 1000\n", b"verify\n"]
+        assert emu.stims["A0"].npulse == 4
+        emu.writes.clear()
+        ao[1].stimulus(stimulus.Wave(np.ones(100), 1*V))
+        ao.commit()
+        ao[1].stimulus(stimulus.Wave(np.ones(200), 1*V))
+        ao.commit()
+        assert emu.stims["A1"].duration == 200
+
+
+def test_wavecache(emu):
+    waves = [stimulus.Wave(np.linspace(0, 1, 1000 + k), 1*V)
+             for k in range(6)]
+    with AnalogOut(rate=10*kHz) as ao:
+        ao[0].stimulus(waves[0])
+        ao[1].stimulus(waves[1])
+        ao.commit()
+        uploads = len(emu.writes)
+        for k in range(3):
+            ao.committed = False
+            ao.commit()
+        assert not any(w.startswith(b"wave") for w in emu.writes[uploads:])
+        for wave in waves[2:]:
+            ao[0].stimulus(wave)
+            ao.commit()
+        ao[0].stimulus(waves[0])
+        emu.writes.clear()
+        ao.commit() # waves[0] was evicted
+        assert sum(w.startswith(b"wave") for w in emu.writes) == 1
+        assert emu.stims["A0"].duration == 1000
+        assert emu.stims["A1"].duration == 1001
+
+
+def test_stimfailure(emu, monkeypatch):
+    pulse = stimulus.Square(1*V, 10*ms)
+    train = stimulus.Train(pulse, 3, pulseperiod=100*ms)
+    with AnalogOut(rate=10*kHz) as ao:
+        ao[0].stimulus(train)
+        cmd_train = emu._cmd_train
+        def failing(*args):
+            raise ValueError("rejected")
+        monkeypatch.setattr(emu, "_cmd_train", failing)
+        with pytest.raises(DeviceError, match="train A0"):
+            ao.commit()
+        monkeypatch.setattr(emu, "_cmd_train", cmd_train)
+        emu.writes.clear()
+        ao.commit() # must not believe that the failed commands took
+        assert b"train A0 3 1000\n" in b"".join(emu.writes)
+        assert emu.stims["A0"].npulse == 3
+
+
+def test_stimsampled(emu):
+    pulse = stimulus.Square(1*V, 10*ms)
+    train = stimulus.Train(pulse, 3, pulseperiod=100*ms)
+    with AnalogOut(rate=10*kHz) as ao:
+        ao[0].stimulus(train)
+        ao.commit()
+        ao[0].sampled(np.zeros(1000), 1*V)
+        ao.committed = False
+        ao.commit()
+        ao[0].stimulus(train)
+        ao.committed = False
+        emu.writes.clear()
+        ao.commit()
+        assert b"train A0 3 1000\n" in b"".join(emu.writes)
@@ -0,0 +1,233 @@
+#!env python3
+
+import pytest
+import sys
+import time
+import numpy as np
+
+sys.path.append("../software")
+
+from picodaq import AnalogIn, AnalogOut, DigitalIn, DigitalOut, kHz, V
+from picodaq.binwriter import BinaryWriter
+
+
+pytestmark = pytest.mark.emulator(loopback=True)
+
+
+def test_clipping(emu):
+    wave = 1.5 * np.sin(np.arange(3000) * 2*np.pi / 300)
+    with AnalogIn(channels=[1], rate=30*kHz) as ai:
+        with AnalogOut() as ao:
+            ao[1].sampled(wave, 10*V)
+            ao.commit()
+            writer = ao.dev.writer
+            ao.run()
+            data = ai.readall()
+    expect = np.clip(10*wave, -10, 10)
+    assert np.max(np.abs(data[:3000, 0] - expect)) < 0.01
+    nclip = np.count_nonzero(np.abs(wave) > 1)
+    assert abs(writer.clipped - nclip) <= 2
+
+
+def test_reuse(emu):
+    wave = np.sin(np.arange(30000) * 2*np.pi / 300)
+    with AnalogIn(channels=[1], rate=30*kHz) as ai:
+        with AnalogOut() as ao:
+            ao[1].sampled(wave, 2*V)
+            ao.commit()
+            writer = ao.dev.writer
+            chunks = [id(c) for c in writer._chunks]
+            ao.run()
+            data = ai.readall()
+            assert writer.chunkno > 2
+            assert [id(c) for c in writer._chunks] == chunks
+    assert writer.clipped == 0
+    assert np.max(np.abs(data[:30000, 0] - 2*wave)) < 0.01
+
+
+def test_digital(emu):
+    rng = np.random.default_rng(1)
+    N = 4000
+    line0 = rng.random(N) < 0.5
+    line1 = rng.integers(0, 3, N).astype(np.uint8)
+    def blocks():
+        n0 = 0
+        while n0 < N:
+            n = rng.integers(1, 700)
+            yield line1[n0:n0+n]
+            n0 += n
+    with DigitalIn(lines=[0, 1], rate=30*kHz) as di:
+        with DigitalOut() as do:
+            do[0].sampled(line0)
+            do[1].sampled(blocks)
+            do.run()
+            data = di.readall()
+    assert np.array_equal(data[:N, 0], line0)
+    assert np.array_equal(data[:N, 1], line1 != 0)
+    assert not np.any(data[N:])
+
+
+def test_packed(emu):
+    rng = np.random.default_rng(2)
+    bits = rng.random((4000, 4)) < 0.5
+    with DigitalIn(lines=[0, 1, 2, 3], rate=30*kHz) as di:
+        with DigitalOut() as do:
+            for k in range(4):
+                packed = np.packbits(bits[:, k], bitorder="little")
+                do[k].sampled(packed, raw=True)
+            do.run()
+            data = di.readall()
+    assert np.array_equal(data[:4000], bits)
+
+
+def test_packedmixed(emu):
+    rng = np.random.default_rng(3)
+    N = 4000
+    bits = rng.random((N, 2)) < 0.5
+    packed = np.packbits(bits[:, 0], bitorder="little")
+    def blocks():
+        for k in range(0, len(packed), 75):
+            yield packed[k:k+75]
+    for src in [blocks, packed]: # chunk by chunk, and all at once
+        with DigitalIn(lines=[2, 3], rate=30*kHz) as di:
+            with DigitalOut() as do:
+                do[2].sampled(src, raw=True)
+                do[3].sampled(bits[:, 1])
+                do.run()
+                data = di.readall()
+        assert np.array_equal(data[:N], bits)
+        assert not np.any(data[N:])
+
+
+def test_packedsingle(emu):
+    rng = np.random.default_rng(4)
+    N = 4000
+    bits = rng.random(N) < 0.5
+    packed = np.packbits(bits, bitorder="little")
+    def blocks():
+        for k in range(0, len(packed), 75):
+            yield packed[k:k+75]
+    def bitblocks():
+        for k in range(0, N, 700):
+            yield bits[k:k+700]
+    for src, raw in [(packed, True), (blocks, True),
+                     (bits, False), (bitblocks, False)]:
+        with DigitalIn(lines=[1], rate=30*kHz) as di:
+            with DigitalOut() as do:
+                do[1].sampled(src, raw=raw)
+                do.run()
+                data = di.readall()
+        assert np.array_equal(data[:N, 0], bits)
+        assert not np.any(data[N:])
+
+
+def test_encoded(emu):
+    wave = np.sin(np.arange(5000) * 2*np.pi / 300)
+    raw = np.round(wave * 3000).astype(np.int16)
+    def blocks():
+        for k in range(0, len(wave), 1000):
+            yield wave[k:k+1000]
+    results = []
+    for src in [wave, blocks]:
+        with AnalogIn(channels=[0, 1], rate=30*kHz) as ai:
+            with AnalogOut() as ao:
+                ao[0].sampled(raw, raw=True)
+                ao[1].sampled(src, 2*V)
+                ao.commit()
+                results.append(ao.dev.writer._encoded)
+                ao.run()
+                data = ai.readall()
+        assert np.max(np.abs(data[:5000, 0] - raw / 3276.799)) < 0.001
+        assert np.max(np.abs(data[:5000, 1] - 2*wave)) < 0.01
+    assert results[0] is not None
+    assert results[1] is None
+
+
+def test_encodedlimit(emu, monkeypatch):
+    # Only raw data are encoded in advance regardless of size
+    monkeypatch.setattr(BinaryWriter, "MAXENCODED", 0)
+    wave = np.sin(np.arange(5000) * 2*np.pi / 300)
+    raw = np.round(wave * 3000).astype(np.int16)
+    results = []
+    for israw in [True, False]:
+        with AnalogIn(channels=[0], rate=30*kHz) as ai:
+            with AnalogOut() as ao:
+                if israw:
+                    ao[0].sampled(raw, raw=True)
+                else:
+                    ao[0].sampled(wave, 2*V)
+                ao.commit()
+                results.append(ao.dev.writer._encoded)
+                ao.run()
+                data = ai.readall()
+        expect = raw / 3276.799 if israw else 2*wave
+        assert np.max(np.abs(data[:5000, 0] - expect)) < 0.01
+    assert results[0] is not None
+    assert results[1] is None
+
+
+def test_feeder(emu):
+    wave = np.sin(np.arange(60000) * 2*np.pi / 300)
+    def blocks():
+        for k in range(0, len(wave), 1000):
+            time.sleep(0.005) # a slow generator
+            yield wave[k:k+1000]
+    with AnalogIn(channels=[1], rate=30*kHz) as ai:
+        with AnalogOut(feeder=True) as ao:
+            ao[1].sampled(blocks, 2*V)
+            ao.start()
+            assert ao.dev.writer.feeder is not None
+            time.sleep(0.5) # neither reading nor polling
+            ao.run()
+            data = ai.readall()
+            stats = ao.outputstats()
+    assert np.max(np.abs(data[:60000, 0] - 2*wave)) < 0.01
+    assert stats["sent"] > 0
+    assert stats["underruns"] == 0
+
+
+def test_feederpause(emu, monkeypatch):
+    # The feeder must carry on through chunks that report no active
+    # stimulus, as between episodes or before a trigger
+    stimactive = emu._stimactive
+    monkeypatch.setattr(emu, "_stimactive",
+                        lambda scan, epi: not 3000 <= scan < 6000
+                        and stimactive(scan, epi))
+    wave = np.sin(np.arange(60000) * 2*np.pi / 300)
+    def blocks():
+        for k in range(0, len(wave), 1000):
+            yield wave[k:k+1000]
+    with AnalogIn(channels=[1], rate=30*kHz) as ai:
+        with AnalogOut(feeder=True) as ao:
+            ao[1].sampled(blocks, 2*V)
+            ao.start()
+            data = ai.read(60000)
+            stats = ao.outputstats()
+    assert np.max(np.abs(data[:, 0] - 2*wave)) < 0.01
+    assert stats["underruns"] == 0
+
+
+def test_stalestatus(emu, monkeypatch):
+    # Chunks sent after the status was reported must still count
+    # against the depth, even if the status never catches up
+    encode = emu._encode
+    monkeypatch.setattr(emu, "_encode",
+                        lambda k, flags, status, a, d:
+                        encode(k, flags, 0, a, d))
+    queueoutput = emu._queueoutput
+    depths = []
+    def record(payload):
+        queueoutput(payload)
+        depths.append(len(emu._outqueue))
+    monkeypatch.setattr(emu, "_queueoutput", record)
+    wave = np.sin(np.arange(30000) * 2*np.pi / 300)
+    with AnalogIn(channels=[1], rate=30*kHz) as ai:
+        with AnalogOut() as ao:
+            ao[1].sampled(wave, 2*V)
+            ao.commit()
+            writer = ao.dev.writer
+            ao.run()
+            data = ai.readall()
+    assert writer.chunkno > writer.flow.maxdepth
+    assert max(depths) <= writer.flow.maxdepth
+    assert np.max(np.abs(data[:30000, 0] - 2*wave)) < 0.01
@@ -0,0 +1,75 @@
+#!env python3
+
+import pytest
+import sys
+import json
+import numpy as np
+
+sys.path.append("../software")
+
+from picodaq import AnalogIn, AnalogOut, kHz, V
+from picodaq import emulator, calibration
+from picodaq.device import PicoDAQ
+
+
+@pytest.fixture
+def calfile(tmp_path, monkeypatch):
+    path = tmp_path / "calibration.json"
+    monkeypatch.setenv("PICODAQ_CALIBRATION", str(path))
+    return path
+
+
+def test_conversion():
+    gain, offset = calibration.inputconversion(10, [[0, 0], [2, 5]])
+    assert np.allclose(gain, [10/32767.5, 10*0.998/32767.5])
+    assert np.allclose(offset, [0, -0.005])
+    gain, offset = calibration.outputconversion(10, [1, 5])
+    assert np.isclose(gain, 3276.799/1.001)
+    assert np.isclose(offset, -gain * 0.005)
+
+
+@pytest.mark.emulator(realtime=False)
+def test_input(emu, calfile):
+    calfile.write_text(json.dumps({emu.serno: {"islope": [[10, 0],
+                                                          [0, 20]]}}))
+    with AnalogIn(channels=[2, 1, 0], rate=10*kHz) as ai:
+        gain, offset = ai.dev.inputcalibration([2, 1, 0])
+        raw = ai.read(1000, raw=True)
+        volts = ai.read(1000)
+    assert gain[0] == ai.dev.igain and offset[0] == ai.dev.ioffset
+    assert np.isclose(gain[1], ai.dev.igain)
+    assert np.isclose(offset[1], -0.02)
+    assert np.isclose(gain[2], 10 * 0.99 / 32767.5)
+    expect, _ = emulator.pattern(np.arange(1000, 2000))
+    assert np.allclose(volts, gain * expect[:, [2, 1, 0]] + offset)
+
+
+@pytest.mark.emulator(loopback=True)
+def test_output(emu, calfile):
+    wave = np.sin(np.arange(3000) * 2*np.pi / 300)
+    results = []
+    for oslope in [[], [[0, 0], [0, 100]]]:
+        with AnalogIn(channels=[0, 1], rate=30*kHz) as ai:
+            with AnalogOut() as ao:
+                ao.dev.setcalibration(oslope=oslope)
+                ao[0].sampled(wave, 2*V)
+                ao[1].sampled(wave, 2*V)
+                ao.run()
+                results.append(ai.readall()[:3000])
+    assert np.allclose(results[0][:, 0], 2*wave, atol=0.01)
+    assert np.allclose(results[0][:, 1], 2*wave, atol=0.01)
+    # The emulator applies the device's calibration, so the host-side
+    # correction for channel 1 shows up in the loopback
+    assert np.allclose(results[1][:, 0], 2*wave, atol=0.01)
+    assert np.allclose(results[1][:, 1], 2*wave - 0.1, atol=0.01)
+
+
+def test_store(emu, calfile):
+    dev = PicoDAQ("emu0")
+    dev.setcalibration(islope=[[1, 2]], store=True)
+    assert calibration.lookup(emu.serno)["islope"].tolist() == [[1, 2]]
+    dev.setcalibration(oslope=[[3, 4], [5, 6]], store=True)
+    dev = PicoDAQ("emu0")
+    assert dev.caltables["islope"].tolist() == [[1, 2]]
+    assert dev.caltables["oslope"].tolist() == [[3, 4], [5, 6]]
+    assert dev.outputcalibration(3) == (dev.ogain, dev.ooffset)
@@ -0,0 +1,76 @@
+#!env python3
+
+import pytest
+import sys
+import warnings
+import numpy as np
+
+sys.path.append("../software")
+
+from picodaq import utils
+from picodaq.utils import checksum
+
+
+def reference(wav):
+    """The original sample-by-sample implementation"""
+    chk = np.uint32(0)
+    with warnings.catch_warnings(action="ignore",
+                                 category=RuntimeWarning) as f:
+        for y in wav:
+            chk += np.uint16(y)
+            chk += chk << 10 # integer overflow ignored
+            chk = chk & 0x7fffffff
+            chk ^= (chk >> 5)
+    return chk
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random(seed):
+    rng = np.random.default_rng(seed)
+    wav = rng.integers(-32768, 32768, rng.integers(0, 3000), dtype=np.int16)
+    if seed % 4 == 0:
+        wav[rng.random(len(wav)) < 0.5] = -32768
+    elif seed % 4 == 1:
+        wav[rng.random(len(wav)) < 0.5] = 32767
+    expect = reference(wav)
+    assert checksum(wav) == expect
+    assert utils._checksumkernel(wav.astype(np.uint16).tolist()) == expect
+
+
+def test_edge():
+    for wav in [np.zeros(0, np.int16), np.zeros(5000, np.int16),
+                np.full(5000, -1, np.int16), np.full(5000, -32768, np.int16)]:
+        assert checksum(wav) == reference(wav)
+    assert isinstance(checksum(np.zeros(3, np.int16)), np.uint32)
+
+
+def test_rows():
+    rng = np.random.default_rng(1)
+    wavs = rng.integers(-32768, 32768, (50, 300), dtype=np.int16)
+    chks = checksum(wavs)
+    assert chks.dtype == np.uint32
+    assert [int(c) for c in chks] == [int(reference(w)) for w in wavs]
+    assert len(checksum(np.zeros((0, 10), np.int16))) == 0
+
+
+def test_nojit(monkeypatch):
+    # Short data must never trigger compilation
+    monkeypatch.setattr(utils, "_checksumjit", None)
+    wav = np.arange(-5000, 5000, dtype=np.int16)
+    assert checksum(wav) == reference(wav)
+    assert utils._checksumjit is None
+
+
+def test_jit(monkeypatch):
+    pytest.importorskip("numba")
+    monkeypatch.setattr(utils, "_checksumjit", None)
+    monkeypatch.setattr(utils, "JITMIN", 0) # every length takes the JIT
+    jit = utils._jit()
+    assert jit
+    rng = np.random.default_rng(2)
+    for n in [0, 1, 2, 1000, 100_000]:
+        wav = rng.integers(-32768, 32768, n, dtype=np.int16)
+        data = wav.astype(np.uint16)
+        expect = utils._checksumkernel(data.tolist())
+        assert jit(data) == expect
+        assert checksum(wav) == expect == reference(wav)
@@ -0,0 +1,97 @@
+#!env python3
+
+import pytest
+import sys
+import numpy as np
+from scipy import signal
+
+sys.path.append("../software")
+
+from picodaq import AnalogIn, kHz, ms
+from picodaq.decimate import Decimator
+
+
+@pytest.mark.parametrize("ftype", ["iir", "fir"])
+def test_streaming(ftype):
+    rng = np.random.default_rng(3)
+    x = rng.standard_normal((5000, 2))
+    dec = Decimator(7, 2, ftype)
+    out = []
+    k = 0
+    while k < len(x):
+        n = int(rng.integers(1, 400))
+        out.append(dec(x[k:k+n]))
+        k += n
+    y = np.concatenate(out)
+    if ftype == "iir":
+        expect = signal.sosfilt(dec.sos, x, axis=0)[::7]
+    else:
+        expect = signal.lfilter(dec.taps[::-1], 1, x, axis=0)[::7]
+    assert y.dtype == np.float32
+    assert np.allclose(y, expect, atol=1e-5)
+    assert dec.inputs == 5000 and dec.outputs == len(y) == 715
+
+
+@pytest.mark.parametrize("ftype", ["iir", "fir"])
+def test_antialias(ftype):
+    tt = np.arange(20000)
+    low = np.sin(2*np.pi * 0.01 * tt)
+    high = np.sin(2*np.pi * 0.2 * tt)
+    dec = Decimator(10, 2, ftype)
+    y = dec(np.stack((low, high), 1))[200:]
+    assert np.std(y[:, 0]) > 0.65
+    assert np.std(y[:, 1]) < 0.01
+
+
+@pytest.mark.parametrize("ftype", ["iir", "fir"])
+def test_delay(ftype):
+    dec = Decimator(10, 1, ftype)
+    if ftype == "fir":
+        assert dec.delay == 150
+    tt = np.arange(20000)
+    x = np.sin(2*np.pi * 0.002 * tt)
+    y = dec(x[:, None])[:, 0]
+    k = np.arange(len(y))
+    shifted = np.sin(2*np.pi * 0.002 * (10*k - dec.delay))
+    assert np.max(np.abs(y - shifted)[50:]) < 0.01
+
+
+@pytest.mark.parametrize("ftype", ["iir", "fir"])
+@pytest.mark.emulator(realtime=False)
+def test_alignment(emu, ftype):
+    def slow(t):
+        analog = np.zeros((len(t), 4), np.int16)
+        analog[:, 0] = 10000 * np.sin(2*np.pi * t / 3000)
+        return analog, np.zeros((len(t), 4), np.uint8)
+    emu.source = slow
+    with AnalogIn(channel=0, rate=30*kHz, decimate=10,
+                  decimation=ftype) as ai:
+        (data, times), (full, fulltimes) = ai.read(600, times=True,
+                                                  full=True)
+        delay = ai.decimationdelay
+    assert delay.as_("s") == pytest.approx(Decimator(10, 1, ftype).delay
+                                           / 30000)
+    # Decimated data agree with the full-rate data at their time stamps
+    expect = np.interp(times, fulltimes, full)
+    assert np.max(np.abs(data - expect)[100:]) < 0.02
+
+
+@pytest.mark.emulator(realtime=False)
+def test_analogin(emu):
+    with AnalogIn(channel=1, rate=30*kHz, decimate=10) as ai:
+        first, full0 = ai.read(100*ms, full=True)
+        data, full = ai.read(333, full=True)
+        (more, times), (fulldata, fulltimes) = ai.read(full=True,
+                                                       times=True)
+        with pytest.raises(ValueError):
+            ai.read(raw=True)
+    assert len(first) == 300
+    assert len(data) == 333
+    assert len(full) == 3330
+    delay = Decimator(10, 1).delay
+    assert np.allclose(times, (633 + np.arange(len(more))) / 3000
+                       - delay / 30000)
+    assert fulltimes[0] == (2991 + 3330) / 30000
+    whole = np.concatenate((full0, full, fulldata))
+    expect = Decimator(10, 1)(whole[:, None])[:, 0]
+    assert np.allclose(np.concatenate((first, data, more)), expect)
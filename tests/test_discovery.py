@@ -0,0 +1,60 @@
+#!env python3
+
+import pytest
+import sys
+import json
+
+sys.path.append("../software")
+
+from picodaq import AnalogIn, kHz
+from picodaq import emulator, devcache
+from picodaq.device import devices
+
+
+pytestmark = pytest.mark.emulator(realtime=False)
+
+
+def test_devices(cache):
+    emus = [emulator.install(f"emu{k}", serno=f"E00000000000000{k}")
+            for k in range(3)]
+    assert devices() == {f"emu{k}": emu.serno for k, emu in enumerate(emus)}
+
+
+def test_cached(emu, cache):
+    ai = AnalogIn(channel=0, rate=10*kHz, serno=emu.serno)
+    assert emu.serno in json.loads(cache.read_text())
+    count = emu.commandcount
+    ai = AnalogIn(channel=0, rate=10*kHz, serno=emu.serno)
+    assert emu.commandcount == count
+    with ai:
+        assert len(ai.read(1000)) == 1000
+
+
+def test_firmware_change(emu):
+    AnalogIn(channel=0, rate=10*kHz, serno=emu.serno)
+    emu.firmware = "1.0-emu"
+    emu.oslope = "5,0"
+    ai = AnalogIn(channel=0, rate=10*kHz, serno=emu.serno)
+    with ai:
+        assert ai.dev.info["firmware"] == "1.0-emu"
+        ai.read(100)
+    assert devcache.firmware(devcache.lookup(emu.serno)) == "1.0-emu"
+
+
+def test_disabled(emu, cache, monkeypatch):
+    monkeypatch.setenv("PICODAQ_CACHE", "")
+    AnalogIn(channel=0, rate=10*kHz, serno=emu.serno)
+    assert not cache.exists()
+    assert devcache.lookup(emu.serno) is None
+
+
+def test_update(tmp_path):
+    path = str(tmp_path / "entries.json")
+    assert devcache.load(path) == {}
+    with devcache.update(path) as entries:
+        entries["A"] = {"x": 1}
+    with pytest.raises(RuntimeError):
+        with devcache.update(path) as entries:
+            entries["B"] = {"x": 2}
+            raise RuntimeError
+    assert devcache.load(path) == {"A": {"x": 1}}
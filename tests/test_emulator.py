@@ -0,0 +1,172 @@
+#!env python3
+
+import pytest
+import sys
+import time
+import numpy as np
+
+sys.path.append("../software")
+
+from picodaq import AnalogIn, DigitalIn, AnalogOut, kHz, ms, V, DeviceError
+from picodaq import emulator, stimulus, dac
+from picodaq.device import devices
+
+
+def test_devices(emu):
+    assert devices() == {"emu0": emu.serno}
+
+
+@pytest.mark.emulator(realtime=False)
+def test_pattern(emu):
+    with AnalogIn(channels=[3, 0, 2, 1], rate=10*kHz) as ai:
+        data = ai.read(1000, raw=True)
+    expect, _ = emulator.pattern(np.arange(1000))
+    assert np.array_equal(data, expect[:, [3, 0, 2, 1]])
+
+
+@pytest.mark.parametrize("channels", [[0], [2], [1, 0], [0, 2], [3, 1],
+                                      [2, 3], [0, 1, 3], [2, 0, 1, 3]])
+@pytest.mark.emulator(realtime=False)
+def test_demux(emu, channels):
+    with AnalogIn(channels=channels, rate=10*kHz) as ai:
+        data = ai.read(1000, raw=True)
+    expect, _ = emulator.pattern(np.arange(1000))
+    assert np.array_equal(data, expect[:, channels])
+
+
+@pytest.mark.emulator(realtime=False)
+def test_digital(emu):
+    with DigitalIn(lines=[2, 3], rate=10*kHz) as di:
+        data = di.read(1000)
+    _, expect = emulator.pattern(np.arange(len(data)))
+    assert np.array_equal(data, expect[:, [2, 3]])
+
+
+@pytest.mark.emulator(realtime=False)
+def test_events(emu):
+    with DigitalIn(lines=[2, 3], rate=10*kHz) as di:
+        events = []
+        data = []
+        for k in range(5):
+            ev, dat = di.readevents(1000 + 4*k, packed=True)
+            events.append(ev)
+            data.append(dat)
+        ev = di.readevents(200, times=True)
+    bits = np.unpackbits(np.concatenate(data),
+                         bitorder="little").reshape(-1, 2)
+    events = np.concatenate(events)
+    for k, line in enumerate([2, 3]):
+        mine = events[events["line"] == line]
+        change = np.flatnonzero(np.diff(bits[:, k].astype(int))) + 1
+        assert np.array_equal(mine["scan"], np.concatenate(([0], change)))
+        assert np.array_equal(mine["state"], bits[mine["scan"], k])
+    _, expect = emulator.pattern(np.arange(len(bits) + 200))
+    assert np.array_equal(bits, expect[:len(bits), [2, 3]])
+    assert np.all(ev["scan"] >= len(bits))
+    assert np.allclose(ev["time"], ev["scan"] / 10000)
+
+
+@pytest.mark.emulator(realtime=False)
+def test_flatmemory(emu):
+    with AnalogIn(channels=[0, 1], rate=100*kHz) as ai:
+        ai.read(10000)
+        capacity = ai.dev.reader._adata.capacity
+        for k in range(50):
+            ai.read(10000)
+        assert ai.dev.reader._adata.capacity == capacity
+
+
+@pytest.mark.emulator(realtime=False)
+def test_readinto(emu, monkeypatch):
+    with AnalogIn(channels=[2, 0], rate=10*kHz) as ai:
+        calls = []
+        inputcalibration = ai.dev.inputcalibration
+        def counting(channels):
+            calls.append(channels)
+            return inputcalibration(channels)
+        monkeypatch.setattr(ai.dev, "inputcalibration", counting)
+        first = ai.read(1000)
+        raw = np.zeros((1500, 2), np.int16)
+        assert ai.read_into(raw, raw=True) == 1500
+        volts = np.zeros((1200, 2))
+        data = ai.read(1000, out=volts)
+        assert data.base is volts and len(data) == 1000
+        with pytest.raises(ValueError):
+            ai.read(out=np.zeros((10, 2), np.int16))
+        with pytest.raises(ValueError):
+            ai.read(out=np.zeros(10))
+        assert len(calls) == 1 # calibration is looked up once per run
+    expect, _ = emulator.pattern(np.arange(3500))
+    expect = expect[:, [2, 0]]
+    assert np.array_equal(raw, expect[1000:2500])
+    assert np.allclose(first, ai.dev.igain * expect[:1000] + ai.dev.ioffset)
+    assert np.allclose(volts[:1000],
+                       ai.dev.igain * expect[2500:] + ai.dev.ioffset)
+    assert np.all(volts[1000:] == 0)
+    with AnalogIn(channel=1, rate=10*kHz) as ai:
+        data = ai.read(500, dtype=np.float64)
+    assert data.dtype == np.float64 and data.shape == (500,)
+
+
+def test_realtime(emu):
+    t0 = time.time()
+    with AnalogIn(channel=0, rate=10*kHz) as ai:
+        ai.read(2000)
+    dt = time.time() - t0
+    assert 0.18 < dt < 0.4
+
+
+def test_overflow(emu):
+    with AnalogIn(channels=[0, 1], rate=20*kHz) as ai:
+        ai.read(1000)
+        time.sleep(1.5)
+        with pytest.raises(DeviceError):
+            ai.read(1000)
+
+
+@pytest.mark.emulator(realtime=False, outbufblocks=64)
+def test_outoverflow(emu):
+    wave = np.sin(np.arange(30000) * 2*np.pi / 300)
+    with pytest.raises(DeviceError, match="overflow"):
+        with AnalogIn(channels=[1], rate=30*kHz) as ai:
+            with AnalogOut() as ao:
+                ao[1].sampled(wave, 2*V)
+                ao.commit()
+                capacity = ao.dev.params["sampled"]
+                ao.start()
+                dac._poll(ao.dev, _forceqty=capacity)
+                ai.readall()
+    assert capacity < emulator.MAXSTATUS
+
+
+@pytest.mark.emulator(loopback=True)
+def test_loopback(emu):
+    wave = np.sin(np.arange(3000) * 2*np.pi / 300)
+    with AnalogIn(channels=[1], rate=30*kHz) as ai:
+        with AnalogOut() as ao:
+            ao[1].sampled(wave, 2*V)
+            ao.run()
+            data = ai.readall()
+    assert np.max(np.abs(data[:3000, 0] - 2*wave)) < 0.01
+
+
+def test_stimactive(emu):
+    pulse = stimulus.Square(1*V, 10*ms)
+    train = stimulus.Train(pulse, 3, pulseperiod=100*ms)
+    t0 = time.time()
+    with AnalogOut(rate=10*kHz) as ao:
+        ao[0].stimulus(train)
+        ao.run()
+    dt = time.time() - t0
+    assert 0.22 < dt < 0.4
+
+
+def test_episodic(emu):
+    with AnalogIn(channel=0, rate=10*kHz) as ai:
+        ai.episodic(duration=50*ms, period=100*ms)
+        t0 = time.time()
+        data1 = ai.read()
+        data2 = ai.read()
+        dt = time.time() - t0
+    assert len(data1) == len(data2) >= 500
+    assert 0.14 < dt < 0.25
@@ -0,0 +1,63 @@
+#!env python3
+
+import pytest
+import sys
+import time
+import numpy as np
+
+sys.path.append("../software")
+
+from picodaq import AnalogIn, AnalogOut, kHz, ms, V
+from picodaq.binwriter import FlowControl
+
+
+def serve(flow, gaps):
+    t = flow.lastservice or 0
+    for gap in gaps:
+        t += gap
+        flow.service(10, t)
+    return flow.depth
+
+
+def test_fixed():
+    flow = FlowControl(0.001, 50)
+    assert serve(flow, [0.1] * 100) == 50
+
+
+def test_latency():
+    flow = FlowControl(0.001, 50, "latency")
+    assert serve(flow, [0.001] * 10) == 50 # not enough data yet
+    assert serve(flow, [0.001] * 100 + [0.0095]) == 12
+    stats = flow.stats()
+    assert stats["maxinterval"] == pytest.approx(0.0095)
+    assert stats["margin"] == pytest.approx(0.010)
+    assert serve(flow, [0.1]) == 50 # capped
+
+
+def test_probability():
+    rng = np.random.default_rng(1)
+    gaps = 0.002 + rng.exponential(0.001, 1000)
+    depths = [serve(FlowControl(0.001, 100, p), gaps)
+              for p in [1e-2, 1e-4, 1e-6]]
+    assert depths[0] < depths[1] < depths[2]
+    # The median is 2.7 ms and the excess over it has a scale of 1 ms
+    assert depths[2] == pytest.approx(np.ceil(2.7 + np.log(0.5e6)) + 2,
+                                      abs=1)
+    with pytest.raises(ValueError):
+        FlowControl(0.001, 100, 2)
+
+
+@pytest.mark.emulator(loopback=True)
+def test_adaptive(emu):
+    wave = np.sin(np.arange(90000) * 2*np.pi / 300)
+    with AnalogIn(channels=[1], rate=30*kHz) as ai:
+        with AnalogOut(flow="latency") as ao:
+            ao[1].sampled(wave, 2*V)
+            ao.run()
+            data = ai.readall()
+            stats = ao.outputstats()
+    # The output is intact, even if the queue may have run dry
+    # momentarily, which "latency" mode does not rule out
+    assert np.max(np.abs(data[:90000, 0] - 2*wave)) < 0.01
+    assert stats["depth"] < 200
+    assert stats["latency"] < 0.5
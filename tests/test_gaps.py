@@ -0,0 +1,78 @@
+#!env python3
+
+import pytest
+import sys
+import numpy as np
+
+sys.path.append("../software")
+
+from picodaq import AnalogIn, DigitalIn, kHz, ms
+
+
+LOST = (5, 6)
+
+
+@pytest.fixture
+def emu(emu, monkeypatch):
+    encode = emu._encode
+    def lossy(chunkno, *args):
+        bts = encode(chunkno, *args)
+        return b"" if chunkno in LOST else bts
+    monkeypatch.setattr(emu, "_encode", lossy)
+    return emu
+
+
+def test_default(emu):
+    with AnalogIn(channel=0, rate=10*kHz) as ai:
+        with pytest.raises(RuntimeError):
+            ai.read(50*ms)
+
+
+def test_fillgaps(emu):
+    with AnalogIn(channels=[0, 1], rate=10*kHz, fillgaps=True) as ai:
+        N = ai.chunkscans()
+        raw = ai.read(12*N, raw=True)
+        assert raw.shape == (12*N, 2)
+        gaps = ai.gaps
+        assert len(gaps) == 1
+        assert gaps[0].scan == LOST[0] * N
+        assert gaps[0].chunks == len(LOST)
+        lost = np.zeros(12*N, bool)
+        lost[LOST[0]*N:(LOST[-1] + 1)*N] = True
+        assert np.all(raw[lost] == -32768)
+        assert np.all(raw[~lost] > -32768)
+        data = ai.read(2*N)
+        assert not np.any(np.isnan(data))
+    # Data after the gap keep their place in time
+    t = np.arange(12*N)
+    analog, _ = emu.source(t)
+    assert np.array_equal(raw[~lost], analog[~lost][:, [0, 1]])
+
+
+def test_saturation(emu, monkeypatch):
+    source = emu.source
+    def saturated(t):
+        analog, digital = source(t)
+        analog[t % 7 == 0] = -32768
+        return analog, digital
+    monkeypatch.setattr(emu, "source", saturated)
+    with AnalogIn(channel=0, rate=10*kHz, fillgaps=True) as ai:
+        N = ai.chunkscans()
+        data = ai.read(12*N)
+        more = ai.read(2*N)
+    lost = np.zeros(12*N, bool)
+    lost[LOST[0]*N:(LOST[-1] + 1)*N] = True
+    # Only lost data read as NaN, not genuine full-scale samples
+    assert np.all(np.isnan(data[lost]))
+    assert not np.any(np.isnan(data[~lost]))
+    assert not np.any(np.isnan(more))
+    assert np.all(data[:LOST[0]*N:7] < -9)
+
+
+def test_digital(emu):
+    with DigitalIn(line=0, rate=10*kHz, fillgaps=True) as di:
+        N = di.chunkscans()
+        data = di.read(10*N)
+        assert len(data) == 10*N
+        assert len(di.gaps) == 1
+        assert not np.any(data[LOST[0]*N:(LOST[-1] + 1)*N])
@@ -0,0 +1,62 @@
+#!env python3
+
+import pytest
+import sys
+import time
+import numpy as np
+
+sys.path.append("../software")
+
+from picodaq import AnalogIn, DigitalIn, AnalogOut, DigitalOut, kHz, ms, V
+from picodaq import stimulus
+from picodaq.device import PicoDAQ, devices
+
+
+@pytest.fixture
+def latencies(emu, monkeypatch):
+    record = []
+    getfeedback = PicoDAQ._getfeedback
+    def timed(self, until=None):
+        t0 = time.perf_counter()
+        lines = getfeedback(self, until)
+        record.append((until, time.perf_counter() - t0))
+        return lines
+    monkeypatch.setattr(PicoDAQ, "_getfeedback", timed)
+    readreply = PicoDAQ._readreply
+    def timedreply(self, key, later):
+        t0 = time.perf_counter()
+        res = readreply(self, key, later)
+        record.append((key, time.perf_counter() - t0))
+        return res
+    monkeypatch.setattr(PicoDAQ, "_readreply", timedreply)
+    return record
+
+
+def test_latency(latencies):
+    devices()
+    pulse = stimulus.Square(1*V, 5*ms)
+    train = stimulus.Train(pulse, 2, pulseperiod=20*ms)
+    with AnalogIn(channels=[0, 1], rate=10*kHz) as ai:
+        with DigitalIn(lines=[0]) as di:
+            with AnalogOut() as ao:
+                with DigitalOut() as do:
+                    ai.episodic(duration=50*ms, period=60*ms)
+                    ai.trigger(0, 1)
+                    ai.immediate()
+                    ai.continuous()
+                    ao[1].stimulus(train)
+                    do[0].stimulus(stimulus.Train(stimulus.TTL(1*ms), 2,
+                                                  pulseperiod=10*ms))
+                    ao[0].sampled(np.zeros(500), 1*V)
+                    ao.run()
+                    ai.readall()
+    assert len(latencies) > 20
+    dts = np.array([dt for until, dt in latencies]) * 1e3
+    bins = [0, 1, 2, 5, 10, 20, 50, 100, 1000]
+    counts, _ = np.histogram(dts, bins)
+    print()
+    print("Command latency (ms)    Count")
+    for k, n in enumerate(counts):
+        print(f"  {bins[k]:4} – {bins[k+1]:4}        {n:5}")
+    slow = [until for until, dt in latencies if dt > 0.05]
+    assert not slow # nothing waits for the 100 ms serial timeout
@@ -0,0 +1,136 @@
+#!env python3
+
+import pytest
+import sys
+import json
+import time
+import numpy as np
+
+sys.path.append("../software")
+
+from picodaq import AnalogIn, DigitalIn, kHz, ms
+from picodaq.binreader import demuxplan
+from picodaq.recorder import MAGIC, HEADERSIZE, Recording
+
+
+def load(path):
+    with open(path, "rb") as f:
+        head = f.read(HEADERSIZE)
+        assert head.startswith(MAGIC)
+        header = json.loads(head[len(MAGIC):])
+        raw = np.frombuffer(f.read(), np.int16)
+    return header, raw.reshape(header["chunks"], -1)
+
+
+def analog(header, raw):
+    plan = demuxplan(tuple(header["channels"]), header["nscans"])
+    return raw[:, plan].reshape(-1, len(header["channels"]))
+
+
+def test_record(emu, tmp_path):
+    path = tmp_path / "rec.pdaq"
+    with AnalogIn(channels=[2, 0], rate=10*kHz) as ai:
+        with DigitalIn(line=1) as di:
+            rec = ai.record(path, 100*ms)
+    header, raw = load(path)
+    N = header["nscans"]
+    assert header["rate_Hz"] == 10000
+    assert header["channels"] == [2, 0]
+    assert header["lines"] == [1]
+    assert header["stop"] == "ok"
+    assert header["gaps"] == []
+    assert header["chunks"] * N >= 1000
+    assert rec.stats()["written"] == raw.nbytes
+    assert np.array_equal(raw[:, 1].astype(np.uint16),
+                          np.arange(len(raw)))
+    scans = np.arange(len(raw) * N)
+    expected, digital = emu.source(scans)
+    assert np.array_equal(analog(header, raw), expected[:, [2, 0]])
+    digistart = 2 * (2 + 2*N)
+    bits = np.unpackbits(raw.view(np.uint8)[:, digistart:digistart + N//8],
+                         bitorder="little")
+    assert np.array_equal(bits, digital[:, 1])
+
+
+def test_background(emu, tmp_path):
+    path = tmp_path / "rec.pdaq"
+    with AnalogIn(channel=1, rate=10*kHz) as ai:
+        rec = ai.record(path)
+        with pytest.raises(ValueError):
+            ai.read()
+        while rec.stats()["chunks"] < 5:
+            time.sleep(0.01)
+    header, raw = load(path)
+    assert header["chunks"] >= 5
+    assert len(raw) == header["chunks"]
+    # Reading resumes after the recording
+    with AnalogIn(channel=1, rate=10*kHz) as ai:
+        assert len(ai.read(10*ms)) == 100
+
+
+def test_gaps(emu, tmp_path, monkeypatch):
+    encode = emu._encode
+    def lossy(chunkno, *args):
+        bts = encode(chunkno, *args)
+        return b"" if chunkno == 3 else bts
+    monkeypatch.setattr(emu, "_encode", lossy)
+    path = tmp_path / "rec.pdaq"
+    with AnalogIn(channel=0, rate=10*kHz, fillgaps=True) as ai:
+        ai.record(path, 100*ms)
+        assert len(ai.gaps) == 1
+    header, raw = load(path)
+    N = header["nscans"]
+    assert len(header["gaps"]) == 1
+    assert header["gaps"][0][:2] == [3*N, 1]
+    assert np.array_equal(raw[:, 1].astype(np.uint16),
+                          np.arange(len(raw)))
+    assert raw[3, 0] == 0
+    data = analog(header, raw)
+    assert np.all(data[3*N:4*N] == -32768)
+    assert np.all(data[4*N:] > -32768)
+    rec = Recording(path)
+    assert rec.gaps[0].chunks == 1
+    volts = rec[:]
+    assert np.all(np.isnan(volts[3*N:4*N]))
+    assert not np.any(np.isnan(volts[4*N:]))
+
+
+def test_recording(emu, tmp_path):
+    path = tmp_path / "rec.pdaq"
+    with AnalogIn(channels=[3, 1], rate=10*kHz) as ai:
+        with DigitalIn(lines=[0, 1]) as di:
+            ai.record(path, 200*ms)
+    rec = Recording(path)
+    T = len(rec)
+    assert T >= 2000
+    assert rec.duration.as_("s") == T / 10000
+    expected, digital = emu.source(np.arange(T))
+    raw = rec.analog(raw=True)
+    assert np.array_equal(raw, expected[:, [3, 1]])
+    volts = rec[10*ms:20*ms]
+    assert volts.dtype == np.float32
+    assert volts.shape == (100, 2)
+    assert np.allclose(volts, rec.analog(100, 200))
+    assert np.array_equal(rec.analog(-5, raw=True), raw[-5:])
+    assert np.array_equal(rec.digital(123, 1234), digital[123:1234, :2])
+    data, times = rec.read(150, times=True)
+    assert np.array_equal(data, rec.analog(0, 150))
+    data, times = rec.read(150, raw=True, times=True)
+    assert np.array_equal(data, raw[150:300])
+    assert np.allclose(times, np.arange(150, 300) / 10000)
+
+
+def test_digitalonly(emu, tmp_path):
+    path = tmp_path / "rec.pdaq"
+    with DigitalIn(lines=[2, 3], rate=10*kHz) as di:
+        di.record(path, 100*ms)
+    rec = Recording(path)
+    T = len(rec)
+    assert T >= 1000
+    _, digital = emu.source(np.arange(T))
+    assert np.array_equal(rec.digital(), digital[:, [2, 3]])
+    assert rec[10*ms:20*ms].shape == (100, 0)
+    data, times = rec.read(150, times=True)
+    assert data.shape == (150, 0) and data.dtype == np.float32
+    assert rec.analog(raw=True).shape == (T, 0)
+    assert len(times) == 150
@@ -0,0 +1,57 @@
+#!env python3
+
+import pytest
+import sys
+import numpy as np
+
+sys.path.append("../software")
+
+from picodaq.ringbuffer import RingBuffer
+
+
+def test_wraparound():
+    buf = RingBuffer(10, (2,))
+    data = np.arange(100).reshape(50, 2)
+    out = []
+    buf.put(data[:4])
+    for k in range(4, 50, 3):
+        buf.put(data[k:k+3])
+        out.append(buf.get(3))
+    out.append(buf.get(100))
+    assert buf.capacity == 10
+    assert len(buf) == 0
+    assert np.array_equal(np.concatenate(out), data)
+
+
+def test_grow():
+    buf = RingBuffer(4)
+    buf.put(np.arange(3))
+    assert np.array_equal(buf.get(2), [0, 1])
+    buf.put(np.arange(3, 12))
+    assert buf.capacity >= 10
+    assert np.array_equal(buf.get(20), np.arange(2, 12))
+
+
+def test_getinto():
+    buf = RingBuffer(6, (2,))
+    data = np.arange(20).reshape(10, 2)
+    buf.put(data[:4])
+    buf.get(3)
+    buf.put(data[4:9])
+    out = np.zeros((8, 2), np.float32)
+    assert buf.getinto(out) == 6
+    assert np.array_equal(out[:6], data[3:9])
+    assert len(buf) == 0
+    buf.put(data[:3])
+    assert buf.getinto(out, lambda src, dst: np.negative(src, out=dst)) == 3
+    assert np.array_equal(out[:3], -data[:3])
+
+
+def test_gather():
+    buf = RingBuffer(6, (2,))
+    source = np.arange(10) * 10
+    buf.put(np.zeros((4, 2)))
+    buf.get(4)
+    index = np.array([[1, 0], [3, 2], [5, 4], [7, 6]])
+    buf.gather(source, index)
+    assert np.array_equal(buf.get(4), source[index])
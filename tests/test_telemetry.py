@@ -0,0 +1,72 @@
+#!env python3
+
+import pytest
+import sys
+import time
+import numpy as np
+
+sys.path.append("../software")
+
+from picodaq import AnalogIn, kHz, ms
+from picodaq.telemetry import Telemetry
+
+
+def words(levels, status):
+    return ((np.array(status) << 8) | (np.array(levels) << 4)
+            | 0x80).astype(np.int16)
+
+
+def test_counts():
+    tm = Telemetry(0.001)
+    calls = []
+    tm.setcallback(lambda level, stats: calls.append(level))
+    t0 = tm.lastarrival
+    tm.update(words([0, 1, 2, 2, 1, 3, 3, 0], [5, 5, 4, 3, 3, 2, 200, 1]),
+              t0 + 0.008)
+    tm.update(words([2], [0]), t0 + 0.012)
+    stats = tm.stats()
+    assert stats["chunks"] == 9
+    assert stats["inbuf"] == {"empty": 2, "continue": 2,
+                              "nearfull": 3, "full": 2}
+    assert stats["nearfull"] == 3
+    assert stats["full"] == 1
+    assert stats["level"] == "nearfull"
+    assert stats["outqueue"][[0, 1, 2, 3, 4, 5, 200]].tolist() \
+        == [1, 1, 1, 2, 1, 2, 1]
+    assert stats["maxarrival"] == pytest.approx(0.004)
+    assert stats["arrival"].sum() == 9
+    assert calls == ["full", "nearfull"]
+
+
+def test_threshold():
+    tm = Telemetry(0.001)
+    calls = []
+    tm.setcallback(lambda level, stats: calls.append(level), "full")
+    tm.update(words([2, 3, 1, 3], [0, 0, 0, 0]))
+    assert calls == ["full"]
+    tm.update(words([3], [0]))
+    assert calls == ["full"]
+    with pytest.raises(ValueError):
+        tm.setcallback(print, "empty")
+
+
+def test_run(emu):
+    with AnalogIn(channels=[0, 1], rate=20*kHz) as ai:
+        ai.read(100*ms)
+        stats = ai.stats()["input"]
+        assert stats["chunks"] > 0
+        assert sum(stats["inbuf"].values()) == stats["chunks"]
+        assert stats["outqueue"].sum() == stats["chunks"]
+    assert ai.stats()["input"]["chunks"] >= stats["chunks"]
+    assert ai.stats()["output"] is None
+
+
+def test_nearfull(emu):
+    calls = []
+    with AnalogIn(channels=[0, 1], rate=20*kHz) as ai:
+        ai.onnearfull(lambda level, stats: calls.append(level))
+        ai.read(1000)
+        time.sleep(1.05) # fills the emulator's buffer beyond 3/4
+        ai.read(20000)
+    assert calls and calls[0] in ("nearfull", "full")
+    assert ai.stats()["input"]["nearfull"] >= 1
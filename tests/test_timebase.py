@@ -0,0 +1,86 @@
+#!env python3
+
+import pytest
+import sys
+import io
+import numpy as np
+
+sys.path.append("../software")
+
+from picodaq import AnalogIn, kHz, ms
+from picodaq.timebase import TimeBase
+
+
+def test_exact():
+    start = 300000 * 3600 * 24 # a day into a run at 300 kHz
+    tb = TimeBase(start, 1000, 300000)
+    assert len(tb) == 1000
+    assert tb[0] == 3600 * 24
+    assert tb[-1] == (start + 999) / 300000
+    assert np.array_equal(np.asarray(tb), (start + np.arange(1000)) / 300e3)
+    assert np.all(np.diff(tb) > 0)
+    assert np.allclose(tb * 1000 - tb[0] * 1000, np.arange(1000) / 300)
+    part = tb[10:20]
+    assert isinstance(part, TimeBase)
+    assert part.start == start + 10 and len(part) == 10
+    assert np.array_equal(tb[[1, 3]], np.asarray(tb)[[1, 3]])
+    with pytest.raises(IndexError):
+        tb[1000]
+
+
+def test_episodic():
+    tb = TimeBase(250, 100, 1000, period=300)
+    assert np.array_equal(tb.scans, np.arange(250, 350) % 300)
+    assert tb[50] == 0
+    assert np.allclose(np.asarray(tb)[:50], np.arange(250, 300) / 1000)
+
+
+def test_arraylike():
+    tb = TimeBase(5, 20, 1000)
+    assert tb.shape == (20,) and tb.ndim == 1 and tb.size == 20
+    assert tb.dtype == np.float64
+    assert np.asarray(tb).dtype == tb.dtype
+    t32 = tb.astype(np.float32)
+    assert t32.dtype == np.float32 and t32.shape == tb.shape
+    assert np.array_equal(np.asarray(tb, np.float32), t32)
+    t64 = tb.astype(np.float64)
+    t64[:] = 0 # a new array, even without conversion
+    assert tb[0] == 0.005
+    buf = io.BytesIO()
+    np.save(buf, tb)
+    buf.seek(0)
+    assert np.array_equal(np.load(buf), np.arange(5, 25) / 1000)
+    empty = TimeBase(5, 0, 1000)
+    assert empty.shape == (0,) and len(np.asarray(empty)) == 0
+
+
+def test_join():
+    tb = TimeBase.join([TimeBase(0, 10, 1000), TimeBase(10, 5, 1000)])
+    assert isinstance(tb, TimeBase) and len(tb) == 15
+    arr = TimeBase.join([TimeBase(0, 10, 1000), TimeBase(20, 5, 1000)])
+    assert isinstance(arr, np.ndarray) and len(arr) == 15
+    tb = TimeBase.join([TimeBase(0, 10, 1000, offset=-0.5),
+                        TimeBase(10, 5, 1000, offset=-0.5)])
+    assert isinstance(tb, TimeBase) and tb[14] == 0.014 - 0.5
+    assert np.allclose(tb[2:4], [-0.498, -0.497])
+
+
+@pytest.mark.emulator(realtime=False)
+def test_read(emu):
+    with AnalogIn(channel=0, rate=10*kHz) as ai:
+        ai.read(1234)
+        data, times = ai.read(100*ms, times=True)
+    assert isinstance(times, TimeBase)
+    assert len(times) == len(data) == 1000
+    assert np.allclose(times, np.arange(1234, 2234) / 10000)
+
+
+@pytest.mark.emulator(realtime=False)
+def test_emptyread(emu, monkeypatch):
+    with AnalogIn(channel=0, rate=10*kHz) as ai:
+        ai.read(1000)
+        monkeypatch.setattr(ai.dev.reader, "hasadata", lambda: False)
+        data, times = ai.readall(times=True)
+    assert len(data) == 0
+    assert isinstance(times, TimeBase)
+    assert times.shape == (0,) and times.start == 1000